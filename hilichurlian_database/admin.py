@@ -1,19 +1,38 @@
 from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.urls import path
 from django.shortcuts import render, redirect
 from django.forms import ModelForm
-from .models import Speaker, Source, Word, CompleteUtterance
+from .models import Speaker, Source, Word, CompleteUtterance, BulkUpdateSelection
+from .ingest import send_data_changed
+from .pagination import EstimatedCountPaginator
+import secrets
 
 # for logging updates
 from simple_history.admin import SimpleHistoryAdmin
 from simple_history.utils import bulk_update_with_history
 
+### CONSTANTS ###
+
+# selections for bulk updates are kept in the database (models.BulkUpdateSelection; shared by every process), not in the URL,
+# so there is no limit on their size
+MAX_SELECTIONS = 5 # per user; the oldest are dropped
+PREVIEW_PAGE_SIZE = 100
+UPDATE_BATCH_SIZE = 500
+
 ### FORM CLASSES ###
 
 class CompleteUtteranceUpdateForm(ModelForm):
 	class Meta:
 		model = CompleteUtterance
 		fields = CompleteUtterance.BULK_UPDATABLE
+		# search as you type instead of an <option> for every speaker and source
+		widgets = {
+			field_name: AutocompleteSelect(CompleteUtterance._meta.get_field(field_name), admin.site)
+			for field_name in ['speaker', 'source']
+		}
 
 	def __init__(self, *args, **kwargs):
 		super(CompleteUtteranceUpdateForm, self).__init__(*args, **kwargs)
@@ -24,7 +43,32 @@ class CompleteUtteranceUpdateForm(ModelForm):
 
 ### MODEL ADMIN CLASSES ###
 
-class CompleteUtteranceAdmin(SimpleHistoryAdmin):
+# for tables too big to show whole: no COUNT(*) of the whole table, filtered or not (the page links use the planner's estimate)
+# and search_fields start with "^" (istartswith), so the autocomplete widgets use the prefix indexes from migration 0020
+# the autocomplete results are paginated, so the admins that other admins autocomplete from have an ordering
+class ScalableAdmin(SimpleHistoryAdmin):
+	show_full_result_count = False
+	paginator = EstimatedCountPaginator
+
+class SpeakerAdmin(ScalableAdmin):
+	list_display = ('name', 'type')
+	list_filter = ('type',)
+	search_fields = ['^name']
+	ordering = ('name', 'id')
+
+class SourceAdmin(ScalableAdmin):
+	list_display = ('name', 'url', 'version')
+	list_filter = ('version',)
+	search_fields = ['^name', '^url']
+	ordering = ('name', 'id')
+	autocomplete_fields = ['related_sources']
+
+class WordAdmin(ScalableAdmin):
+	search_fields = ['^word']
+	ordering = ('word',)
+	autocomplete_fields = ['variants_same_word', 'variants_grammatical']
+
+class CompleteUtteranceAdmin(ScalableAdmin):
 	# for use when I have a CompleteUtteranceAdmin instance
 	MODEL_CLASS = CompleteUtterance
 	MODEL_NAME = "CompleteUtterance"
@@ -46,12 +90,17 @@ class CompleteUtteranceAdmin(SimpleHistoryAdmin):
 		('Context',				{'fields': ['speaker', 'translation', 'translation_source', 'context', 'source']}),
 	]
 	list_display = ('__str__', 'speaker', 'source')
+	list_select_related = ('speaker', 'source')
+	list_filter = ('source__version', 'speaker__type')
+	search_fields = ['^utterance']
+	autocomplete_fields = ['speaker', 'source', 'words']
 	actions = ['update_multiple_utterances']
 
 	@admin.action(description='Unify attributes for selected complete utterances')
 	def update_multiple_utterances(self, request, queryset):
-		selected = queryset.values_list('pk', flat=True)
-		return redirect("./update_multiple_define?ids=" + ','.join(str(pk) for pk in selected))
+		# in the order of the preview, so that each of its pages is a slice
+		token = save_selection(request, queryset.order_by('source', 'id').values_list('pk', flat=True))
+		return redirect("./update_multiple_define?selection=" + token)
 	
 	# Views (wrappers) for bulk updating
 	def update_multiple_utterances_define(self, request):
@@ -61,23 +110,45 @@ class CompleteUtteranceAdmin(SimpleHistoryAdmin):
 		return update_multiple_execute(self, request)
 
 
+### SELECTION SETS ###
+
+# returns the token for the selection
+def save_selection(request, pks):
+	token = secrets.token_urlsafe(12)
+	BulkUpdateSelection.objects.create(token=token, user=request.user, ids=list(pks))
+	old_tokens = BulkUpdateSelection.objects.filter(user=request.user).order_by('-created', '-token').values_list('token', flat=True)[MAX_SELECTIONS:]
+	BulkUpdateSelection.objects.filter(token__in=list(old_tokens)).delete()
+	return token
+
+# returns the selected pks, or None if the token is unknown (e.g. used up or dropped) or belongs to another user
+def get_selection(request, token):
+	return BulkUpdateSelection.objects.filter(token=token, user=request.user).values_list('ids', flat=True).first()
+
+def forget_selection(request, token):
+	BulkUpdateSelection.objects.filter(token=token, user=request.user).delete()
+
+
 ### VIEWS FOR MULTIPLE MODELS ###
 
 # admin user-facing
 def update_multiple_define(model_admin_instance, request):
 	request.current_app = model_admin_instance.admin_site.name
 	req = request.GET
-	id_list = req.get('ids', "").split(",")
-	ids_string = ','.join(str(pk) for pk in id_list)
-	to_update = model_admin_instance.MODEL_CLASS.objects.filter(pk__in=id_list) # QuerySet
+	token = req.get('selection', "")
+	id_list = get_selection(request, token) or []
+	# one page of the selection at a time: only its slice of the ids, with speakers and sources in the same query
+	preview_page = Paginator(id_list, PREVIEW_PAGE_SIZE).get_page(req.get('page', 1))
+	page_ids = list(preview_page.object_list)
+	utterances = model_admin_instance.MODEL_CLASS.objects.select_related('speaker', 'source').in_bulk(page_ids)
+	preview_page.object_list = [ utterances[pk] for pk in page_ids if pk in utterances ]
 	context = dict(
 		# from doc: common variables for rendering the admin template
 		model_admin_instance.admin_site.each_context(request),
 		# specific to app
 		model_name = model_admin_instance.MODEL_NAME,
-		id_list = id_list,
-		ids_string = ids_string,
-		objects_to_update = to_update,
+		selection = token,
+		selected_count = len(id_list),
+		objects_to_update = preview_page,
 		form = CompleteUtteranceUpdateForm(),
 	)
 	return render(request, "admin/specify-bulk-update.html", context)
@@ -89,10 +160,8 @@ def update_multiple_execute(model_admin_instance, request):
 		# initialize parameters
 		model_class = model_admin_instance.MODEL_CLASS
 		data = request.POST
-		ids = data["ids"].split(",")
+		ids = get_selection(request, data.get("selection", ""))
 		field_values_to_update = {} # will have strings galore
-		objects_to_update_set = model_class.objects.filter(pk__in=ids) # QuerySet
-		objects_to_update_list = []
 
 		# check for only the bulk updatable fields
 		for field_name in model_class.BULK_UPDATABLE:
@@ -101,31 +170,39 @@ def update_multiple_execute(model_admin_instance, request):
 		if not field_values_to_update:
 			messages.error(request, "No fields selected")
 			return redirect(admin_reverse)
-
-		# updating objects...
-		for obj in objects_to_update_set:
-			for field_name, field_value in field_values_to_update.items():
-				setattr(obj, field_name, field_value)
-			objects_to_update_list.append(obj)
-		if len(objects_to_update_list) == 0:
+		if not ids:
 			messages.error(request, "No objects selected")
 			return redirect(admin_reverse)
-		
+		# the strings are primary keys for ForeignKeys, so set speaker_id etc.
+		attnames = { field_name: model_class._meta.get_field(field_name).attname for field_name in field_values_to_update }
+
 		# chop list for reason in history if it's too long
 		string_list_of_fields = str(list(field_values_to_update.keys()))
 		if len(string_list_of_fields) > 75:
 			string_list_of_fields = string_list_of_fields[:75]
 
-		# update objects!
-		bulk_update_with_history(
-			objects_to_update_list,
-			model_class,
-			list( field_values_to_update.keys() ),
-			default_change_reason = "Bulk update of " + string_list_of_fields,
-		)
-		
+		# update objects! one chunk in memory at a time
+		updated = 0
+		with transaction.atomic():
+			for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+				objects_to_update_list = list(model_class.objects.filter(pk__in=ids[start:start + UPDATE_BATCH_SIZE]))
+				for obj in objects_to_update_list:
+					for field_name, field_value in field_values_to_update.items():
+						setattr(obj, attnames[field_name], field_value)
+				bulk_update_with_history(
+					objects_to_update_list,
+					model_class,
+					list( field_values_to_update.keys() ),
+					batch_size = UPDATE_BATCH_SIZE,
+					default_change_reason = "Bulk update of " + string_list_of_fields,
+				)
+				updated += len(objects_to_update_list)
+			# bulk_update() sends no signals
+			transaction.on_commit(send_data_changed)
+		forget_selection(request, data["selection"])
+
 		# make somewhat human-readable confirmation message
-		update_message = 'Updated ' + str(len(objects_to_update_list)) + ' ' + str(model_admin_instance.MODEL_NAME) + ' instances in bulk by unifying the following values: ' + str(field_values_to_update)
+		update_message = 'Updated ' + str(updated) + ' ' + str(model_admin_instance.MODEL_NAME) + ' instances in bulk by unifying the following values: ' + str(field_values_to_update)
 		messages.success(request, update_message)
 	else:
 		messages.error(request, "No data received")
@@ -134,7 +211,7 @@ def update_multiple_execute(model_admin_instance, request):
 
 ### ADMIN SITE MODEL REGISTRATION ###
 
-admin.site.register(Speaker, SimpleHistoryAdmin)
-admin.site.register(Source, SimpleHistoryAdmin)
-admin.site.register(Word, SimpleHistoryAdmin)
+admin.site.register(Speaker, SpeakerAdmin)
+admin.site.register(Source, SourceAdmin)
+admin.site.register(Word, WordAdmin)
 admin.site.register(CompleteUtterance, CompleteUtteranceAdmin)
\ No newline at end of file
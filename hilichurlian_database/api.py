@@ -0,0 +1,234 @@
+from django.db import models
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+from django.http import HttpResponse, JsonResponse
+from .models import Speaker, Source, Word
+from .search import SearchCriteria, OrderedUtterances, table_utterances
+from .caching import cached_search, public_data_condition
+from .pagination import KEYSET_ORDERINGS, KeysetPaginator, NumberedPaginator
+from . import export
+import base64
+import json
+
+# read-only JSON API
+# utterances are the same flat rows as the JSON Lines export (export.utterance_row()), searched like the /filter page
+# words, sources and speakers are listed in primary key order with cursors, and every endpoint has a batch form (?ids= or ?words=)
+# every response takes a fixed number of queries, however many entries or related objects are in it
+
+### CONSTANTS ###
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 1000
+CONTENT_TYPE = "application/json"
+
+
+### HELPER FUNCTIONS ###
+
+# rows are dicts of JSON types; the page is joined from the encoded rows, since most of the work is per row
+def encode_rows(rows):
+	return "[" + ",".join(json.dumps(row, ensure_ascii=False, separators=(',', ':')) for row in rows) + "]"
+
+# extra is a dict of other top-level values (already JSON types)
+def rows_response(rows, **extra):
+	body = '{"results":' + encode_rows(rows)
+	for (name, value) in extra.items():
+		body += ',' + json.dumps(name) + ':' + json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+	return HttpResponse(body + "}", content_type=CONTENT_TYPE)
+
+def error_response(message, status=400):
+	return JsonResponse({ "error": message }, status=status)
+
+# returns the page size, or None if it is not valid
+def get_page_size(req):
+	try:
+		page_size = int(req.get('pageSize', DEFAULT_PAGE_SIZE))
+	except ValueError:
+		return None
+	return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+# comma-separated values of a batch parameter; returns None if there are too many
+def get_batch(req, name):
+	values = [ value.strip() for value in req.get(name, "").split(",") if value.strip() ]
+	if len(values) > MAX_BATCH_SIZE:
+		return None
+	return values
+
+def get_batch_ids(req):
+	values = get_batch(req, 'ids')
+	if values is None:
+		return None
+	try:
+		return [ int(value) for value in values ]
+	except ValueError:
+		return None
+
+# cursors for entry_page(): the last primary key of the previous page (an int, or a string for words)
+def encode_entry_cursor(pk):
+	return base64.urlsafe_b64encode(json.dumps(pk).encode()).decode().rstrip("=")
+
+# returns None if the cursor is not valid for model
+def decode_entry_cursor(cursor, model):
+	try:
+		pk = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+	except ValueError:
+		return None
+	if isinstance(model._meta.pk, models.AutoField):
+		# bool is an int too, but not a primary key
+		valid = isinstance(pk, int) and not isinstance(pk, bool)
+	else:
+		valid = isinstance(pk, str)
+	return pk if valid else None
+
+def utterance_rows(utterances):
+	utterances = list(utterances)
+	prefetch_related_objects(utterances, export.words_prefetch())
+	return [ export.utterance_row(utterance) for utterance in utterances ]
+
+def word_row(word):
+	return {
+		'word': word.word,
+		'variants_same_word': [ variant.word for variant in word.variants_same_word.all() ],
+		'variants_grammatical': [ variant.word for variant in word.variants_grammatical.all() ],
+		'same_word_group': word.same_word_group,
+		'grammatical_group': word.grammatical_group,
+	}
+
+def source_row(source):
+	return {
+		'id': source.id,
+		'name': source.name,
+		'url': source.url,
+		'version': source.version,
+		'related_sources': [ related.id for related in source.related_sources.all() ],
+	}
+
+def speaker_row(speaker):
+	return {
+		'id': speaker.id,
+		'name': speaker.name,
+		'type': speaker.type,
+	}
+
+# each model: (queryset with everything its rows need, row function)
+def entry_listing(model):
+	if model is Word:
+		variants = Word.objects.only('word').order_by('word')
+		queryset = Word.objects.only('word', 'same_word_group', 'grammatical_group').prefetch_related(
+			Prefetch('variants_same_word', queryset=variants),
+			Prefetch('variants_grammatical', queryset=variants),
+		)
+		return (queryset, word_row)
+	if model is Source:
+		return (Source.objects.prefetch_related(Prefetch('related_sources', queryset=Source.objects.only('id').order_by('id'))), source_row)
+	return (Speaker.objects.all(), speaker_row)
+
+# one page in primary key order; the cursor is the last primary key of the previous page
+def entry_page(model, req):
+	page_size = get_page_size(req)
+	if page_size is None:
+		return error_response("pageSize must be a number")
+	(queryset, row) = entry_listing(model)
+	queryset = queryset.order_by('pk')
+	cursor = req.get('cursor', "")
+	if cursor:
+		after = decode_entry_cursor(cursor, model)
+		if after is None:
+			return error_response("cursor is not valid")
+		queryset = queryset.filter(pk__gt=after)
+	entries = list(queryset[:page_size + 1])
+	next_cursor = None
+	if len(entries) > page_size:
+		entries = entries[:page_size]
+		next_cursor = encode_entry_cursor(entries[-1].pk)
+	return rows_response([ row(entry) for entry in entries ], next=next_cursor)
+
+def entry_batch(model, req):
+	if model is Word:
+		keys = get_batch(req, 'words')
+	else:
+		keys = get_batch_ids(req)
+	if keys is None:
+		return error_response("At most " + str(MAX_BATCH_SIZE) + " comma-separated " + ("words" if model is Word else "ids"))
+	(queryset, row) = entry_listing(model)
+	found = queryset.in_bulk(keys)
+	# in the order asked for, without the ones that do not exist
+	return rows_response([ row(found[key]) for key in dict.fromkeys(keys) if key in found ], missing=[ key for key in keys if key not in found ])
+
+
+### VIEWS ###
+
+# the /api/utterances endpoint: same criteria as /filter
+# criteria that are not in the database are ignored like on /filter (and listed in "nonexistent"),
+# but if none of the criteria exist, there are no results (instead of every utterance)
+@public_data_condition
+def utterances(request):
+	req = request.GET
+	page_size = get_page_size(req)
+	if page_size is None:
+		return error_response("pageSize must be a number")
+	criteria = SearchCriteria.from_querydict(req)
+	nonexistent = {}
+	ordered = table_utterances().order_by('source', 'id')
+	if criteria.has_criteria():
+		(search, ordered) = cached_search(criteria)
+		nonexistent = search.nonexistent_values
+		if ordered is None:
+			return rows_response([], next=None, previous=None, nonexistent=nonexistent)
+	# the export row also needs the speaker's type
+	if isinstance(ordered, QuerySet):
+		ordered = ordered.only(*export.EXPORT_FIELDS)
+	else:
+		ordered = OrderedUtterances(ordered.ids, table_utterances().only(*export.EXPORT_FIELDS))
+
+	if isinstance(ordered, QuerySet) and tuple(ordered.query.order_by) in KEYSET_ORDERINGS:
+		# no count; the cursors continue from the last row
+		page = KeysetPaginator(ordered, page_size).get_page(req.get('cursor', ""))
+		return rows_response(
+			utterance_rows(page),
+			next = page.next_cursor or None,
+			previous = page.previous_cursor or None,
+			nonexistent = nonexistent,
+		)
+	# ranked or cached results: numbered pages of a list of ids
+	paginator = NumberedPaginator(ordered, page_size)
+	page = paginator.get_page(req.get('page', 1))
+	return rows_response(
+		utterance_rows(page),
+		count = paginator.count,
+		page = page.number,
+		num_pages = paginator.num_pages,
+		nonexistent = nonexistent,
+	)
+
+@public_data_condition
+def utterance_batch(request):
+	ids = get_batch_ids(request.GET)
+	if ids is None:
+		return error_response("At most " + str(MAX_BATCH_SIZE) + " comma-separated ids")
+	found = table_utterances().only(*export.EXPORT_FIELDS).in_bulk(ids)
+	rows = utterance_rows([ found[utt_id] for utt_id in dict.fromkeys(ids) if utt_id in found ])
+	return rows_response(rows, missing=[ utt_id for utt_id in ids if utt_id not in found ])
+
+@public_data_condition
+def words(request):
+	return entry_page(Word, request.GET)
+
+@public_data_condition
+def word_batch(request):
+	return entry_batch(Word, request.GET)
+
+@public_data_condition
+def sources(request):
+	return entry_page(Source, request.GET)
+
+@public_data_condition
+def source_batch(request):
+	return entry_batch(Source, request.GET)
+
+@public_data_condition
+def speakers(request):
+	return entry_page(Speaker, request.GET)
+
+@public_data_condition
+def speaker_batch(request):
+	return entry_batch(Speaker, request.GET)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class HilichurlianDatabaseConfig(AppConfig):
 	name = 'hilichurlian_database'
+
+	def ready(self):
+		# connect the signal receivers that keep the in-memory search index, the caches, and the variant groups fresh
+		from . import search_index
+		from . import caching
+		from . import variants
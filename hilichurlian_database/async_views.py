@@ -0,0 +1,110 @@
+from django.shortcuts import render
+from .models import Speaker, Source, Word, CompleteUtterance
+from .search import SearchCriteria, table_utterances, alist
+from .caching import acached_search, acached_fragment, public_data_condition
+from .pagination import aget_paginator, requested_page
+from .views import DEFAULT_PAGE_SIZE, ENTRY_FIELDS, database_public_view_context, generate_message, report_search, criteria_lists, criteria_lists_html
+import asyncio
+
+# async versions of the public read views in views.py, for ASGI servers (asgi.py with settings.ASYNC_VIEWS; see urls.py)
+# the same pages and the same queries, but every query goes through the async ORM, and independent queries are awaited together
+# under WSGI, the sync views are faster: each async view would need its own event loop
+# the pages are rendered in the event loop, since everything they show is fetched first and none of them read the session
+
+### VIEWS FOR USERS ###
+
+@public_data_condition
+async def index(request):
+	req = request.GET
+	# initialize parameters
+	render_page = "hilichurlian_database/index.html"
+	page = req.get('page', 1)
+	page_size = req.get('pageSize', DEFAULT_PAGE_SIZE)
+	if int(page_size) < 1:
+		page_size = 1
+	if int(page) > 1 or req.get('cursor'):
+		# go away, big home page blurb
+		render_page = "hilichurlian_database/results.html"
+	paging = await aget_paginator(table_utterances().order_by('source', 'id'), page_size, req)
+	db_page = await paging.aget_page(requested_page(paging, req))
+	return render(
+		request,
+		render_page,
+		database_public_view_context(paging, None, page_size, db_page=db_page)
+	)
+
+# general
+async def view_entry(request, entry_queryset, entry_type):
+	render_page = "hilichurlian_database/entry.html"
+	order = ENTRY_FIELDS[entry_type]
+
+	context = {"type": entry_type}
+	# the same queries as views.view_entry()
+	entry = await entry_queryset.model.with_related(entry_queryset, order).afirst()
+	if entry:
+		context["entry"] = entry
+		context["entry_values"] = entry.get_fields_as_dict(order)
+
+	return render(request, render_page, context)
+
+@public_data_condition
+async def view_utterance(request, id):
+	return await view_entry(request, CompleteUtterance.objects.filter(id=id), "utterance")
+
+@public_data_condition
+async def view_word(request, word):
+	return await view_entry(request, Word.objects.filter(pk=word), "word")
+
+@public_data_condition
+async def view_source(request, id):
+	return await view_entry(request, Source.objects.filter(id=id), "source")
+
+@public_data_condition
+async def view_speaker(request, id):
+	return await view_entry(request, Speaker.objects.filter(id=id), "speaker")
+
+# for searching
+@public_data_condition
+async def filter(request):
+	req = request.GET
+	# initialize general parameters
+	page_size = req.get('pageSize', DEFAULT_PAGE_SIZE)
+	if int(page_size) < 1:
+		page_size = 1
+	new_search = req.get('newSearch', "")
+
+	# the words, speaker and source are looked up at the same time (see search.alookup_existing())
+	(search, ordered_utterances) = await acached_search(SearchCriteria.from_querydict(req))
+	search_messages = []
+	if search.nonexistent_values:
+		search_messages.append(generate_message("invalid criteria found", search.nonexistent_values))
+
+	search_values = search.search_values
+	has_results = False
+	if search_values:
+		paging = await aget_paginator(ordered_utterances, page_size, req)
+		has_results = await paging.ahas_results()
+	if not has_results:
+		# show everything instead
+		paging = await aget_paginator(table_utterances().order_by('source', 'id'), page_size, req)
+
+	# add message with info about search
+	search_messages += report_search(search_values, has_results, new_search)
+
+	db_page = await paging.aget_page(requested_page(paging, req))
+	return render(
+		request,
+		"hilichurlian_database/results.html",
+		database_public_view_context(paging, None, page_size, search, search_messages, db_page=db_page)
+	)
+
+# the /select page; the three lists are fetched at the same time
+@public_data_condition
+async def view_all_criteria(request):
+	return render(request, "hilichurlian_database/select.html", {
+		'criteria_lists': await acached_fragment("select", render_criteria_lists),
+	})
+
+async def render_criteria_lists():
+	(speakers, sources, words) = await asyncio.gather(*[ alist(queryset) for queryset in criteria_lists() ])
+	return criteria_lists_html(speakers, sources, words)
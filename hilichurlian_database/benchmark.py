@@ -0,0 +1,196 @@
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Source, Word, CompleteUtterance
+from .pagination import encode_cursor
+from . import ingest
+from . import search_index
+from . import variants
+import random
+import statistics
+import time
+import tracemalloc
+
+# synthetic corpora and timings of the public views, for manage.py benchmark
+# the corpus is built with the bulk paths in ingest.py, so that 100k utterances take minutes, not hours
+
+### CONSTANTS ###
+
+SCALES = { "1k": 1000, "10k": 10000, "100k": 100000 }
+SYLLABLES = ["ya", "mi", "mo", "nye", "da", "gu", "sha", "ka", "ba", "ye", "pupu", "unu", "olah", "celi", "upa", "lata", "mosi", "kundala"]
+VERSIONS = [ version for (version, label) in Source.VERSIONS ]
+# (name, url name, args, GET parameters); placeholders such as "first utterance" are filled in by resolve_scenario()
+SCENARIOS = [
+	("index", "index", [], {}),
+	("deep page", "view", [], { "page": "last", "pageSize": 20 }),
+	("deep cursor page", "view", [], { "cursor": "middle", "pageSize": 20 }),
+	("filter words", "filter", [], { "words": "common words", "pageSize": 20 }),
+	("filter words similar", "filter", [], { "words": "common words", "similar": "yes", "pageSize": 20 }),
+	("view utterance", "utterance", ["first utterance"], {}),
+	("view word", "word", ["common word"], {}),
+	("view all criteria", "select", [], {}),
+]
+
+
+### CORPUS ###
+
+# a word from one to three syllables, Zipf-like so that some words are very common
+def make_vocabulary(rng, size):
+	words = set()
+	while len(words) < size:
+		words.add("".join(rng.choice(SYLLABLES) for i in range(rng.choice([1, 1, 2, 2, 3]))))
+	return sorted(words)
+
+# symmetrical ManyToMany rows in both directions, like add() would make
+def symmetrical_links(through, from_field, to_field, pairs):
+	links = set()
+	for (a, b) in pairs:
+		if a != b:
+			links.add((a, b))
+			links.add((b, a))
+	through.objects.bulk_create(
+		[ through(**{ from_field: a, to_field: b }) for (a, b) in sorted(links) ],
+		batch_size = ingest.DEFAULT_BATCH_SIZE,
+		ignore_conflicts = True,
+	)
+
+# num_utterances utterances with about one word per five utterances, one speaker per 50 and one source per 20
+# words have elongated forms and grammatical variants; sources have related sources
+def generate_corpus(num_utterances, seed=0, log=None):
+	rng = random.Random(seed)
+	vocabulary = make_vocabulary(rng, max(50, num_utterances // 5))
+	weights = [ 1.0 / (rank + 1) for rank in range(len(vocabulary)) ]
+	rng.shuffle(weights)
+	num_speakers = max(5, num_utterances // 50)
+	num_sources = max(5, num_utterances // 20)
+	speakers = [ ("Speaker " + str(i), rng.choice(["hili", "hili", "hili", "stud", "unkn"])) for i in range(num_speakers) ]
+	sources = [ ("https://genshin-impact.fandom.com/wiki/Source_" + str(i), rng.choice(VERSIONS)) for i in range(num_sources) ]
+
+	rows = []
+	for i in range(num_utterances):
+		words = rng.choices(vocabulary, weights, k=rng.randint(1, 6))
+		if rng.random() < 0.1:
+			# elongated
+			index = rng.randrange(len(words))
+			words[index] = words[index] + words[index][-1] * rng.randint(1, 3)
+		(speaker, speaker_type) = rng.choice(speakers)
+		(url, version) = rng.choice(sources)
+		rows.append({
+			'utterance': " ".join(words).capitalize() + rng.choice([".", "!", "?", "..."]),
+			'speaker': speaker,
+			'speaker_type': speaker_type,
+			'translation': "Translation " + str(i) if rng.random() < 0.3 else "",
+			'translation_source': "Item " + str(i % 40) if rng.random() < 0.3 else "",
+			'context': "Context for utterance " + str(i) + ".\nMore context." if rng.random() < 0.5 else "",
+			'source': "",
+			'source_url': url,
+			'version': version,
+		})
+	start = time.monotonic()
+	for batch_start in range(0, len(rows), ingest.DEFAULT_BATCH_SIZE):
+		with transaction.atomic():
+			ingest.import_batch(rows[batch_start:batch_start + ingest.DEFAULT_BATCH_SIZE])
+		if log:
+			log("Imported " + str(min(batch_start + ingest.DEFAULT_BATCH_SIZE, len(rows))) + " utterances in " + str(round(time.monotonic() - start, 1)) + " s")
+
+	# variant clusters: elongated forms are the same word, reduplicated forms are grammatical variants
+	words = set(Word.objects.values_list('word', flat=True))
+	same_word_pairs = []
+	grammatical_pairs = []
+	for word in words:
+		for length in range(1, len(word)):
+			if word[:length] in words and set(word[length:]) == {word[length - 1]}:
+				same_word_pairs.append((word, word[:length]))
+		if len(word) % 2 == 0 and word[:len(word) // 2] * 2 == word and word[:len(word) // 2] in words:
+			grammatical_pairs.append((word, word[:len(word) // 2]))
+	symmetrical_links(variants.SAME_WORD_VARIANTS, 'from_word_id', 'to_word_id', same_word_pairs)
+	symmetrical_links(variants.GRAMMATICAL_VARIANTS, 'from_word_id', 'to_word_id', grammatical_pairs)
+	source_ids = list(Source.objects.values_list('id', flat=True))
+	related_pairs = [ (source_id, rng.choice(source_ids)) for source_id in source_ids if rng.random() < 0.3 ]
+	symmetrical_links(Source.related_sources.through, 'from_source_id', 'to_source_id', related_pairs)
+	variants.rebuild_all()
+	ingest.send_data_changed()
+
+
+### TIMINGS ###
+
+# replaces the placeholders in SCENARIOS with values from the corpus
+def resolve_scenario(url_name, args, params):
+	common_words = list(
+		CompleteUtterance.words.through.objects.values('word_id').annotate(uses=Count('id')).order_by('-uses').values_list('word_id', flat=True)[:2]
+	)
+	values = {
+		"first utterance": CompleteUtterance.objects.order_by('id').values_list('id', flat=True).first(),
+		"common word": common_words[0],
+		"common words": " ".join(common_words),
+	}
+	args = [ values.get(arg, arg) for arg in args ]
+	params = { name: values.get(value, value) for (name, value) in params.items() }
+	if params.get("page") == "last":
+		params["page"] = max(1, CompleteUtterance.objects.count() // int(params["pageSize"]))
+	if params.get("cursor") == "middle":
+		# a cursor halfway through, like following "next" from the first page
+		middle = CompleteUtterance.objects.order_by('source_id', 'id').values_list('source_id', 'id')[CompleteUtterance.objects.count() // 2]
+		params["cursor"] = encode_cursor("next", middle[0], middle[1])
+	return (reverse("hilichurlian_database:" + url_name, args=args), params)
+
+def clear_caches():
+	caches["search"].clear()
+	search_index.mark_stale()
+
+# one request; returns (status, queries, seconds)
+def timed_request(client, url, params):
+	with CaptureQueriesContext(connection) as queries:
+		start = time.perf_counter()
+		response = client.get(url, params)
+		if response.streaming:
+			b"".join(response.streaming_content)
+		seconds = time.perf_counter() - start
+	return (response.status_code, len(queries), seconds)
+
+# returns { scenario name: measurements }; the first request of each scenario is cold (empty caches), the rest warm
+def run_scenarios(repeat=5):
+	client = Client()
+	results = {}
+	for (name, url_name, args, params) in SCENARIOS:
+		(url, params) = resolve_scenario(url_name, args, params)
+		clear_caches()
+		(status, cold_queries, cold_seconds) = timed_request(client, url, params)
+		warm = [ timed_request(client, url, params) for i in range(repeat) ]
+		# memory separately, since tracemalloc slows everything down
+		clear_caches()
+		tracemalloc.start()
+		client.get(url, params)
+		(current, peak) = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		results[name] = {
+			"url": url,
+			"params": params,
+			"status": status,
+			"cold_queries": cold_queries,
+			"cold_ms": round(cold_seconds * 1000, 2),
+			"warm_queries": max(queries for (status, queries, seconds) in warm),
+			"warm_median_ms": round(statistics.median(seconds for (status, queries, seconds) in warm) * 1000, 2),
+			"warm_min_ms": round(min(seconds for (status, queries, seconds) in warm) * 1000, 2),
+			"peak_kib": round(peak / 1024, 1),
+		}
+	return results
+
+# returns a list of messages for the scenarios that got worse than baseline (same structure as run_scenarios())
+# more queries are always a regression; times are compared with a tolerance, since they are noisy
+def find_regressions(results, baseline, tolerance=0.25):
+	regressions = []
+	for (name, result) in results.items():
+		if name not in baseline:
+			continue
+		before = baseline[name]
+		for measure in ["cold_queries", "warm_queries"]:
+			if result[measure] > before[measure]:
+				regressions.append(name + ": " + measure + " " + str(before[measure]) + " -> " + str(result[measure]))
+		for measure in ["cold_ms", "warm_median_ms", "peak_kib"]:
+			if result[measure] > before[measure] * (1 + tolerance):
+				regressions.append(name + ": " + measure + " " + str(before[measure]) + " -> " + str(result[measure]))
+	return regressions
@@ -0,0 +1,33 @@
+from django.core.cache.backends.filebased import FileBasedCache
+import os
+
+# Django's file-based cache culls random entries when it is full
+# this one culls the least recently used entries instead (like the local-memory cache does)
+# every hit touches the file, so a file's modification time is its last use
+
+class LRUFileBasedCache(FileBasedCache):
+	def get(self, key, default=None, version=None):
+		value = super().get(key, default, version)
+		if value is not default:
+			try:
+				os.utime(self._key_to_file(key, version))
+			except FileNotFoundError:
+				pass
+		return value
+
+	def _cull(self):
+		filelist = self._list_cache_files()
+		num_entries = len(filelist)
+		if num_entries < self._max_entries:
+			return # return early if no culling is required
+		if self._cull_frequency == 0:
+			return self.clear() # clear the cache when CULL_FREQUENCY = 0
+		# delete the least recently used entries
+		def last_used(fname):
+			try:
+				return os.path.getmtime(fname)
+			except FileNotFoundError:
+				return 0
+		filelist.sort(key=last_used)
+		for fname in filelist[:int(num_entries / self._cull_frequency)]:
+			self._delete(fname)
@@ -0,0 +1,248 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from .models import DataVersion
+from .search import SearchCriteria, compile_search, lookup_existing, alookup_existing, OrderedUtterances
+from .signals import connect_data_changed
+from . import search_index
+from functools import wraps
+import asyncio
+import hashlib
+import json
+
+# caches for the public read path
+# every cache key includes the data version, which is bumped whenever the public data changes,
+# so that stale entries are never read and are left for the cache's LRU eviction
+# the version is a row in the database (models.DataVersion), so that a change made by any process (another worker,
+# a management command) reaches every worker; each one reads it again at most every settings.DATA_VERSION_MAX_AGE seconds
+# it is read from the database the request reads everything else from (see routers.py), and kept separately for each database,
+# so that what a request caches under a version is what that version is on every database
+# the async views call the caches directly too: they are in local memory or local files, so a thread for each call would cost more
+
+### CONSTANTS ###
+
+SEARCH_CACHE = "search" # alias in settings.CACHES
+ROW_CACHE = "rows" # alias in settings.CACHES
+DATA_VERSION_KEY = "data-version" # + database alias: (version, modified) of the DataVersion row there, kept for DATA_VERSION_MAX_AGE
+DATA_VERSION_MAX_AGE = getattr(settings, 'DATA_VERSION_MAX_AGE', 2) # seconds
+RELEASE_ID = str(getattr(settings, 'RELEASE_ID', ""))
+# pages rendered before this process started may have come from other code, so they are never "not modified" since then
+STARTED = timezone.now()
+# searches with more results than this are not cached (and are paged with cursors instead; see pagination.py)
+MAX_CACHED_IDS = 10000
+ROW_TEMPLATE = "hilichurlian_database/elements/table-row.html"
+
+
+### FUNCTIONS ###
+
+def data_version_key(alias):
+	return DATA_VERSION_KEY + ":" + alias
+
+# (version, modified) of the public data, on the database that this request reads from
+def get_data_state():
+	alias = router.db_for_read(DataVersion)
+	state = caches[SEARCH_CACHE].get(data_version_key(alias))
+	if state is None:
+		state = data_state_from_row(DataVersion.objects.using(alias).filter(pk=1).values_list('version', 'modified').first())
+		caches[SEARCH_CACHE].set(data_version_key(alias), state, timeout=DATA_VERSION_MAX_AGE)
+	return state
+
+async def aget_data_state():
+	alias = router.db_for_read(DataVersion)
+	state = caches[SEARCH_CACHE].get(data_version_key(alias))
+	if state is None:
+		state = data_state_from_row(await DataVersion.objects.using(alias).filter(pk=1).values_list('version', 'modified').afirst())
+		caches[SEARCH_CACHE].set(data_version_key(alias), state, timeout=DATA_VERSION_MAX_AGE)
+	return state
+
+# if the row is missing (it is made by migration 0021), now is the safe answer for when the data changed:
+# clients revalidate more than needed, and never see stale pages
+def data_state_from_row(row):
+	if row is None:
+		return (1, timezone.now())
+	return row
+
+def get_data_version():
+	return get_data_state()[0]
+
+def get_data_modified():
+	return get_data_state()[1]
+
+# after the change is committed, so that no process can cache data from before the commit under the new version
+def bump_data_version():
+	now = timezone.now()
+	if not DataVersion.objects.filter(pk=1).update(version=F('version') + 1, modified=now):
+		DataVersion.objects.create(pk=1, version=2, modified=now)
+	# the replicas get it later; until then they keep serving (and caching) the version they have
+	caches[SEARCH_CACHE].delete(data_version_key(router.db_for_write(DataVersion)))
+
+# the state for this request, read once so that its ETag, Last-Modified and cache keys agree
+# the async views read it first with the async ORM (see public_data_condition())
+def request_data_state(request):
+	if not hasattr(request, 'data_state'):
+		request.data_state = get_data_state()
+	return request.data_state
+
+# a rendered piece of a page that depends only on the public data; render_fragment() is called on a miss
+def cached_fragment(name, render_fragment):
+	cache = caches[SEARCH_CACHE]
+	key = "fragment:" + name + ":" + str(get_data_version())
+	fragment = cache.get(key)
+	if fragment is None:
+		fragment = render_fragment()
+		cache.set(key, fragment)
+	return fragment
+
+# the same for async views; arender_fragment() is a coroutine function
+async def acached_fragment(name, arender_fragment):
+	cache = caches[SEARCH_CACHE]
+	key = "fragment:" + name + ":" + str((await aget_data_state())[0])
+	fragment = cache.get(key)
+	if fragment is None:
+		fragment = await arender_fragment()
+		cache.set(key, fragment)
+	return fragment
+
+# for django.views.decorators.http.condition(): pages that depend only on the public data and the code (templates, views)
+# at most the query for the data version, so a conditional GET is answered with 304 Not Modified before the view runs
+def data_version_etag(request, *args, **kwargs):
+	return "data-" + RELEASE_ID + "-" + str(request_data_state(request)[0])
+
+def data_last_modified(request, *args, **kwargs):
+	return max(request_data_state(request)[1], STARTED)
+
+sync_public_data_condition = condition(etag_func=data_version_etag, last_modified_func=data_last_modified)
+
+# the pages are the same for every visitor (they never read the session), so shared caches such as a CDN may keep them
+# for settings.PUBLIC_CACHE_MAX_AGE seconds, then revalidate with the ETag (which is answered without the database)
+def public_cache_control(response):
+	patch_cache_control(response, public=True, max_age=getattr(settings, 'PUBLIC_CACHE_MAX_AGE', 0))
+	return response
+
+# decorator for the public read views: ETag and Last-Modified, and 304 Not Modified for If-None-Match and If-Modified-Since
+# condition() only wraps sync views in this version of Django, so async views get the same checks around an empty response
+def public_data_condition(view):
+	if not asyncio.iscoroutinefunction(view):
+		conditional_view = sync_public_data_condition(view)
+
+		@wraps(view)
+		def sync_inner(request, *args, **kwargs):
+			return public_cache_control(conditional_view(request, *args, **kwargs))
+		return sync_inner
+	check = sync_public_data_condition(lambda request, *args, **kwargs: HttpResponse())
+
+	@wraps(view)
+	async def inner(request, *args, **kwargs):
+		request.data_state = await aget_data_state()
+		checked = check(request, *args, **kwargs)
+		if checked.status_code != 200:
+			# 304 Not Modified or 412 Precondition Failed
+			return public_cache_control(checked)
+		response = await view(request, *args, **kwargs)
+		for header in ("ETag", "Last-Modified"):
+			if checked.has_header(header) and not response.has_header(header):
+				response.headers[header] = checked.headers[header]
+		return public_cache_control(response)
+	return inner
+
+# the key of a rendered table row is a hash of everything the row shows (the utterance and its speaker and source)
+# so it changes whenever any of them does, and needs no invalidation or data version
+def row_cache_key(utterance):
+	shown = [
+		utterance.id, utterance.utterance, utterance.translation, utterance.translation_source, utterance.context,
+		utterance.speaker.name, utterance.source.name, utterance.source.url, utterance.source.version,
+	]
+	return "row:" + hashlib.sha1(json.dumps(shown).encode()).hexdigest()
+
+# utterances are from search.table_utterances() (speaker and source already joined)
+# returns the rendered cells of each row (elements/table-row.html), in order; one cache fetch for the page, and templates only for misses
+def rendered_rows(utterances):
+	cache = caches[ROW_CACHE]
+	utterances = list(utterances)
+	keys = [ row_cache_key(utterance) for utterance in utterances ]
+	rows = cache.get_many(keys)
+	missing = {}
+	for (key, utterance) in zip(keys, utterances):
+		if key not in rows and key not in missing:
+			missing[key] = get_template(ROW_TEMPLATE).render({ 'utt': utterance })
+	if missing:
+		cache.set_many(missing)
+		rows.update(missing)
+	return [ rows[key] for key in keys ]
+
+# same key for the same search, whatever the order or duplicates of the words
+# version is from get_data_version()
+def search_cache_key(criteria, version):
+	normalized = [sorted(set(criteria.words)), bool(criteria.similar), criteria.speaker, criteria.source, criteria.text, criteria.speaker_like, criteria.source_like]
+	digest = hashlib.sha1(json.dumps(normalized).encode()).hexdigest()
+	return "search:" + str(version) + ":" + digest
+
+# returns (CompiledSearch, ordered utterances for the paginator or None if no criteria exist)
+# a cache hit needs no queries until the page is fetched
+def cached_search(criteria):
+	key = search_cache_key(criteria, get_data_version())
+	cached = caches[SEARCH_CACHE].get(key)
+	if cached is not None:
+		search = compile_search(criteria, cached["existing"])
+		return (search, OrderedUtterances(cached["ids"]))
+
+	existing = lookup_existing(criteria)
+	search = compile_search(criteria, existing)
+	if not search.has_criteria():
+		# nothing to search for; the caller shows everything instead
+		return (search, None)
+	ordered = search.ordered_utterances()
+	if isinstance(ordered, OrderedUtterances):
+		ids = ordered.ids
+	else:
+		ids = list(ordered.values_list('id', flat=True)[:MAX_CACHED_IDS + 1])
+	return (search, store_search(key, existing, ordered, ids))
+
+# the same with the async ORM
+async def acached_search(criteria):
+	key = search_cache_key(criteria, (await aget_data_state())[0])
+	cached = caches[SEARCH_CACHE].get(key)
+	if cached is not None:
+		search = compile_search(criteria, cached["existing"])
+		return (search, OrderedUtterances(cached["ids"]))
+
+	existing = await alookup_existing(criteria)
+	search = compile_search(criteria, existing)
+	if not search.has_criteria():
+		return (search, None)
+	if search_index.is_enabled():
+		# may (re)build the in-memory index, which is sync
+		ordered = await sync_to_async(search.ordered_utterances)()
+	else:
+		ordered = search.ordered_utterances()
+	if isinstance(ordered, OrderedUtterances):
+		ids = ordered.ids
+	else:
+		ids = [ utt_id async for utt_id in ordered.values_list('id', flat=True)[:MAX_CACHED_IDS + 1] ]
+	return (search, store_search(key, existing, ordered, ids))
+
+# ids are those of ordered, up to MAX_CACHED_IDS + 1 of them if ordered is a QuerySet
+# returns the ordered utterances for the paginator
+def store_search(key, existing, ordered, ids):
+	if not isinstance(ordered, OrderedUtterances):
+		if len(ids) > MAX_CACHED_IDS:
+			return ordered
+		ordered = OrderedUtterances(ids)
+	caches[SEARCH_CACHE].set(key, { "existing": existing, "ids": ids })
+	return ordered
+
+
+### SIGNALS ###
+
+# once per change, not once per transaction: each is one cheap UPDATE, and a flag to skip the rest could not be cleared on rollback
+def public_data_changed(sender, **kwargs):
+	transaction.on_commit(bump_data_version)
+
+connect_data_changed(public_data_changed, "caching")
@@ -0,0 +1,80 @@
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+from .models import Word, CompleteUtterance
+from .search import OrderedUtterances, table_utterances
+import csv
+import json
+
+# streaming export of utterances as CSV or JSON Lines
+# rows are generated a chunk at a time (related rows joined or prefetched per chunk), so memory stays constant whatever the corpus size
+
+### CONSTANTS ###
+
+FORMATS = {
+	# format: (content type, file extension)
+	"csv": ("text/csv; charset=utf-8", "csv"),
+	"jsonl": ("application/jsonl; charset=utf-8", "jsonl"),
+}
+EXPORT_FIELDS = CompleteUtterance.TABLE_FIELDS + ['speaker__type']
+COLUMNS = ['id', 'utterance', 'words', 'speaker', 'speaker_type', 'translation', 'translation_source', 'context', 'source', 'source_url', 'version']
+DEFAULT_CHUNK_SIZE = 2000
+
+
+### CLASSES ###
+
+# for csv.writer: hands back each line instead of storing it
+class Echo:
+	def write(self, value):
+		return value
+
+
+### FUNCTIONS ###
+
+def words_prefetch():
+	return Prefetch('words', queryset=Word.objects.only('word').order_by('word'))
+
+# ordered is a QuerySet or search.OrderedUtterances (from CompiledSearch.ordered_utterances()), or None for every utterance
+def iter_utterances(ordered=None, chunk_size=DEFAULT_CHUNK_SIZE):
+	if ordered is None:
+		ordered = table_utterances().order_by('source', 'id')
+	if isinstance(ordered, QuerySet):
+		# keeps the ordering (and ranking) of the search; the words are prefetched per chunk
+		utterances = ordered.only(*EXPORT_FIELDS).prefetch_related(words_prefetch())
+		yield from utterances.iterator(chunk_size=chunk_size)
+		return
+	ordered = OrderedUtterances(ordered.ids, table_utterances().only(*EXPORT_FIELDS))
+	for start in range(0, len(ordered), chunk_size):
+		chunk = ordered[start:start + chunk_size]
+		prefetch_related_objects(chunk, words_prefetch())
+		yield from chunk
+
+def utterance_row(utterance):
+	return {
+		'id': utterance.id,
+		'utterance': utterance.utterance,
+		'words': [ word.word for word in utterance.words.all() ],
+		'speaker': utterance.speaker.name,
+		'speaker_type': utterance.speaker.type,
+		'translation': utterance.translation,
+		'translation_source': utterance.translation_source,
+		'context': utterance.context,
+		'source': utterance.source.name,
+		'source_url': utterance.source.url,
+		'version': utterance.source.version,
+	}
+
+def csv_lines(utterances):
+	writer = csv.writer(Echo())
+	yield writer.writerow(COLUMNS)
+	for utterance in utterances:
+		row = utterance_row(utterance)
+		row['words'] = " ".join(row['words'])
+		yield writer.writerow([ row[column] for column in COLUMNS ])
+
+def jsonl_lines(utterances):
+	for utterance in utterances:
+		yield json.dumps(utterance_row(utterance), ensure_ascii=False, separators=(',', ':')) + "\n"
+
+def export_lines(export_format, utterances):
+	if export_format == "csv":
+		return csv_lines(utterances)
+	return jsonl_lines(utterances)
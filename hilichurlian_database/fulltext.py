@@ -0,0 +1,56 @@
+from django.db import connections
+from django.db.models import Q
+
+# English full-text search (translation, translation source, context) and fuzzy speaker and source names
+# PostgreSQL: ranked full-text search and trigram similarity, both backed by GIN indexes (see migration 0018)
+# anything else (e.g. SQLite for local work): case-insensitive substring matches, unranked
+# django.contrib.postgres needs psycopg2, so it is only imported when the database is PostgreSQL
+
+### CONSTANTS ###
+
+TEXT_SEARCH_CONFIG = "english"
+# the GIN indexes in migration 0018 are built from the same expressions (written out there), so the planner can use them
+UTTERANCE_TEXT_FIELDS = [("translation", "A"), ("translation_source", "B"), ("context", "C")]
+SPEAKER_FUZZY_FIELDS = ["name"]
+SOURCE_FUZZY_FIELDS = ["name", "url"]
+
+
+### FUNCTIONS ###
+
+def is_postgresql(using="default"):
+	return connections[using].vendor == "postgresql"
+
+# the weighted tsvector of an utterance's English text
+def utterance_search_vector():
+	from django.contrib.postgres.search import SearchVector
+	vector = None
+	for (field_name, weight) in UTTERANCE_TEXT_FIELDS:
+		field_vector = SearchVector(field_name, weight=weight, config=TEXT_SEARCH_CONFIG)
+		vector = field_vector if vector is None else vector + field_vector
+	return vector
+
+# returns (filtered utterances, whether they are ordered by rank)
+def filter_text(utterances, text):
+	if is_postgresql(utterances.db):
+		from django.contrib.postgres.search import SearchQuery, SearchRank
+		query = SearchQuery(text, search_type="websearch", config=TEXT_SEARCH_CONFIG)
+		vector = utterance_search_vector()
+		# @@ against the indexed expression, then ranked
+		matches = utterances.alias(text_vector=vector).filter(text_vector=query)
+		return (matches.annotate(text_rank=SearchRank(vector, query)), True)
+	words_q = Q()
+	for text_word in text.split():
+		any_field = Q()
+		for (field_name, weight) in UTTERANCE_TEXT_FIELDS:
+			any_field |= Q(**{ field_name + "__icontains": text_word })
+		words_q &= any_field
+	return (utterances.filter(words_q), False)
+
+# Q object for utterances whose related model (prefix is "speaker" or "source") has a field similar to value
+def fuzzy_q(prefix, field_names, value, using="default"):
+	# trigram_similar is registered by django.contrib.postgres (added to INSTALLED_APPS on PostgreSQL) and uses the % operator, which the GIN indexes support
+	lookup = "__trigram_similar" if is_postgresql(using) else "__icontains"
+	fuzzy = Q()
+	for field_name in field_names:
+		fuzzy |= Q(**{ prefix + "__" + field_name + lookup: value })
+	return fuzzy
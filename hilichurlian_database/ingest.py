@@ -0,0 +1,180 @@
+from django.db import IntegrityError, transaction
+from simple_history.utils import bulk_create_with_history
+from .models import Speaker, Source, Word, CompleteUtterance
+from .signals import data_changed
+from .templatetags.describe_url import describe_url
+from .tokenizer import tokenize, normalize
+from . import variants
+
+# set-based creation of utterances and their words, for manage.py import_utterances and the submission form
+# a constant number of queries per batch, however many rows, words, speakers or sources are in it
+# bulk_create() sends no model signals, so this module does what the signal receivers would have done:
+# history rows (simple_history), the derived Word fields (variants.py), and data_changed (search index and caches)
+
+### CONSTANTS ###
+
+UTTERANCE_WORDS = CompleteUtterance.words.through
+DEFAULT_BATCH_SIZE = 1000
+# same names as the export columns (export.COLUMNS), so an export can be imported; id and words are ignored
+IMPORT_COLUMNS = ['utterance', 'speaker', 'speaker_type', 'translation', 'translation_source', 'context', 'source', 'source_url', 'version']
+REQUIRED_COLUMNS = ['utterance', 'speaker', 'source_url']
+DEFAULT_SPEAKER_TYPE = "unkn"
+
+
+### CLASSES ###
+
+class InvalidRow(ValueError):
+	pass
+
+
+### FUNCTIONS ###
+
+# creates the words that are not in the database yet; returns the new words (strings)
+def create_missing_words(words, batch_size=DEFAULT_BATCH_SIZE):
+	words = set(words)
+	if not words:
+		return []
+	while True:
+		existing = set(Word.objects.filter(word__in=words).values_list('word', flat=True))
+		new_words = [
+			# a new word is in a component by itself until refresh_components() finds its other forms (see variants.set_derived_fields())
+			Word(word=word, normalized=normalize(word), same_word_group=word, grammatical_group=word)
+			for word in sorted(words - existing)
+		]
+		try:
+			# all or none, so that the history is only for the words created here
+			with transaction.atomic():
+				Word.objects.bulk_create(new_words, batch_size=batch_size)
+			break
+		except IntegrityError:
+			# another import or submission created some of them since; they are not new anymore
+			pass
+	if new_words:
+		Word.object_history.bulk_history_create(new_words, batch_size=batch_size)
+		variants.refresh_components([ word.word for word in new_words ])
+	return [ word.word for word in new_words ]
+
+# utterances must be saved; adds the words in each utterance's text
+# returns (the new words, the number of links added)
+def link_words(utterances, batch_size=DEFAULT_BATCH_SIZE):
+	utterance_words = { utterance.pk: set(tokenize(utterance.utterance)) for utterance in utterances }
+	new_words = create_missing_words(set().union(*utterance_words.values()), batch_size)
+	links = [
+		UTTERANCE_WORDS(completeutterance_id=utterance_id, word_id=word)
+		for (utterance_id, words) in utterance_words.items()
+		for word in sorted(words)
+	]
+	UTTERANCE_WORDS.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+	return (new_words, len(links))
+
+# utterances is a list of (id, utterance text); makes their word links match tokenize() again (e.g. after it changes)
+# only the differences are written: one query for the current links, then the missing words, inserts and deletes in bulk
+# returns (the new words, the number of links added, the number of links removed)
+def relink_words(utterances, batch_size=DEFAULT_BATCH_SIZE):
+	wanted = { (utterance_id, word) for (utterance_id, text) in utterances for word in tokenize(text) }
+	current = {}
+	for (link_id, utterance_id, word) in UTTERANCE_WORDS.objects.filter(completeutterance_id__in=[ utterance_id for (utterance_id, text) in utterances ]).values_list('id', 'completeutterance_id', 'word_id'):
+		current[(utterance_id, word)] = link_id
+	added = wanted - set(current)
+	removed = [ current[link] for link in set(current) - wanted ]
+	new_words = create_missing_words({ word for (utterance_id, word) in added }, batch_size)
+	UTTERANCE_WORDS.objects.bulk_create(
+		[ UTTERANCE_WORDS(completeutterance_id=utterance_id, word_id=word) for (utterance_id, word) in sorted(added) ],
+		batch_size = batch_size,
+		ignore_conflicts = True,
+	)
+	for start in range(0, len(removed), batch_size):
+		UTTERANCE_WORDS.objects.filter(id__in=removed[start:start + batch_size]).delete()
+	return (new_words, len(added), len(removed))
+
+# for the submission form: utterance is unsaved, with its speaker and source set
+# save() as usual (signals and history), then all of its words with one IN query, one bulk insert and one add()
+# so the cost does not depend on the number of words, and a failure leaves no utterance without its words
+def create_utterance(utterance):
+	with transaction.atomic():
+		utterance.save()
+		words = set(tokenize(utterance.utterance))
+		create_missing_words(words)
+		utterance.words.add(*words)
+	return utterance
+
+# rows are dicts with IMPORT_COLUMNS; creates the speakers that are not in the database
+# returns ({ speaker name: Speaker }, the number of new speakers)
+def resolve_speakers(rows, batch_size=DEFAULT_BATCH_SIZE):
+	speaker_types = {}
+	for row in rows:
+		speaker_types.setdefault(row['speaker'], row.get('speaker_type') or DEFAULT_SPEAKER_TYPE)
+	speakers = {}
+	# names are not unique; use the first speaker with the name, like get_or_create() would (if it did not raise)
+	for speaker in Speaker.objects.filter(name__in=speaker_types).order_by('-id'):
+		speakers[speaker.name] = speaker
+	new_speakers = [ Speaker(name=name, type=speaker_type) for (name, speaker_type) in speaker_types.items() if name not in speakers ]
+	if new_speakers:
+		for speaker in bulk_create_with_history(new_speakers, Speaker, batch_size=batch_size):
+			speakers[speaker.name] = speaker
+	return (speakers, len(new_speakers))
+
+# rows are dicts with IMPORT_COLUMNS; creates the sources that are not in the database
+# returns ({ URL: Source }, the number of new sources)
+def resolve_sources(rows, batch_size=DEFAULT_BATCH_SIZE):
+	new_sources = {}
+	for row in rows:
+		new_sources.setdefault(row['source_url'], row)
+	sources = {}
+	for source in Source.objects.filter(url__in=new_sources).order_by('-id'):
+		sources[source.url] = source
+	new_sources = [
+		# same defaults as the submission form
+		Source(url=url, name=row.get('source') or describe_url(url), version=row.get('version', ""))
+		for (url, row) in new_sources.items() if url not in sources
+	]
+	for source in new_sources:
+		if not source.version:
+			raise InvalidRow("New source " + source.url + " needs a version")
+	if new_sources:
+		for source in bulk_create_with_history(new_sources, Source, batch_size=batch_size):
+			sources[source.url] = source
+	return (sources, len(new_sources))
+
+# line_number is only for the error message
+def clean_row(row, line_number):
+	row = { column: str(row.get(column) or "").strip() for column in IMPORT_COLUMNS }
+	for column in REQUIRED_COLUMNS:
+		if not row[column]:
+			raise InvalidRow("Line " + str(line_number) + ": " + column + " is required")
+	if row['speaker_type'] and row['speaker_type'] not in dict(Speaker.SPEAKER_TYPES):
+		raise InvalidRow("Line " + str(line_number) + ": unknown speaker type " + row['speaker_type'])
+	if row['version'] and row['version'] not in dict(Source.VERSIONS):
+		raise InvalidRow("Line " + str(line_number) + ": unknown version " + row['version'])
+	return row
+
+# rows are clean (see clean_row()); call inside a transaction
+# returns the numbers of created utterances, words, word links, speakers and sources
+def import_batch(rows, batch_size=DEFAULT_BATCH_SIZE, change_reason=""):
+	(speakers, new_speakers) = resolve_speakers(rows, batch_size)
+	(sources, new_sources) = resolve_sources(rows, batch_size)
+	utterances = [
+		CompleteUtterance(
+			utterance = row['utterance'],
+			speaker = speakers[row['speaker']],
+			translation = row['translation'],
+			translation_source = row['translation_source'],
+			context = row['context'],
+			source = sources[row['source_url']],
+		)
+		for row in rows
+	]
+	# the primary keys are needed for the words; PostgreSQL and SQLite 3.35+ return them from the insert
+	utterances = bulk_create_with_history(utterances, CompleteUtterance, batch_size=batch_size, default_change_reason=change_reason)
+	(new_words, links) = link_words(utterances, batch_size)
+	return {
+		'utterances': len(utterances),
+		'words': len(new_words),
+		'links': links,
+		'speakers': new_speakers,
+		'sources': new_sources,
+	}
+
+# after bulk changes are committed: refresh the search index and caches
+def send_data_changed():
+	data_changed.send(sender=CompleteUtterance)
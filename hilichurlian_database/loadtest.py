@@ -0,0 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+import http.client
+import random
+import re
+import threading
+import time
+
+# load generator for manage.py loadtest: a weighted mix of public pages, requested by a pool of threads
+# against a running server (see the command for starting one on a synthetic corpus)
+# no Django imports, so that it measures only the server
+
+### CONSTANTS ###
+
+# endpoint: weight
+DEFAULT_MIX = { "home": 20, "page": 30, "search": 30, "entry": 20 }
+ENDPOINTS = list(DEFAULT_MIX)
+PERCENTILES = [50, 95, 99]
+TIMEOUT = 30 # seconds per request
+SEARCH_LINK_RE = re.compile(r'href="(/filter\?[^"]+)"')
+WORD_LINK_RE = re.compile(r'href="/filter\?words=([^"]+)"')
+UTTERANCE_LINK_RE = re.compile(r'href="(/utterance/\d+)"')
+
+
+### CLASSES ###
+
+# the URLs of each kind of endpoint, found by crawling the site like a visitor would
+class TrafficMix:
+	def __init__(self, weights, search_links, entry_links, max_page):
+		self.endpoints = [ endpoint for endpoint in ENDPOINTS if weights.get(endpoint, 0) > 0 ]
+		self.weights = [ weights[endpoint] for endpoint in self.endpoints ]
+		self.search_links = search_links
+		self.entry_links = entry_links
+		self.max_page = max_page
+
+	# returns (endpoint, path)
+	def pick(self, rng):
+		endpoint = rng.choices(self.endpoints, self.weights)[0]
+		if endpoint == "home":
+			return (endpoint, "/")
+		if endpoint == "page":
+			return (endpoint, "/view?page=" + str(rng.randint(2, self.max_page)))
+		if endpoint == "search":
+			return (endpoint, rng.choice(self.search_links))
+		return (endpoint, rng.choice(self.entry_links))
+
+class Recorder:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.latencies = { endpoint: [] for endpoint in ENDPOINTS }
+		self.errors = { endpoint: 0 for endpoint in ENDPOINTS }
+
+	def record(self, endpoint, seconds, ok):
+		with self.lock:
+			self.latencies[endpoint].append(seconds)
+			if not ok:
+				self.errors[endpoint] += 1
+
+
+### FUNCTIONS ###
+
+# "home=20,page=30" -> { "home": 20, "page": 30 }; raises ValueError
+def parse_mix(text):
+	weights = {}
+	for part in text.split(","):
+		(endpoint, weight) = part.split("=")
+		endpoint = endpoint.strip()
+		if endpoint not in ENDPOINTS:
+			raise ValueError("Unknown endpoint " + endpoint + " (expected one of " + ", ".join(ENDPOINTS) + ")")
+		weights[endpoint] = float(weight)
+	if not any(weight > 0 for weight in weights.values()):
+		raise ValueError("Every weight is 0")
+	return weights
+
+# nearest-rank percentile of sorted values
+def percentile(sorted_values, percent):
+	if not sorted_values:
+		return None
+	rank = max(1, -(-len(sorted_values) * percent // 100)) # ceiling
+	return sorted_values[int(rank) - 1]
+
+# one keep-alive connection per worker; reconnects when the server closes it
+class Client:
+	def __init__(self, base_url, host_header=""):
+		url = urlsplit(base_url)
+		self.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=TIMEOUT)
+		self.headers = { "Host": host_header } if host_header else {}
+
+	# returns (status, body); raises OSError or http.client.HTTPException
+	def get(self, path):
+		for attempt in range(2):
+			try:
+				self.connection.request("GET", path, headers=self.headers)
+				response = self.connection.getresponse()
+				body = response.read()
+				if response.will_close:
+					self.connection.close()
+				return (response.status, body)
+			except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+				self.connection.close()
+				if attempt:
+					raise
+
+	def close(self):
+		self.connection.close()
+
+# the links on /select (searches and words) and on the first pages of the table (utterances)
+def discover_mix(base_url, weights, host_header="", max_page=50):
+	client = Client(base_url, host_header)
+	(status, select) = client.get("/select")
+	if status != 200:
+		raise ValueError("/select returned " + str(status))
+	select = select.decode()
+	search_links = [ link.replace("&amp;", "&") for link in SEARCH_LINK_RE.findall(select) ]
+	entry_links = [ "/word/" + word for word in WORD_LINK_RE.findall(select) ]
+	for page in range(1, 4):
+		(status, table) = client.get("/view?" + urlencode({ "page": page }))
+		entry_links += UTTERANCE_LINK_RE.findall(table.decode())
+	client.close()
+	if not search_links or not entry_links:
+		raise ValueError("Found no links to follow on " + base_url + "; is there a corpus?")
+	return TrafficMix(weights, search_links, entry_links, max_page)
+
+# runs for duration seconds with concurrency threads, each sending one request at a time
+def run_load(base_url, mix, concurrency=4, duration=30, host_header="", seed=0):
+	recorder = Recorder()
+	deadline = time.monotonic() + duration
+
+	def worker(worker_number):
+		rng = random.Random(seed * 1000 + worker_number)
+		client = Client(base_url, host_header)
+		while time.monotonic() < deadline:
+			(endpoint, path) = mix.pick(rng)
+			start = time.perf_counter()
+			try:
+				(status, body) = client.get(path)
+				ok = status == 200
+			except (OSError, http.client.HTTPException):
+				client.close()
+				ok = False
+			recorder.record(endpoint, time.perf_counter() - start, ok)
+		client.close()
+
+	start = time.monotonic()
+	with ThreadPoolExecutor(max_workers=concurrency) as pool:
+		list(pool.map(worker, range(concurrency)))
+	return summarize(recorder, time.monotonic() - start)
+
+# { "elapsed_s", "requests", "requests_per_s", "endpoints": { endpoint: { "requests", "errors", "requests_per_s", "p50_ms", ... } } }
+def summarize(recorder, elapsed):
+	endpoints = {}
+	for endpoint in ENDPOINTS:
+		latencies = sorted(recorder.latencies[endpoint])
+		if not latencies:
+			continue
+		summary = {
+			"requests": len(latencies),
+			"errors": recorder.errors[endpoint],
+			"requests_per_s": round(len(latencies) / elapsed, 2),
+		}
+		for percent in PERCENTILES:
+			summary["p" + str(percent) + "_ms"] = round(percentile(latencies, percent) * 1000, 2)
+		summary["max_ms"] = round(latencies[-1] * 1000, 2)
+		endpoints[endpoint] = summary
+	total = sum(summary["requests"] for summary in endpoints.values())
+	return {
+		"elapsed_s": round(elapsed, 2),
+		"requests": total,
+		"errors": sum(summary["errors"] for summary in endpoints.values()),
+		"requests_per_s": round(total / elapsed, 2),
+		"endpoints": endpoints,
+	}
+
+# plain-text table of summarize() results
+def format_report(label, report):
+	columns = ["requests", "errors", "requests_per_s"] + [ "p" + str(percent) + "_ms" for percent in PERCENTILES ] + ["max_ms"]
+	lines = [
+		label + ": " + str(report["requests"]) + " requests in " + str(report["elapsed_s"]) + " s, "
+		+ str(report["requests_per_s"]) + " requests/s, " + str(report["errors"]) + " errors",
+		"{:<10}".format("endpoint") + "".join("{:>16}".format(column) for column in columns),
+	]
+	for (endpoint, summary) in report["endpoints"].items():
+		lines.append("{:<10}".format(endpoint) + "".join("{:>16}".format(summary[column]) for column in columns))
+	return "\n".join(lines)
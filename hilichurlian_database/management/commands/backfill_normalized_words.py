@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from hilichurlian_database.models import Word
+from hilichurlian_database.tokenizer import normalize
+from hilichurlian_database import ingest, variants
+
+# fill in Word.normalized in bulk (e.g. after tokenizer.normalize() changes), then regroup the variants
+class Command(BaseCommand):
+	help = "Recompute Word.normalized for every word in bulk, then the variant groups that depend on it."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		changed = []
+		for (word, normalized) in Word.objects.values_list('word', 'normalized').iterator(chunk_size=options['batch_size']):
+			if normalize(word) != normalized:
+				changed.append(word)
+		for start in range(0, len(changed), options['batch_size']):
+			batch = [ Word(word=word, normalized=normalize(word)) for word in changed[start:start + options['batch_size']] ]
+			# bulk_update() so that no history is recorded for a derived field
+			Word.objects.bulk_update(batch, ['normalized'])
+		self.stdout.write("Normalized " + str(len(changed)) + " words")
+		regrouped = variants.rebuild_all()
+		if changed or regrouped:
+			# bulk_update() and update() send no signals; searches match by these columns
+			ingest.send_data_changed()
+		self.stdout.write(self.style.SUCCESS("Updated the variant groups of " + str(regrouped) + " words"))
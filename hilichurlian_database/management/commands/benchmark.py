@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils import timezone
+from hilichurlian_database import benchmark
+import json
+
+# builds a synthetic corpus in a throwaway test database (never the real one) and times the public views with the test client
+# compare runs with --baseline, e.g. the output of the same command before a change
+class Command(BaseCommand):
+	help = "Time the public views against a synthetic corpus and write the results as JSON."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--scale', choices=list(benchmark.SCALES), default='1k', help="Number of utterances")
+		parser.add_argument('--seed', type=int, default=0)
+		parser.add_argument('--repeat', type=int, default=5, help="Warm requests per view")
+		parser.add_argument('--output', help="JSON file to write the results to (default: standard output)")
+		parser.add_argument('--baseline', help="JSON file from an earlier run; regressions make the command fail")
+		parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before a time counts as a regression (0.25 is 25%%)")
+
+	def handle(self, *args, **options):
+		baseline = None
+		if options['baseline']:
+			with open(options['baseline'], encoding='utf-8') as baseline_file:
+				baseline = json.load(baseline_file)
+			if baseline.get('scale') != options['scale']:
+				raise CommandError("The baseline is for scale " + str(baseline.get('scale')) + ", not " + options['scale'])
+
+		setup_test_environment(debug=False)
+		old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+		try:
+			self.stderr.write("Building a corpus of " + options['scale'] + " utterances...")
+			benchmark.generate_corpus(benchmark.SCALES[options['scale']], options['seed'], log=self.stderr.write if options['verbosity'] > 1 else None)
+			self.stderr.write("Timing the views...")
+			results = benchmark.run_scenarios(options['repeat'])
+			vendor = connection.vendor
+		finally:
+			teardown_databases(old_config, verbosity=0)
+			teardown_test_environment()
+
+		report = {
+			'scale': options['scale'],
+			'utterances': benchmark.SCALES[options['scale']],
+			'seed': options['seed'],
+			'repeat': options['repeat'],
+			'database': vendor,
+			'date': timezone.now().isoformat(),
+			'results': results,
+		}
+		output = json.dumps(report, indent=2)
+		if options['output']:
+			with open(options['output'], 'w', encoding='utf-8') as output_file:
+				output_file.write(output + "\n")
+		else:
+			self.stdout.write(output)
+
+		if baseline:
+			regressions = benchmark.find_regressions(results, baseline['results'], options['tolerance'])
+			if regressions:
+				raise CommandError("Regressions:\n" + "\n".join(regressions))
+			self.stderr.write(self.style.SUCCESS("No regressions"))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from hilichurlian_database import export
+from hilichurlian_database.search import SearchCriteria, compile_search
+from hilichurlian_database.tokenizer import tokenize
+import sys
+
+# same output as the /export/<format> pages
+class Command(BaseCommand):
+	help = "Write every utterance (or the results of a search) as CSV or JSON Lines."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--format', choices=list(export.FORMATS), default='csv')
+		parser.add_argument('--output', help="File to write to (default: standard output)")
+		parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+		# search criteria, like /filter
+		parser.add_argument('--words', default="")
+		parser.add_argument('--similar', action='store_true')
+		parser.add_argument('--speaker', default="")
+		parser.add_argument('--source', default="")
+		parser.add_argument('--text', default="")
+		parser.add_argument('--speaker-like', default="")
+		parser.add_argument('--source-like', default="")
+
+	def handle(self, *args, **options):
+		criteria = SearchCriteria(
+			words = tokenize(options['words']),
+			similar = "yes" if options['similar'] else "",
+			speaker = options['speaker'],
+			source = options['source'],
+			text = options['text'],
+			speaker_like = options['speaker_like'],
+			source_like = options['source_like'],
+		)
+		ordered = None # everything
+		if criteria.has_criteria():
+			search = compile_search(criteria)
+			if search.nonexistent_values:
+				self.stderr.write("Not in the database: " + str(search.nonexistent_values))
+			if not search.has_criteria():
+				raise CommandError("Nothing to export")
+			ordered = search.ordered_utterances()
+
+		output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+		count = 0
+		try:
+			for line in export.export_lines(options['format'], export.iter_utterances(ordered, options['chunk_size'])):
+				output.write(line)
+				count += 1
+		finally:
+			if options['output']:
+				output.close()
+		if options['output']:
+			if options['format'] == 'csv':
+				count -= 1 # header
+			self.stderr.write(self.style.SUCCESS("Exported " + str(count) + " utterances to " + options['output']))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from hilichurlian_database.models import CompleteUtterance
+from hilichurlian_database import benchmark
+
+# the synthetic corpus of manage.py benchmark, written to the configured database (e.g. a scratch SQLite file for manage.py loadtest)
+class Command(BaseCommand):
+	help = "Fill an empty database with a synthetic corpus."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--scale', choices=list(benchmark.SCALES), default='1k', help="Number of utterances")
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		if CompleteUtterance.objects.exists():
+			raise CommandError("The database already has utterances; use an empty database")
+		benchmark.generate_corpus(benchmark.SCALES[options['scale']], options['seed'], log=self.stderr.write if options['verbosity'] > 1 else None)
+		self.stdout.write(self.style.SUCCESS("Generated " + str(CompleteUtterance.objects.count()) + " utterances"))
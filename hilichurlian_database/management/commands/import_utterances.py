@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from hilichurlian_database import ingest
+import contextlib
+import csv
+import itertools
+import json
+import time
+
+# load many utterances at once, e.g. from a new game version
+# reads the same columns that manage.py export_utterances writes (see ingest.IMPORT_COLUMNS)
+# each batch is one transaction with a constant number of queries (see ingest.py)
+class Command(BaseCommand):
+	help = "Add utterances from a CSV or JSON Lines file, creating their speakers, sources and words as needed."
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help="CSV (with a header row) or JSON Lines file")
+		parser.add_argument('--format', choices=['csv', 'jsonl'], help="Default: from the file extension")
+		parser.add_argument('--batch-size', type=int, default=ingest.DEFAULT_BATCH_SIZE)
+		parser.add_argument('--change-reason', default="Bulk import", help="Recorded in the history of every new utterance")
+		parser.add_argument('--dry-run', action='store_true', help="Roll back instead of saving")
+
+	def read_rows(self, path, file_format):
+		with open(path, encoding='utf-8', newline='') as input_file:
+			if file_format == 'csv':
+				# line 1 is the header
+				for (line_number, row) in enumerate(csv.DictReader(input_file), start=2):
+					yield (line_number, row)
+			else:
+				for (line_number, line) in enumerate(input_file, start=1):
+					if not line.strip():
+						continue
+					try:
+						row = json.loads(line)
+					except ValueError:
+						row = None
+					if not isinstance(row, dict):
+						raise ingest.InvalidRow("Line " + str(line_number) + ": not a JSON object")
+					yield (line_number, row)
+
+	def handle(self, *args, **options):
+		file_format = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json')) else 'csv')
+		batch_size = options['batch_size']
+		if batch_size < 1:
+			raise CommandError("--batch-size must be at least 1")
+
+		totals = { 'utterances': 0, 'words': 0, 'links': 0, 'speakers': 0, 'sources': 0 }
+		start_time = time.monotonic()
+		rows = self.read_rows(options['path'], file_format)
+		# dry run: every batch in one transaction that is rolled back at the end
+		# otherwise: each batch is committed, so that a bad line later in the file does not undo the earlier batches
+		outer = transaction.atomic() if options['dry_run'] else contextlib.nullcontext()
+		try:
+			with outer:
+				while True:
+					batch = [ ingest.clean_row(row, line_number) for (line_number, row) in itertools.islice(rows, batch_size) ]
+					if not batch:
+						break
+					with transaction.atomic():
+						counts = ingest.import_batch(batch, batch_size, options['change_reason'])
+					for (name, count) in counts.items():
+						totals[name] += count
+					if options['verbosity'] > 1:
+						self.stderr.write(str(totals['utterances']) + " utterances, " + self.rate(totals['utterances'], start_time))
+				if options['dry_run']:
+					transaction.set_rollback(True)
+		except ingest.InvalidRow as error:
+			raise CommandError(str(error) + " (after " + str(totals['utterances']) + " utterances" + (", all rolled back)" if options['dry_run'] else ")"))
+		except FileNotFoundError:
+			raise CommandError("No such file: " + options['path'])
+		finally:
+			if totals['utterances'] and not options['dry_run']:
+				ingest.send_data_changed()
+
+		summary = (
+			("Would import " if options['dry_run'] else "Imported ") + str(totals['utterances']) + " utterances"
+			+ " (" + str(totals['speakers']) + " new speakers, " + str(totals['sources']) + " new sources, "
+			+ str(totals['words']) + " new words, " + str(totals['links']) + " word links) in "
+			+ self.rate(totals['utterances'], start_time)
+		)
+		self.stdout.write(self.style.SUCCESS(summary))
+
+	def rate(self, count, start_time):
+		elapsed = time.monotonic() - start_time
+		return "{:.2f} s ({:.0f} rows/s)".format(elapsed, count / elapsed if elapsed > 0 else 0)
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from hilichurlian_database import benchmark
+from hilichurlian_database import loadtest
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# throughput and latency percentiles of one server process for a mix of public pages
+# with --target: against a server that is already running
+# otherwise: builds a synthetic corpus in a scratch SQLite database and starts one gunicorn worker (like the Procfile) for each --server
+class Command(BaseCommand):
+	help = "Load test the public pages and report requests/s and p50/p95/p99 latency per endpoint."
+
+	SERVERS = {
+		# gunicorn arguments after the bind address
+		"wsgi": ["hilichurlian_database_project.wsgi", "--preload"],
+		# needs uvicorn installed
+		"asgi": ["hilichurlian_database_project.asgi", "--worker-class", "uvicorn.workers.UvicornWorker"],
+	}
+	# extra environment variables for each server
+	SERVER_ENV = {
+		"wsgi": {},
+		"asgi": { "ASYNC_VIEWS": "True" },
+	}
+
+	def add_arguments(self, parser):
+		parser.add_argument('--target', help="Base URL of a running server, e.g. http://127.0.0.1:8000")
+		parser.add_argument('--server', choices=["wsgi", "asgi", "both"], default="wsgi", help="Which entry point to start (without --target)")
+		parser.add_argument('--scale', choices=list(benchmark.SCALES), default='1k', help="Corpus size (without --target)")
+		parser.add_argument('--database', help="SQLite file for the corpus (default: a temporary file); reused if it exists")
+		parser.add_argument('--mix', default=",".join(name + "=" + str(weight) for (name, weight) in loadtest.DEFAULT_MIX.items()))
+		parser.add_argument('--concurrency', type=int, default=4)
+		parser.add_argument('--duration', type=float, default=30, help="Seconds per server")
+		parser.add_argument('--host-header', help="Host header to send (default: the first of ALLOWED_HOSTS)")
+		parser.add_argument('--seed', type=int, default=0)
+		parser.add_argument('--output', help="JSON file to write the results to")
+
+	def handle(self, *args, **options):
+		try:
+			weights = loadtest.parse_mix(options['mix'])
+		except ValueError as error:
+			raise CommandError("--mix: " + str(error))
+		host_header = options['host_header'] or (settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else "")
+
+		reports = {}
+		if options['target']:
+			reports["target"] = self.run(options['target'], weights, host_header, options)
+		else:
+			database = options['database'] or os.path.join(tempfile.gettempdir(), "hilichurlian-loadtest-" + options['scale'] + ".sqlite3")
+			env = dict(os.environ, DJANGO_SETTINGS_MODULE="hilichurlian_database_project.settings", DATABASE_URL="sqlite:///" + os.path.abspath(database), LOCAL_WORK="False", DJANGO_DEBUG="False")
+			if not os.path.exists(database):
+				self.stderr.write("Building a corpus of " + options['scale'] + " utterances in " + database + "...")
+				self.manage(env, "migrate", "--no-input")
+				self.manage(env, "generate_corpus", "--scale", options['scale'], "--seed", str(options['seed']))
+			servers = ["wsgi", "asgi"] if options['server'] == "both" else [options['server']]
+			for server in servers:
+				with self.start_server(server, env) as base_url:
+					reports[server] = self.run(base_url, weights, host_header, options)
+
+		for (label, report) in reports.items():
+			self.stdout.write(loadtest.format_report(label, report) + "\n")
+		if options['output']:
+			with open(options['output'], 'w', encoding='utf-8') as output_file:
+				json.dump({ 'mix': weights, 'concurrency': options['concurrency'], 'reports': reports }, output_file, indent=2)
+
+	def run(self, base_url, weights, host_header, options):
+		try:
+			mix = loadtest.discover_mix(base_url, weights, host_header)
+		except (ValueError, OSError) as error:
+			raise CommandError(str(error))
+		self.stderr.write("Sending requests to " + base_url + " for " + str(options['duration']) + " s...")
+		return loadtest.run_load(base_url, mix, options['concurrency'], options['duration'], host_header, options['seed'])
+
+	def manage(self, env, *args):
+		subprocess.run([sys.executable, "manage.py", *args], env=env, cwd=settings.BASE_DIR, check=True)
+
+	# context manager: one worker, like the Procfile; yields the base URL
+	def start_server(self, server, env):
+		command = self
+
+		class RunningServer:
+			def __enter__(self):
+				with socket.socket() as probe:
+					probe.bind(("127.0.0.1", 0))
+					port = probe.getsockname()[1]
+				self.process = subprocess.Popen(
+					[sys.executable, "-m", "gunicorn", "--bind", "127.0.0.1:" + str(port), "--workers", "1", *command.SERVERS[server]],
+					env = dict(env, **command.SERVER_ENV[server]),
+					cwd = settings.BASE_DIR,
+					stdout = subprocess.DEVNULL,
+					stderr = subprocess.DEVNULL,
+				)
+				base_url = "http://127.0.0.1:" + str(port)
+				deadline = time.monotonic() + 30
+				while time.monotonic() < deadline:
+					if self.process.poll() is not None:
+						raise CommandError("The " + server + " server exited (is " + ("uvicorn" if server == "asgi" else "gunicorn") + " installed?)")
+					try:
+						socket.create_connection(("127.0.0.1", port), timeout=1).close()
+						return base_url
+					except OSError:
+						time.sleep(0.2)
+				self.__exit__()
+				raise CommandError("The " + server + " server did not start")
+
+			def __exit__(self, *exc_info):
+				self.process.terminate()
+				self.process.wait()
+
+		return RunningServer()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from hilichurlian_database import ingest, variants
+
+# recompute Word.same_word_group and Word.grammatical_group for every word
+# (they are kept up to date when Words are edited, so this is only needed after changes that skip signals, e.g. raw SQL)
+class Command(BaseCommand):
+	help = "Recompute the transitive closure of word variants (Word.same_word_group and Word.grammatical_group)."
+
+	def handle(self, *args, **options):
+		changed = variants.rebuild_all()
+		if changed:
+			# update() sends no signals; searches match by these groups
+			ingest.send_data_changed()
+		self.stdout.write(self.style.SUCCESS("Updated the variant groups of " + str(changed) + " words"))
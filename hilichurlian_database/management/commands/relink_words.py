@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from hilichurlian_database.models import Word, CompleteUtterance
+from hilichurlian_database import ingest
+import time
+
+# re-tokenize every utterance (e.g. after tokenizer.tokenize() changes) and fix CompleteUtterance.words to match
+# utterances are processed in order of id, one transaction per chunk; if it stops, rerun with --after set to the last id it printed
+class Command(BaseCommand):
+	help = "Recompute the words of every utterance from its text, writing only the links that changed."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=ingest.DEFAULT_BATCH_SIZE)
+		parser.add_argument('--after', type=int, default=0, help="Resume after this utterance id")
+		parser.add_argument('--delete-orphans', action='store_true', help="Then delete the words that are in no utterance")
+
+	def handle(self, *args, **options):
+		chunk_size = options['chunk_size']
+		if chunk_size < 1:
+			raise CommandError("--chunk-size must be at least 1")
+
+		last_id = options['after']
+		totals = { 'utterances': 0, 'words': 0, 'added': 0, 'removed': 0 }
+		start_time = time.monotonic()
+		while True:
+			# keyset, so each chunk costs the same however far along it is
+			chunk = list(CompleteUtterance.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'utterance')[:chunk_size])
+			if not chunk:
+				break
+			with transaction.atomic():
+				(new_words, added, removed) = ingest.relink_words(chunk, chunk_size)
+				if added or removed:
+					transaction.on_commit(ingest.send_data_changed)
+			last_id = chunk[-1][0]
+			totals['utterances'] += len(chunk)
+			totals['words'] += len(new_words)
+			totals['added'] += added
+			totals['removed'] += removed
+			if options['verbosity'] > 0:
+				self.stderr.write(
+					"Up to utterance " + str(last_id) + ": " + str(totals['utterances']) + " utterances, "
+					+ str(totals['added']) + " links added, " + str(totals['removed']) + " removed, " + self.rate(totals['utterances'], start_time)
+				)
+		self.stdout.write(self.style.SUCCESS(
+			"Relinked " + str(totals['utterances']) + " utterances (" + str(totals['words']) + " new words, "
+			+ str(totals['added']) + " links added, " + str(totals['removed']) + " removed) in " + self.rate(totals['utterances'], start_time)
+		))
+
+		if options['delete_orphans']:
+			# delete() rather than a raw delete so that the variant groups and history are kept up to date
+			(deleted, per_model) = Word.objects.filter(completeutterance__isnull=True).delete()
+			self.stdout.write(self.style.SUCCESS("Deleted " + str(per_model.get(Word._meta.label, 0)) + " words that are in no utterance"))
+
+	def rate(self, count, start_time):
+		elapsed = time.monotonic() - start_time
+		return "{:.2f} s ({:.0f} rows/s)".format(elapsed, count / elapsed if elapsed > 0 else 0)
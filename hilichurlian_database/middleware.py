@@ -0,0 +1,187 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+from .routers import request_databases
+from collections import Counter
+from contextvars import ContextVar
+import asyncio
+import json
+import logging
+import time
+
+# opt-in timing of each request (settings.SERVER_TIMING): number of queries, SQL time, template time and view time
+# sent as a Server-Timing header (shown in the browser's developer tools) and logged as one JSON line per request
+# requests slower than settings.SLOW_REQUEST_MS are also logged as warnings, with the statements that ran most often
+# when disabled, Django drops the middleware at startup (MiddlewareNotUsed), so it costs nothing
+# sync and async, so that it does not put the async views (see async_views.py) behind a thread
+
+### CONSTANTS ###
+
+logger = logging.getLogger("hilichurlian_database.timing")
+TOP_STATEMENTS = 5
+
+# the timings of the request being handled (a ContextVar, so that concurrent requests in one process keep their own)
+current_timings = ContextVar("current_timings", default=None)
+
+
+### CLASSES ###
+
+class RequestTimings:
+	def __init__(self):
+		self.queries = 0
+		self.sql_seconds = 0.0
+		self.template_seconds = 0.0
+		self.template_depth = 0 # templates rendered while rendering a template are already counted
+		self.statements = Counter()
+
+	# for connection.execute_wrapper()
+	def record_query(self, execute, sql, params, many, context):
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.sql_seconds += time.perf_counter() - start
+			self.queries += 1
+			self.statements[sql] += 1
+
+class ServerTimingMiddleware:
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		if not getattr(settings, 'SERVER_TIMING', False):
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+		patch_template_render()
+		time_queries()
+		if asyncio.iscoroutinefunction(get_response):
+			# tells Django that __call__ returns a coroutine (like django.utils.deprecation.MiddlewareMixin)
+			self._is_coroutine = asyncio.coroutines._is_coroutine
+
+	def __call__(self, request):
+		if getattr(self, '_is_coroutine', None):
+			return self.__acall__(request)
+		timings = RequestTimings()
+		token = current_timings.set(timings)
+		start = time.perf_counter()
+		try:
+			response = self.get_response(request)
+		finally:
+			current_timings.reset(token)
+		return self.add_timings(request, response, timings, time.perf_counter() - start)
+
+	async def __acall__(self, request):
+		timings = RequestTimings()
+		token = current_timings.set(timings)
+		start = time.perf_counter()
+		try:
+			# the async ORM runs queries in another thread, with its own connections and a copy of this context
+			response = await self.get_response(request)
+		finally:
+			current_timings.reset(token)
+		return self.add_timings(request, response, timings, time.perf_counter() - start)
+
+	def add_timings(self, request, response, timings, view_seconds):
+		response['Server-Timing'] = server_timing_header(timings, view_seconds)
+		log_request(request, response, timings, view_seconds)
+		return response
+
+
+# reads from a replica during public page requests, if there are any (see routers.py)
+class ReplicaMiddleware:
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		if not getattr(settings, 'REPLICA_DATABASES', []):
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+		if asyncio.iscoroutinefunction(get_response):
+			self._is_coroutine = asyncio.coroutines._is_coroutine
+
+	def __call__(self, request):
+		if getattr(self, '_is_coroutine', None):
+			return self.__acall__(request)
+		with request_databases(request):
+			return self.get_response(request)
+
+	async def __acall__(self, request):
+		with request_databases(request):
+			return await self.get_response(request)
+
+
+### FUNCTIONS ###
+
+# for connection.execute_wrapper(); records into the timings of the request being handled, whichever thread runs the query
+def timed_execute(execute, sql, params, many, context):
+	timings = current_timings.get()
+	if timings is None:
+		return execute(sql, params, many, context)
+	return timings.record_query(execute, sql, params, many, context)
+
+def add_query_timer(connection):
+	if timed_execute not in connection.execute_wrappers:
+		connection.execute_wrappers.append(timed_execute)
+
+def connection_opened(sender, connection, **kwargs):
+	add_query_timer(connection)
+
+# every connection of every thread: the ones this thread already has, and every one opened from now on
+# done once, and only when the middleware is enabled
+def time_queries():
+	for connection in connections.all():
+		add_query_timer(connection)
+	connection_created.connect(connection_opened, dispatch_uid="hilichurlian_database.timing")
+
+# time every template rendered through the template backend (render(), render_to_string(), TemplateResponse)
+# done once, and only when the middleware is enabled
+def patch_template_render():
+	if getattr(Template.render, 'is_timed', False):
+		return
+	untimed_render = Template.render
+
+	def render(self, context=None, request=None):
+		timings = current_timings.get()
+		if timings is None:
+			return untimed_render(self, context, request)
+		timings.template_depth += 1
+		start = time.perf_counter()
+		try:
+			return untimed_render(self, context, request)
+		finally:
+			timings.template_depth -= 1
+			if timings.template_depth == 0:
+				timings.template_seconds += time.perf_counter() - start
+
+	render.is_timed = True
+	Template.render = render
+
+def milliseconds(seconds):
+	return round(seconds * 1000, 1)
+
+def server_timing_header(timings, view_seconds):
+	return ", ".join([
+		'db;dur=' + str(milliseconds(timings.sql_seconds)) + ';desc="' + str(timings.queries) + ' queries"',
+		'tpl;dur=' + str(milliseconds(timings.template_seconds)) + ';desc="Templates"',
+		'view;dur=' + str(milliseconds(view_seconds)) + ';desc="View"',
+	])
+
+def log_request(request, response, timings, view_seconds):
+	line = {
+		"method": request.method,
+		"path": request.path,
+		"status": response.status_code,
+		"queries": timings.queries,
+		"sql_ms": milliseconds(timings.sql_seconds),
+		"template_ms": milliseconds(timings.template_seconds),
+		"view_ms": milliseconds(view_seconds),
+	}
+	logger.info(json.dumps(line))
+	if milliseconds(view_seconds) >= getattr(settings, 'SLOW_REQUEST_MS', 500):
+		line["top_statements"] = [
+			{ "count": count, "sql": sql }
+			for (sql, count) in timings.statements.most_common(TOP_STATEMENTS)
+		]
+		logger.warning(json.dumps(line))
@@ -0,0 +1,76 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:00
+# PARTIALLY MANUALLY WRITTEN
+
+from django.db import migrations, models
+
+
+# a copy of variants.compute_groups() as it was when this migration was written (before normalized forms),
+# so that later changes to the app do not change this migration
+# same_word_pairs and grammatical_pairs are iterables of (word, word); returns { word: (same_word_group, grammatical_group) }
+def compute_groups(words, same_word_pairs, grammatical_pairs):
+	# union-find
+	def find(parents, word):
+		root = word
+		while parents[root] != root:
+			root = parents[root]
+		while parents[word] != root: # path compression
+			(parents[word], word) = (root, parents[word])
+		return root
+
+	def union(parents, word_a, word_b):
+		root_a = find(parents, word_a)
+		root_b = find(parents, word_b)
+		if root_a != root_b:
+			# keep the alphabetically first word as the root
+			if root_b < root_a:
+				(root_a, root_b) = (root_b, root_a)
+			parents[root_b] = root_a
+
+	same_word_parents = { word: word for word in words }
+	grammatical_parents = dict(same_word_parents)
+	for (word_a, word_b) in same_word_pairs:
+		union(same_word_parents, word_a, word_b)
+		union(grammatical_parents, word_a, word_b)
+	for (word_a, word_b) in grammatical_pairs:
+		union(grammatical_parents, word_a, word_b)
+	return {
+		word: (find(same_word_parents, word), find(grammatical_parents, word))
+		for word in same_word_parents
+	}
+
+# database already has Word objects and variant relations
+def assign_groups(apps, schema_editor):
+	Word = apps.get_model('hilichurlian_database', 'Word')
+	db_alias = schema_editor.connection.alias
+
+	groups = compute_groups(
+		Word.objects.using(db_alias).values_list('word', flat=True),
+		Word.variants_same_word.through.objects.using(db_alias).values_list('from_word_id', 'to_word_id'),
+		Word.variants_grammatical.through.objects.using(db_alias).values_list('from_word_id', 'to_word_id'),
+	)
+	# every word is new to these fields; update() so that no history is recorded for derived fields
+	words_by_groups = {}
+	for (word, word_groups) in groups.items():
+		words_by_groups.setdefault(word_groups, []).append(word)
+	for ((same_word_group, grammatical_group), words) in words_by_groups.items():
+		Word.objects.using(db_alias).filter(word__in=words).update(same_word_group=same_word_group, grammatical_group=grammatical_group)
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('hilichurlian_database', '0016_alter_historicalsource_url_and_more'),
+	]
+
+	operations = [
+		migrations.AddField(
+			model_name='word',
+			name='same_word_group',
+			field=models.CharField(blank=True, db_index=True, editable=False, help_text='The alphabetically first word that is the same word as this word, directly or through other variants.', max_length=25),
+		),
+		migrations.AddField(
+			model_name='word',
+			name='grammatical_group',
+			field=models.CharField(blank=True, db_index=True, editable=False, help_text='The alphabetically first word that is the same word as or a grammatical variant of this word, directly or through other variants.', max_length=25),
+		),
+		migrations.RunPython(assign_groups, migrations.RunPython.noop),
+	]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:00
+# MANUALLY WRITTEN
+
+from django.db import migrations
+
+# GIN indexes for fulltext.py; PostgreSQL only (other databases fall back to unindexed substring matches)
+# not in the models' Meta.indexes because they cannot be created on SQLite
+# the utterance vector is the same expression as fulltext.utterance_search_vector() (written out, so that later changes to the app do not change this migration)
+def get_indexes():
+	from django.contrib.postgres.indexes import GinIndex, OpClass
+	from django.contrib.postgres.search import SearchVector
+	utterance_vector = (
+		SearchVector('translation', weight='A', config='english')
+		+ SearchVector('translation_source', weight='B', config='english')
+		+ SearchVector('context', weight='C', config='english')
+	)
+	return [
+		("CompleteUtterance", GinIndex(utterance_vector, name='utterance_text_search_gin')),
+		("Speaker", GinIndex(OpClass('name', name='gin_trgm_ops'), name='speaker_name_trgm_gin')),
+		("Source", GinIndex(OpClass('name', name='gin_trgm_ops'), name='source_name_trgm_gin')),
+		("Source", GinIndex(OpClass('url', name='gin_trgm_ops'), name='source_url_trgm_gin')),
+	]
+
+def add_indexes(apps, schema_editor):
+	if schema_editor.connection.vendor != 'postgresql':
+		return
+	schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+	for (model_name, index) in get_indexes():
+		schema_editor.add_index(apps.get_model('hilichurlian_database', model_name), index)
+
+def remove_indexes(apps, schema_editor):
+	if schema_editor.connection.vendor != 'postgresql':
+		return
+	for (model_name, index) in get_indexes():
+		schema_editor.remove_index(apps.get_model('hilichurlian_database', model_name), index)
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('hilichurlian_database', '0017_word_same_word_group_word_grammatical_group'),
+	]
+
+	operations = [
+		migrations.RunPython(add_indexes, remove_indexes)
+	]
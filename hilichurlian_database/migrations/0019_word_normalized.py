@@ -0,0 +1,93 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:00
+# PARTIALLY MANUALLY WRITTEN
+
+from django.db import migrations, models
+import re
+
+
+# copies of tokenizer.normalize() and variants.compute_groups() as they were when this migration was written,
+# so that later changes to the app do not change this migration
+
+REPEATED_LETTER_RE = re.compile(r'(\w)\1{2,}')
+
+def normalize(word):
+	return REPEATED_LETTER_RE.sub(r'\1', word.lower())
+
+# words is an iterable of (word, normalized form); same_word_pairs and grammatical_pairs are iterables of (word, word)
+# returns { word: (same_word_group, grammatical_group) }
+def compute_groups(words, same_word_pairs, grammatical_pairs):
+	# union-find
+	def find(parents, word):
+		root = word
+		while parents[root] != root:
+			root = parents[root]
+		while parents[word] != root: # path compression
+			(parents[word], word) = (root, parents[word])
+		return root
+
+	def union(parents, word_a, word_b):
+		root_a = find(parents, word_a)
+		root_b = find(parents, word_b)
+		if root_a != root_b:
+			# keep the alphabetically first word as the root
+			if root_b < root_a:
+				(root_a, root_b) = (root_b, root_a)
+			parents[root_b] = root_a
+
+	words = list(words)
+	same_word_parents = { word: word for (word, normalized) in words }
+	grammatical_parents = dict(same_word_parents)
+	# words with the same normalized form are the same word
+	first_with_form = {}
+	for (word, normalized) in words:
+		first_word = first_with_form.setdefault(normalized or word, word)
+		union(same_word_parents, word, first_word)
+		union(grammatical_parents, word, first_word)
+	for (word_a, word_b) in same_word_pairs:
+		union(same_word_parents, word_a, word_b)
+		union(grammatical_parents, word_a, word_b)
+	for (word_a, word_b) in grammatical_pairs:
+		union(grammatical_parents, word_a, word_b)
+	return {
+		word: (find(same_word_parents, word), find(grammatical_parents, word))
+		for word in same_word_parents
+	}
+
+# database already has Word objects; words with the same normalized form now share their groups
+def assign_normalized(apps, schema_editor):
+	Word = apps.get_model('hilichurlian_database', 'Word')
+	db_alias = schema_editor.connection.alias
+
+	words = []
+	for word in Word.objects.using(db_alias).all():
+		word.normalized = normalize(word.word)
+		words.append(word)
+	Word.objects.using(db_alias).bulk_update(words, ['normalized'], batch_size=500)
+
+	groups = compute_groups(
+		Word.objects.using(db_alias).values_list('word', 'normalized'),
+		Word.variants_same_word.through.objects.using(db_alias).values_list('from_word_id', 'to_word_id'),
+		Word.variants_grammatical.through.objects.using(db_alias).values_list('from_word_id', 'to_word_id'),
+	)
+	# save only the groups that changed; update() so that no history is recorded for derived fields
+	changed = {}
+	for (word, same_word_group, grammatical_group) in Word.objects.using(db_alias).values_list('word', 'same_word_group', 'grammatical_group'):
+		if (same_word_group, grammatical_group) != groups[word]:
+			changed.setdefault(groups[word], []).append(word)
+	for ((same_word_group, grammatical_group), words) in changed.items():
+		Word.objects.using(db_alias).filter(word__in=words).update(same_word_group=same_word_group, grammatical_group=grammatical_group)
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('hilichurlian_database', '0018_fulltext_and_trigram_indexes'),
+	]
+
+	operations = [
+		migrations.AddField(
+			model_name='word',
+			name='normalized',
+			field=models.CharField(blank=True, db_index=True, editable=False, help_text="This word with letters repeated three or more times in a row written once. For example, 'yaaaa' and 'ya' are both 'ya', but 'unuu' stays 'unuu'.", max_length=25),
+		),
+		migrations.RunPython(assign_normalized, migrations.RunPython.noop),
+	]
@@ -0,0 +1,70 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:26
+# PARTIALLY MANUALLY WRITTEN
+
+from django.db import migrations, models
+
+
+# for the admin's autocomplete, which searches by prefix (search_fields starting with "^", so istartswith)
+# on PostgreSQL istartswith is UPPER(column::text) LIKE 'X%', which a plain index cannot serve
+# PostgreSQL only, like migration 0018
+def get_indexes():
+	from django.contrib.postgres.indexes import OpClass
+	from django.db.models.functions import Upper
+	return [
+		("Speaker", models.Index(OpClass(Upper('name'), name='text_pattern_ops'), name='speaker_name_prefix')),
+		("Source", models.Index(OpClass(Upper('name'), name='text_pattern_ops'), name='source_name_prefix')),
+		("Source", models.Index(OpClass(Upper('url'), name='text_pattern_ops'), name='source_url_prefix')),
+		("Word", models.Index(OpClass(Upper('word'), name='text_pattern_ops'), name='word_word_prefix')),
+	]
+
+def add_indexes(apps, schema_editor):
+	if schema_editor.connection.vendor != 'postgresql':
+		return
+	for (model_name, index) in get_indexes():
+		schema_editor.add_index(apps.get_model('hilichurlian_database', model_name), index)
+
+def remove_indexes(apps, schema_editor):
+	if schema_editor.connection.vendor != 'postgresql':
+		return
+	for (model_name, index) in get_indexes():
+		schema_editor.remove_index(apps.get_model('hilichurlian_database', model_name), index)
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('hilichurlian_database', '0019_word_normalized'),
+	]
+
+	operations = [
+		migrations.AlterField(
+			model_name='historicalsource',
+			name='version',
+			field=models.CharField(choices=[('0', 'Pre-launch'), ('1.0', 'Version 1.0'), ('1.1', 'Version 1.1'), ('1.2', 'Version 1.2'), ('1.3', 'Version 1.3'), ('1.4', 'Version 1.4'), ('1.5', 'Version 1.5'), ('1.6', 'Version 1.6'), ('2.0', 'Version 2.0'), ('2.1', 'Version 2.1'), ('2.2', 'Version 2.2'), ('2.3', 'Version 2.3'), ('2.4', 'Version 2.4'), ('2.5', 'Version 2.5'), ('2.6', 'Version 2.6'), ('2.7', 'Version 2.7'), ('2.8', 'Version 2.8'), ('3.0', 'Version 3.0'), ('3.1', 'Version 3.1'), ('3.2', 'Version 3.2'), ('3.3', 'Version 3.3'), ('3.4', 'Version 3.4'), ('3.5', 'Version 3.5')], db_index=True, help_text='The first live version of Genshin Impact in which this source appeared. Select "Pre-launch" only if the source is a pre-launch post from miHoYo or was never released after Genshin Impact launched.', max_length=3),
+		),
+		migrations.AlterField(
+			model_name='historicalspeaker',
+			name='name',
+			field=models.CharField(db_index=True, help_text='Provide a living being when possible. Non-living entities such as Quest UI are acceptable as a last resort.', max_length=75),
+		),
+		migrations.AlterField(
+			model_name='historicalspeaker',
+			name='type',
+			field=models.CharField(choices=[('hili', 'Hilichurl'), ('stud', 'Student'), ('unkn', 'Unknown')], db_index=True, max_length=4),
+		),
+		migrations.AlterField(
+			model_name='source',
+			name='version',
+			field=models.CharField(choices=[('0', 'Pre-launch'), ('1.0', 'Version 1.0'), ('1.1', 'Version 1.1'), ('1.2', 'Version 1.2'), ('1.3', 'Version 1.3'), ('1.4', 'Version 1.4'), ('1.5', 'Version 1.5'), ('1.6', 'Version 1.6'), ('2.0', 'Version 2.0'), ('2.1', 'Version 2.1'), ('2.2', 'Version 2.2'), ('2.3', 'Version 2.3'), ('2.4', 'Version 2.4'), ('2.5', 'Version 2.5'), ('2.6', 'Version 2.6'), ('2.7', 'Version 2.7'), ('2.8', 'Version 2.8'), ('3.0', 'Version 3.0'), ('3.1', 'Version 3.1'), ('3.2', 'Version 3.2'), ('3.3', 'Version 3.3'), ('3.4', 'Version 3.4'), ('3.5', 'Version 3.5')], db_index=True, help_text='The first live version of Genshin Impact in which this source appeared. Select "Pre-launch" only if the source is a pre-launch post from miHoYo or was never released after Genshin Impact launched.', max_length=3),
+		),
+		migrations.AlterField(
+			model_name='speaker',
+			name='name',
+			field=models.CharField(db_index=True, help_text='Provide a living being when possible. Non-living entities such as Quest UI are acceptable as a last resort.', max_length=75),
+		),
+		migrations.AlterField(
+			model_name='speaker',
+			name='type',
+			field=models.CharField(choices=[('hili', 'Hilichurl'), ('stud', 'Student'), ('unkn', 'Unknown')], db_index=True, max_length=4),
+		),
+		migrations.RunPython(add_indexes, remove_indexes),
+	]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.3 on 2026-10-18 09:10
+# PARTIALLY MANUALLY WRITTEN
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# the one row that caching.py reads and bumps
+def create_version(apps, schema_editor):
+	DataVersion = apps.get_model('hilichurlian_database', 'DataVersion')
+	DataVersion.objects.using(schema_editor.connection.alias).get_or_create(pk=1, defaults={ 'version': 1, 'modified': timezone.now() })
+
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('hilichurlian_database', '0020_admin_indexes'),
+	]
+
+	operations = [
+		migrations.CreateModel(
+			name='DataVersion',
+			fields=[
+				('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+				('version', models.PositiveBigIntegerField(default=1)),
+				('modified', models.DateTimeField()),
+			],
+		),
+		migrations.RunPython(create_version, migrations.RunPython.noop),
+	]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+		('hilichurlian_database', '0021_dataversion'),
+	]
+
+	operations = [
+		migrations.CreateModel(
+			name='BulkUpdateSelection',
+			fields=[
+				('token', models.CharField(max_length=32, primary_key=True, serialize=False)),
+				('ids', models.JSONField()),
+				('created', models.DateTimeField(auto_now_add=True)),
+				('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+			],
+		),
+	]
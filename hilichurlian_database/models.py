@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from simple_history.models import HistoricalRecords # for logging changes
 
@@ -27,19 +28,41 @@ def get_version_list():
 ##### ABSTRACT MODELS #####
 
 class Entry(models.Model):
+	# field_names is the same as order in get_fields_as_dict()
+	# returns (names for select_related(), names for prefetch_related()) so that get_fields_as_dict() needs no queries
+	@classmethod
+	def get_related_field_names(cls, field_names=[]):
+		if field_names:
+			fields = [ cls._meta.get_field(field_name) for field_name in field_names ]
+		else:
+			fields = cls._meta.get_fields()
+		select = [ field.name for field in fields if field.many_to_one and field.concrete ]
+		prefetch = [ field.name for field in fields if field.many_to_many and field.concrete ]
+		return (select, prefetch)
+
+	# queryset with everything that get_fields_as_dict(order) needs; a constant number of queries however many entries or related objects
+	@classmethod
+	def with_related(cls, queryset, order=[]):
+		(select, prefetch) = cls.get_related_field_names(order)
+		return queryset.select_related(*select).prefetch_related(*prefetch)
+
+	# for lists and APIs: [ (entry, entry.get_fields_as_dict(order)), ... ]
+	@classmethod
+	def get_fields_as_dicts(cls, queryset, order=[]):
+		return [ (entry, entry.get_fields_as_dict(order)) for entry in cls.with_related(queryset, order) ]
+
+	# uses the related objects that are already loaded (see with_related()), so it makes no queries of its own if they are
 	def get_fields_as_dict(self, order=[]):
 		# helper function
 		def get_value_for_dict(field):
 			# TODO: just string and not list for anything other than many-to-many
 			value_for_dict = []
 			if field.many_to_one:
-				# go get the other object
-				value_for_dict.append(field.related_model.objects.get(id=field.value_to_string(self)))
+				# the other object (cached by select_related)
+				value_for_dict.append(getattr(self, field.name))
 			elif field.many_to_many:
-				# identify the other objects
-				for related_object in getattr(self, field.name).all():
-					# go get the other objects
-					value_for_dict.append(field.related_model.objects.get(pk=related_object))
+				# the other objects (cached by prefetch_related)
+				value_for_dict.extend(getattr(self, field.name).all())
 			elif field.choices:
 				value_for_dict.append(getattr(self, 'get_%s_display' % field.name)())
 			else:
@@ -84,11 +107,13 @@ class Speaker(Entry):
 	SPECIALLY_HANDLED = [] # form submission needs get_or_create()
 	BULK_UPDATABLE = ['type']
 
+	# indexed for the admin's list filters and autocomplete (see also migration 0020)
 	name = models.CharField(
 		max_length = 75,
+		db_index = True,
 		help_text = "Provide a living being when possible. Non-living entities such as Quest UI are acceptable as a last resort."
-	) # db_index=True later?
-	type = models.CharField(max_length=4, choices=SPEAKER_TYPES)
+	)
+	type = models.CharField(max_length=4, choices=SPEAKER_TYPES, db_index=True)
 
 	object_history = HistoricalRecords()
 
@@ -116,6 +141,7 @@ class Source(Entry):
 	version = models.CharField(
 		max_length = 3,
 		choices = VERSIONS,
+		db_index = True, # for the admin's list filter
 		help_text = 'The first live version of Genshin Impact in which this source appeared. Select "Pre-launch" only if the source is a pre-launch post from miHoYo or was never released after Genshin Impact launched.'
 	)
 	related_sources = models.ManyToManyField(
@@ -139,7 +165,8 @@ class Word(Entry):
 		primary_key = True,
 		help_text = "Must be a word that can be found in an utterance."
 	)
-	# TODO: if wordA's variants_same_word includes wordB and variants_grammatical includes wordC, then wordB's variants_grammatical should also include wordC, right?
+	# if wordA's variants_same_word includes wordB and variants_grammatical includes wordC, then wordB's variants_grammatical should also include wordC
+	# so searches use the transitive closure of these relations (see same_word_group and grammatical_group)
 	variants_same_word = models.ManyToManyField(
 		"self",
 		verbose_name = "other written forms of this word",
@@ -152,8 +179,33 @@ class Word(Entry):
 		blank = True, # there may not be variants in the database yet
 		help_text = "Different words that are likely grammatical variants of this word. For example, 'mi' and 'mimi' are likely grammatical variants of each other."
 	)
+	# for elongation-insensitive lookup; see tokenizer.normalize()
+	# fill in existing words with manage.py backfill_normalized_words
+	normalized = models.CharField(
+		max_length = 25,
+		blank = True,
+		editable = False,
+		db_index = True,
+		help_text = "This word with letters repeated three or more times in a row written once. For example, 'yaaaa' and 'ya' are both 'ya', but 'unuu' stays 'unuu'."
+	)
+	# connected components of the variant relations (and of words with the same normalized form), maintained by variants.py
+	# rebuild with manage.py rebuild_word_variants
+	same_word_group = models.CharField(
+		max_length = 25,
+		blank = True,
+		editable = False,
+		db_index = True,
+		help_text = "The alphabetically first word that is the same word as this word, directly or through other variants."
+	)
+	grammatical_group = models.CharField(
+		max_length = 25,
+		blank = True,
+		editable = False,
+		db_index = True,
+		help_text = "The alphabetically first word that is the same word as or a grammatical variant of this word, directly or through other variants."
+	)
 
-	object_history = HistoricalRecords()
+	object_history = HistoricalRecords(excluded_fields=['normalized', 'same_word_group', 'grammatical_group']) # derived fields
 
 	def __str__(self):
 		return self.word
@@ -163,6 +215,8 @@ class CompleteUtterance(Entry):
 	SPECIALLY_HANDLED = ['speaker', 'source']
 	# auto-populated fields: words
 	BULK_UPDATABLE = ['speaker', 'source']
+	# for which fields the results table (elements/table.html) shows; use with select_related('speaker', 'source')
+	TABLE_FIELDS = ['id', 'utterance', 'speaker', 'speaker__name', 'translation', 'translation_source', 'context', 'source', 'source__name', 'source__url', 'source__version']
 
 	# making the autofield explicit as a reminder
 	id = models.AutoField(primary_key=True)
@@ -192,4 +246,18 @@ class CompleteUtterance(Entry):
 	object_history = HistoricalRecords()
 
 	def __str__(self):
-		return self.utterance
\ No newline at end of file
+		return self.utterance
+
+# one row: the version of the public data, shared by every process (web workers, management commands)
+# bumped after every committed change (see caching.py); not public data itself, so it has no history
+class DataVersion(models.Model):
+	version = models.PositiveBigIntegerField(default=1)
+	modified = models.DateTimeField()
+
+# the utterances picked for a bulk update in the admin (see admin.py), between choosing them and confirming the update
+# in a table rather than the session, which would load and save every pk on every admin request
+class BulkUpdateSelection(models.Model):
+	token = models.CharField(max_length=32, primary_key=True)
+	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+	ids = models.JSONField() # in the order they are previewed
+	created = models.DateTimeField(auto_now_add=True)
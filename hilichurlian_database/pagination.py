@@ -0,0 +1,231 @@
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+import base64
+import json
+import re
+
+# pagination for the results table
+# numbered pages (Django's Paginator) for small result sets
+# keyset (cursor) pages for large result sets, so that deep pages cost the same as the first page:
+# every listing is ordered by (source_id, id), so a page starts right after the last (source_id, id) of the previous page
+# instead of at an OFFSET that the database has to scan through
+# the a- methods and functions are for the async views: the same pages, with every query through the async ORM
+
+### CONSTANTS ###
+
+# result sets with more rows than this get cursor pagination unless a page number is requested
+NUMBERED_PAGES_LIMIT = 1000
+# the orderings that a cursor can continue
+KEYSET_ORDERINGS = [('source', 'id'), ('source_id', 'id')]
+
+
+### CLASSES ###
+
+class NumberedPaginator(Paginator):
+	def has_results(self):
+		return self.count > 0
+
+	async def acount(self):
+		if 'count' not in self.__dict__: # not counted (or set by get_paginator()) yet
+			self.count = await acount(self.object_list)
+		return self.count
+
+	async def ahas_results(self):
+		return await self.acount() > 0
+
+	# like get_page(), with the rows already fetched
+	async def aget_page(self, number):
+		await self.acount()
+		try:
+			number = self.validate_number(number)
+		except PageNotAnInteger:
+			number = 1
+		except EmptyPage:
+			number = self.num_pages
+		bottom = (number - 1) * self.per_page
+		top = bottom + self.per_page
+		if top + self.orphans >= self.count:
+			top = self.count
+		return self._get_page(await aslice(self.object_list, bottom, top), number, self)
+
+# for the admin's changelists of big tables: approximate_count() instead of a COUNT(*) of the whole table
+# the page links follow the estimate, so the last pages may be missing or empty when it is off
+class EstimatedCountPaginator(Paginator):
+	@cached_property
+	def count(self):
+		return approximate_count(self.object_list)
+
+class KeysetPage:
+	def __init__(self, object_list, page_size, next_cursor="", previous_cursor=""):
+		self.object_list = object_list
+		self.page_size = page_size
+		self.next_cursor = next_cursor
+		self.previous_cursor = previous_cursor
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+	def has_next(self):
+		return bool(self.next_cursor)
+
+	def has_previous(self):
+		return bool(self.previous_cursor)
+
+class KeysetPaginator:
+	is_keyset = True
+
+	# object_list must be a QuerySet of CompleteUtterances (ordering is replaced)
+	# approximate_count is only for display; None if unknown
+	def __init__(self, object_list, per_page, approximate_count=None):
+		self.object_list = object_list.order_by('source_id', 'id')
+		self.per_page = int(per_page)
+		self.approximate_count = approximate_count
+
+	def has_results(self):
+		return self.object_list.exists()
+
+	async def ahas_results(self):
+		return await self.object_list.aexists()
+
+	# cursor is a token from KeysetPage.next_cursor or KeysetPage.previous_cursor; empty or invalid means the first page
+	def get_page(self, cursor=""):
+		(rows, position) = self.page_rows(cursor)
+		return self.make_page(list(rows), position)
+
+	async def aget_page(self, cursor=""):
+		(rows, position) = self.page_rows(cursor)
+		return self.make_page([ row async for row in rows ], position)
+
+	# returns (QuerySet of up to one row more than a page, position from decode_cursor())
+	def page_rows(self, cursor):
+		position = decode_cursor(cursor)
+		if position is None:
+			return (self.object_list[:self.per_page + 1], position)
+		(direction, source_id, utt_id) = position
+		if direction == "next":
+			after = Q(source_id__gt=source_id) | Q(source_id=source_id, id__gt=utt_id)
+			return (self.object_list.filter(after)[:self.per_page + 1], position)
+		before = Q(source_id__lt=source_id) | Q(source_id=source_id, id__lt=utt_id)
+		return (self.object_list.filter(before).order_by('-source_id', '-id')[:self.per_page + 1], position)
+
+	# rows is the list of page_rows()
+	def make_page(self, rows, position):
+		if position is None:
+			more_after = len(rows) > self.per_page
+			rows = rows[:self.per_page]
+			more_before = False
+		elif position[0] == "next":
+			more_after = len(rows) > self.per_page
+			rows = rows[:self.per_page]
+			more_before = True
+		else:
+			more_before = len(rows) > self.per_page
+			rows = rows[:self.per_page][::-1]
+			more_after = True
+		next_cursor = ""
+		previous_cursor = ""
+		if rows and more_after:
+			next_cursor = encode_cursor("next", rows[-1].source_id, rows[-1].id)
+		if rows and more_before:
+			previous_cursor = encode_cursor("prev", rows[0].source_id, rows[0].id)
+		return KeysetPage(rows, self.per_page, next_cursor, previous_cursor)
+
+
+### FUNCTIONS ###
+
+def encode_cursor(direction, source_id, utt_id):
+	raw = json.dumps([direction, source_id, utt_id], separators=(',', ':'))
+	return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+# returns (direction, source_id, id), or None if the cursor is empty or not valid
+def decode_cursor(cursor):
+	if not cursor:
+		return None
+	try:
+		raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+		(direction, source_id, utt_id) = json.loads(raw)
+	except (ValueError, TypeError):
+		return None
+	if direction not in ("next", "prev") or not isinstance(source_id, int) or not isinstance(utt_id, int):
+		return None
+	return (direction, source_id, utt_id)
+
+# the planner's row estimate on PostgreSQL (no scan); an exact count elsewhere
+def approximate_count(queryset):
+	connection = connections[queryset.db]
+	if connection.vendor == "postgresql":
+		estimate = planner_estimate(queryset.order_by().explain())
+		if estimate is not None:
+			return estimate
+	return queryset.count()
+
+async def aapproximate_count(queryset):
+	connection = connections[queryset.db]
+	if connection.vendor == "postgresql":
+		estimate = planner_estimate(await queryset.order_by().aexplain())
+		if estimate is not None:
+			return estimate
+	return await queryset.acount()
+
+def planner_estimate(plan):
+	estimate = re.search(r"rows=(\d+)", plan)
+	if estimate:
+		return int(estimate.group(1))
+	return None
+
+# a QuerySet, search.OrderedUtterances or list
+async def acount(object_list):
+	if isinstance(object_list, QuerySet):
+		return await object_list.acount()
+	return len(object_list)
+
+# object_list[start:stop] as a list
+async def aslice(object_list, start, stop):
+	if isinstance(object_list, QuerySet):
+		return [ item async for item in object_list[start:stop] ]
+	if hasattr(object_list, 'aslice'): # search.OrderedUtterances
+		return await object_list.aslice(start, stop)
+	return list(object_list[start:stop])
+
+# what to pass to paginator.get_page()
+def requested_page(paginator, req):
+	if getattr(paginator, 'is_keyset', False):
+		return req.get('cursor', "")
+	return req.get('page', 1)
+
+# numbered pages unless the request asks for a cursor, or the results are too many to count and offset through
+def get_paginator(object_list, page_size, req):
+	if not needs_estimate(object_list, req):
+		return NumberedPaginator(object_list, page_size)
+	return estimated_paginator(object_list, page_size, req, approximate_count(object_list))
+
+async def aget_paginator(object_list, page_size, req):
+	if not needs_estimate(object_list, req):
+		return NumberedPaginator(object_list, page_size)
+	return estimated_paginator(object_list, page_size, req, await aapproximate_count(object_list))
+
+# whether the choice of paginator depends on approximate_count(); if not, the pages are numbered
+def needs_estimate(object_list, req):
+	if not isinstance(object_list, QuerySet):
+		# already in memory; slicing is cheap
+		return False
+	if tuple(object_list.query.order_by) not in KEYSET_ORDERINGS:
+		# e.g. ranked full-text search results
+		return False
+	if req.get('cursor') is None and req.get('page') is not None:
+		# keep page number links working
+		return False
+	return True
+
+def estimated_paginator(object_list, page_size, req, estimate):
+	if req.get('cursor') is not None or estimate > NUMBERED_PAGES_LIMIT:
+		return KeysetPaginator(object_list, page_size, estimate)
+	paging = NumberedPaginator(object_list, page_size)
+	if connections[object_list.db].vendor != "postgresql":
+		paging.count = estimate # exact, so don't count again
+	return paging
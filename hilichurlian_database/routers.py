@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.urls import reverse
+from contextvars import ContextVar
+from functools import wraps
+import contextlib
+import random
+
+# read replicas (settings.REPLICA_DATABASES, from REPLICA_DATABASE_URLS)
+# reads during GET and HEAD requests for the public pages go to one replica, chosen per request
+# everything else goes to the primary ("default"): writes, reads after a write in the same request, the admin, add_data,
+# and everything outside of a request (migrations, management commands, the shell), which may not read stale data
+# the request is marked by middleware.ReplicaMiddleware
+
+### CONSTANTS ###
+
+PRIMARY = "default"
+
+# the databases of the request being handled; None outside of requests
+current_databases = ContextVar("current_databases", default=None)
+
+
+### CLASSES ###
+
+# mutable, so that a write pins the rest of the request to the primary even from the async ORM's thread (which has a copy of the context)
+class RequestDatabases:
+	def __init__(self, replica=None):
+		self.replica = replica # None for the primary
+
+	def use_primary(self):
+		self.replica = None
+
+# settings.DATABASE_ROUTERS
+class ReplicaRouter:
+	def db_for_read(self, model, **hints):
+		databases = current_databases.get()
+		if databases is None or databases.replica is None:
+			return PRIMARY
+		return databases.replica
+
+	def db_for_write(self, model, **hints):
+		databases = current_databases.get()
+		if databases is not None:
+			# the replicas may not have the write yet
+			databases.use_primary()
+		return PRIMARY
+
+	def allow_relation(self, obj1, obj2, **hints):
+		# every database has the same data
+		return True
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# the replicas get the schema from the primary
+		return db == PRIMARY
+
+
+### FUNCTIONS ###
+
+def may_use_replica(request):
+	return request.method in ("GET", "HEAD") and not request.path.startswith(reverse("admin:index"))
+
+# sets the databases for the duration of a request
+# (a streamed response is read after this, so it reads from the primary)
+@contextlib.contextmanager
+def request_databases(request):
+	replicas = getattr(settings, 'REPLICA_DATABASES', [])
+	replica = None
+	if replicas and may_use_replica(request):
+		replica = random.choice(replicas)
+	token = current_databases.set(RequestDatabases(replica))
+	try:
+		yield
+	finally:
+		current_databases.reset(token)
+
+# decorator for views that must see their own writes and the latest data, whatever the request method
+def use_primary_database(view):
+	@wraps(view)
+	def inner(request, *args, **kwargs):
+		databases = current_databases.get()
+		if databases is not None:
+			databases.use_primary()
+		return view(request, *args, **kwargs)
+	return inner
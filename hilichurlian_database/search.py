@@ -0,0 +1,250 @@
+from django.db.models import Count, F, Q, Value
+from .models import Speaker, Source, Word, CompleteUtterance
+from . import search_index
+from . import fulltext
+from .tokenizer import tokenize, normalize
+import asyncio
+
+# the search compiler for views.filter()
+# turns the search criteria into one lookup query (for reporting what is not in the database)
+# plus one grouped query (GROUP BY utterance, HAVING every word matched) instead of a round trip per word
+
+### CONSTANTS ###
+
+# through table of CompleteUtterance.words
+UTTERANCE_WORDS = CompleteUtterance.words.through # completeutterance_id, word_id
+
+
+### CLASSES ###
+
+class SearchCriteria:
+	def __init__(self, words=[], similar="", speaker="", source="", text="", speaker_like="", source_like=""):
+		# keep order, like remove_duplicates() in views.py
+		self.words = list(dict.fromkeys(words))
+		self.similar = similar
+		self.speaker = speaker
+		self.source = source
+		# English full-text search and fuzzy names (see fulltext.py)
+		self.text = text
+		self.speaker_like = speaker_like
+		self.source_like = source_like
+
+	@classmethod
+	def from_querydict(cls, req):
+		words_as_string = req.get('words', "").strip()
+		return cls(
+			words = tokenize(words_as_string),
+			similar = req.get('similar', "").strip(),
+			speaker = req.get('speaker', "").strip(),
+			source = req.get('source', "").strip(),
+			text = req.get('text', "").strip(),
+			speaker_like = req.get('speakerLike', "").strip(),
+			source_like = req.get('sourceLike', "").strip(),
+		)
+
+	def has_criteria(self):
+		return bool(self.words or self.speaker or self.source or self.text or self.speaker_like or self.source_like)
+
+class CompiledSearch:
+	def __init__(self, criteria, words, speaker, source, nonexistent_values):
+		self.criteria = criteria
+		# only the criteria that exist in the database
+		self.words = list(words) # words is { word: (same_word_group, grammatical_group) }
+		self.word_groups = words
+		self.similar = criteria.similar
+		self.speaker = speaker
+		self.source = source
+		self.text = criteria.text
+		self.speaker_like = criteria.speaker_like
+		self.source_like = criteria.source_like
+		# the criteria that do not exist in the database; same shape as search_values
+		self.nonexistent_values = nonexistent_values
+
+	@property
+	def words_as_string(self):
+		return " ".join(self.words)
+
+	# info about the search for messages
+	@property
+	def search_values(self):
+		search_values = {}
+		if self.words:
+			search_values["words"] = str(self.words)[1:-1]
+		if self.speaker:
+			search_values["speaker"] = self.speaker
+		if self.source:
+			search_values["source"] = self.source
+		if self.text:
+			search_values["English text"] = self.text
+		if self.speaker_like:
+			search_values["speaker name like"] = self.speaker_like
+		if self.source_like:
+			search_values["source like"] = self.source_like
+		return search_values
+
+	def has_criteria(self):
+		return bool(self.words or self.speaker or self.source or self.has_text_criteria())
+
+	# criteria that only the database can answer (not the in-memory index)
+	def has_text_criteria(self):
+		return bool(self.text or self.speaker_like or self.source_like)
+
+	# unordered QuerySet of the utterances that satisfy all of the criteria
+	# no database access until the QuerySet is evaluated
+	def utterances(self):
+		utterances = table_utterances()
+		if self.speaker:
+			utterances = utterances.filter(speaker__name=self.speaker)
+		if self.source:
+			utterances = utterances.filter(source__url=self.source)
+		if self.words:
+			utterances = utterances.filter(id__in=self.matching_utterance_ids())
+		if self.speaker_like:
+			utterances = utterances.filter(fulltext.fuzzy_q("speaker", fulltext.SPEAKER_FUZZY_FIELDS, self.speaker_like, utterances.db))
+		if self.source_like:
+			utterances = utterances.filter(fulltext.fuzzy_q("source", fulltext.SOURCE_FUZZY_FIELDS, self.source_like, utterances.db))
+		return utterances
+
+	# ordered results for the paginator, from whichever backend is configured
+	# best full-text matches first if there is English text to search for, otherwise by source then id
+	def ordered_utterances(self):
+		if search_index.is_enabled() and not self.has_text_criteria():
+			return OrderedUtterances(search_index.get_index().search(self))
+		utterances = self.utterances()
+		if self.text:
+			(utterances, ranked) = fulltext.filter_text(utterances, self.text)
+			if ranked:
+				return utterances.order_by('-text_rank', 'source', 'id')
+		return utterances.order_by('source', 'id')
+
+	# the variant group (see variants.py) of the words that count as a match for word_string
+	def variant_group(self, word_string):
+		(same_word_group, grammatical_group) = self.word_groups[word_string]
+		if self.similar:
+			return ("grammatical_group", grammatical_group)
+		return ("same_word_group", same_word_group)
+
+	# Q object for the words that count as a match for word_string; one indexed lookup
+	def variants_q(self, word_string):
+		(group_field, group) = self.variant_group(word_string)
+		return Q(**{ "word__" + group_field: group })
+
+	# subquery of the ids of the utterances that have (a variant of) every word
+	def matching_utterance_ids(self):
+		all_variants = Q()
+		term_counts = {}
+		for i, word_string in enumerate(self.words):
+			variants = self.variants_q(word_string)
+			all_variants = all_variants | variants
+			term_counts["term_" + str(i)] = Count('pk', filter=variants)
+		# TODO: handle case where grammatical variations are specifically specified (e.g. user enters "mi mimi") so that anything the user enters is required
+		return UTTERANCE_WORDS.objects.filter(
+			all_variants
+		).values(
+			'completeutterance_id'
+		).annotate(
+			**term_counts
+		).filter(
+			**{ term + "__gt": 0 for term in term_counts }
+		).values('completeutterance_id')
+
+# list of utterance ids that only fetches the utterances on the requested page
+# (for the paginator; behaves like a QuerySet ordered by source then id)
+class OrderedUtterances:
+	# queryset is where the utterances are fetched from; table_utterances() by default
+	def __init__(self, ids, queryset=None):
+		self.ids = ids
+		self.queryset = queryset
+
+	def __len__(self):
+		return len(self.ids)
+
+	def count(self):
+		return len(self.ids)
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			page_ids = self.ids[key]
+			utterances = self.get_queryset().in_bulk(page_ids)
+			return [ utterances[utt_id] for utt_id in page_ids if utt_id in utterances ]
+		return self.get_queryset().get(id=self.ids[key])
+
+	# self[start:stop], with the async ORM
+	async def aslice(self, start, stop):
+		page_ids = self.ids[start:stop]
+		utterances = await self.get_queryset().ain_bulk(page_ids)
+		return [ utterances[utt_id] for utt_id in page_ids if utt_id in utterances ]
+
+	def get_queryset(self):
+		if self.queryset is None:
+			return table_utterances()
+		return self.queryset
+
+
+### FUNCTIONS ###
+
+# QuerySet for the results table: speaker and source in the same query, and only the columns that are shown
+def table_utterances():
+	return CompleteUtterance.objects.select_related('speaker', 'source').only(*CompleteUtterance.TABLE_FIELDS)
+
+# a QuerySet for each kind of criteria, with the same columns: (kind, value, group_a, group_b)
+def existing_lookups(criteria):
+	# every column is an annotation so that the columns are in the same order in every part of the UNION
+	lookups = []
+	if criteria.words:
+		# every elongated form with one indexed equality lookup
+		normalized_words = [ normalize(w) for w in criteria.words ]
+		lookups.append(Word.objects.filter(normalized__in=normalized_words).annotate(
+			kind=Value("words"), value=F('normalized'), group_a=F('same_word_group'), group_b=F('grammatical_group')
+		).values_list('kind', 'value', 'group_a', 'group_b'))
+	if criteria.speaker:
+		lookups.append(Speaker.objects.filter(name=criteria.speaker).annotate(
+			kind=Value("speaker"), value=F('name'), group_a=Value(""), group_b=Value("")
+		).values_list('kind', 'value', 'group_a', 'group_b'))
+	if criteria.source:
+		lookups.append(Source.objects.filter(url=criteria.source).annotate(
+			kind=Value("source"), value=F('url'), group_a=Value(""), group_b=Value("")
+		).values_list('kind', 'value', 'group_a', 'group_b'))
+	return lookups
+
+# rows of existing_lookups() -> { kind: { value: (group_a, group_b) } }
+def group_existing(rows):
+	existing = { "words": {}, "speaker": {}, "source": {} }
+	for kind, value, group_a, group_b in rows:
+		existing[kind][value] = (group_a, group_b)
+	return existing
+
+# one query to find which of the criteria exist in the database
+def lookup_existing(criteria):
+	lookups = existing_lookups(criteria)
+	if not lookups:
+		return group_existing([])
+	return group_existing(lookups[0].union(*lookups[1:], all=True))
+
+# the same with the async ORM: the lookups are independent, so they are awaited together instead of as one UNION
+async def alookup_existing(criteria):
+	results = await asyncio.gather(*[ alist(lookup) for lookup in existing_lookups(criteria) ])
+	return group_existing(row for rows in results for row in rows)
+
+# evaluates a QuerySet with the async ORM (a coroutine, e.g. for asyncio.gather())
+async def alist(queryset):
+	return [ item async for item in queryset ]
+
+# existing is from lookup_existing(), if it has already been looked up (e.g. cached)
+def compile_search(criteria, existing=None):
+	if existing is None:
+		existing = lookup_existing(criteria)
+	# words with the same normalized form are in the same groups (see variants.py)
+	words = { w: existing["words"][normalize(w)] for w in criteria.words if normalize(w) in existing["words"] }
+	not_words = [ w for w in criteria.words if w not in words ]
+	speaker = criteria.speaker if criteria.speaker in existing["speaker"] else ""
+	source = criteria.source if criteria.source in existing["source"] else ""
+
+	nonexistent_values = {}
+	if not_words:
+		nonexistent_values["words"] = str(not_words)[1:-1]
+	if criteria.speaker and not speaker:
+		nonexistent_values["speaker"] = criteria.speaker
+	if criteria.source and not source:
+		nonexistent_values["source"] = criteria.source
+	return CompiledSearch(criteria, words, speaker, source, nonexistent_values)
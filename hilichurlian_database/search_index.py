@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import connections
+from .models import Speaker, Source, Word, CompleteUtterance
+from .signals import connect_data_changed
+import re
+import threading
+import time
+
+# optional in-process search backend (settings.SEARCH_BACKEND = "memory")
+# keeps an inverted index of Word -> utterances so that views.filter() needs no SQL joins
+# each set of utterances is a bitmap (a Python int); bit n is the nth utterance in order_by('source', 'id'),
+# so the results of an AND of bitmaps are already in the order of the results table
+
+### CONSTANTS ###
+
+# rebuilt when the data version (see caching.py) changes, which other processes' changes take a few seconds to reach;
+# and after this many seconds anyway
+MAX_AGE = getattr(settings, 'SEARCH_INDEX_MAX_AGE', 300)
+
+
+### CLASSES ###
+
+class InvertedIndex:
+	def __init__(self):
+		self.utterance_ids = [] # bit position -> CompleteUtterance id
+		self.all_utterances = 0 # bitmap with every utterance
+		self.same_word = {} # Word.same_word_group -> bitmap of the utterances with any word in the group
+		self.grammatical = {} # Word.grammatical_group -> bitmap of the utterances with any word in the group
+		self.speakers = {} # Speaker name -> bitmap
+		self.sources = {} # Source url -> bitmap
+		self.built_at = 0
+		self.data_version = None
+
+	# data_version is caching.get_data_version(), read before the data
+	def build(self, data_version=None):
+		# one query per table; no joins
+		utterance_ids = []
+		position = {}
+		speaker_of = {}
+		source_of = {}
+		for (utt_id, speaker_id, source_id) in CompleteUtterance.objects.order_by('source', 'id').values_list('id', 'speaker_id', 'source_id'):
+			position[utt_id] = len(utterance_ids)
+			utterance_ids.append(utt_id)
+			speaker_of[utt_id] = speaker_id
+			source_of[utt_id] = source_id
+
+		word_groups = list(Word.objects.values_list('word', 'same_word_group', 'grammatical_group'))
+		words = { word: 0 for (word, same_word_group, grammatical_group) in word_groups }
+		for (utt_id, word) in CompleteUtterance.words.through.objects.values_list('completeutterance_id', 'word_id'):
+			words[word] |= 1 << position[utt_id]
+
+		speakers_by_id = dict(Speaker.objects.values_list('id', 'name'))
+		sources_by_id = dict(Source.objects.values_list('id', 'url'))
+		speakers = { name: 0 for name in speakers_by_id.values() }
+		sources = { url: 0 for url in sources_by_id.values() }
+		for utt_id, bit in position.items():
+			speakers[speakers_by_id[speaker_of[utt_id]]] |= 1 << bit
+			sources[sources_by_id[source_of[utt_id]]] |= 1 << bit
+
+		# union the variant sets now instead of for every search
+		same_word = {}
+		grammatical = {}
+		for (word, same_word_group, grammatical_group) in word_groups:
+			same_word[same_word_group] = same_word.get(same_word_group, 0) | words[word]
+			grammatical[grammatical_group] = grammatical.get(grammatical_group, 0) | words[word]
+
+		self.utterance_ids = utterance_ids
+		self.all_utterances = (1 << len(utterance_ids)) - 1
+		self.same_word = same_word
+		self.grammatical = grammatical
+		self.speakers = speakers
+		self.sources = sources
+		self.built_at = time.monotonic()
+		self.data_version = data_version
+		return self
+
+	# search is a CompiledSearch from search.py
+	# returns the ids of the matching utterances, ordered by source then id
+	def search(self, search):
+		matches = self.all_utterances
+		if search.speaker:
+			matches &= self.speakers.get(search.speaker, 0)
+		if search.source:
+			matches &= self.sources.get(search.source, 0)
+		for word_string in search.words:
+			(same_word_group, grammatical_group) = search.word_groups[word_string]
+			if search.similar:
+				matches &= self.grammatical.get(grammatical_group, 0)
+			else:
+				matches &= self.same_word.get(same_word_group, 0)
+			if not matches:
+				break
+		return self.bitmap_to_ids(matches)
+
+	def bitmap_to_ids(self, bitmap):
+		# reversed binary string, so that the index of each "1" is its bit position
+		bits = format(bitmap, 'b')[::-1]
+		return [ self.utterance_ids[m.start()] for m in re.finditer('1', bits) ]
+
+
+### FUNCTIONS ###
+
+_index = None
+_stale = True
+_lock = threading.Lock()
+
+def get_index():
+	global _index, _stale
+	from .caching import get_data_version # caching.py uses this module
+	with _lock:
+		data_version = get_data_version()
+		# not rebuilt for an older version: requests reading from a replica that lags see the newer index
+		if _stale or _index is None or _index.data_version is None or _index.data_version < data_version or (time.monotonic() - _index.built_at > MAX_AGE):
+			_stale = False
+			_index = InvertedIndex().build(data_version)
+		return _index
+
+# build the index at startup, before gunicorn --preload forks the workers
+def warm_up():
+	if is_enabled():
+		get_index()
+		# the forked workers must not share the connection used for the build
+		connections.close_all()
+
+def mark_stale():
+	global _stale
+	_stale = True
+
+def is_enabled():
+	return getattr(settings, 'SEARCH_BACKEND', 'orm') == 'memory'
+
+
+### SIGNALS ###
+
+# rebuilt on the next search, not right away, so that a bulk change only costs one rebuild
+def search_data_changed(sender, **kwargs):
+	mark_stale()
+
+connect_data_changed(search_data_changed, "search_index")
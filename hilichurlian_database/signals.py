@@ -0,0 +1,34 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import Signal
+from .models import Speaker, Source, Word, CompleteUtterance
+
+# every change to the public data (the models and their ManyToManyFields) sends one of these signals
+# used to keep the in-memory search index and the caches fresh
+# bulk operations (bulk_create(), update(), ...) send no model signals, so they must send data_changed themselves
+
+### CONSTANTS ###
+
+MODELS = [CompleteUtterance, Word, Speaker, Source]
+THROUGH_MODELS = [
+	CompleteUtterance.words.through,
+	Word.variants_same_word.through,
+	Word.variants_grammatical.through,
+	Source.related_sources.through,
+]
+
+
+### SIGNALS ###
+
+data_changed = Signal()
+
+
+### FUNCTIONS ###
+
+# handler(sender, **kwargs) is called after any change to the public data
+def connect_data_changed(handler, dispatch_uid):
+	for model in MODELS:
+		post_save.connect(handler, sender=model, dispatch_uid=dispatch_uid + "-save-" + model.__name__)
+		post_delete.connect(handler, sender=model, dispatch_uid=dispatch_uid + "-delete-" + model.__name__)
+	for through in THROUGH_MODELS:
+		m2m_changed.connect(handler, sender=through, dispatch_uid=dispatch_uid + "-m2m-" + through.__name__)
+	data_changed.connect(handler, dispatch_uid=dispatch_uid + "-bulk")
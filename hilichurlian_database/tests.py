@@ -1,3 +1,1117 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.db.models import F
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.template.loader import get_template
+from django.test import AsyncRequestFactory, LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from .models import Speaker, Source, Word, CompleteUtterance, DataVersion
+from .search import SearchCriteria, compile_search, lookup_existing, alookup_existing, table_utterances
+from . import search_index
+from . import pagination
+from . import views
+from . import async_views
+from . import api
+from . import ingest
+from . import benchmark
+from . import loadtest
+from .caching import cached_search, data_version_key, get_data_state, row_cache_key
+from .routers import ReplicaRouter, request_databases
+from .cache_backends import LRUFileBasedCache
+from .middleware import ServerTimingMiddleware
+from .tokenizer import tokenize, normalize
+from asgiref.sync import sync_to_async
+from unittest import mock
+from datetime import timedelta
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import warnings
 
-# Create your tests here.
+### HELPER FUNCTIONS ###
+
+# small random corpus with variants of both kinds
+def make_corpus(seed=0, num_words=20, num_utterances=150):
+	rng = random.Random(seed)
+	speakers = [ Speaker.objects.create(name="Speaker " + str(i), type="hili") for i in range(4) ]
+	sources = [ Source.objects.create(name="Source " + str(i), url="https://example.com/" + str(i), version="1.0") for i in range(4) ]
+	words = [ Word.objects.create(word="w" + str(i)) for i in range(num_words) ]
+	for i in range(num_words // 2):
+		(word_a, word_b) = rng.sample(words, 2)
+		word_a.variants_same_word.add(word_b)
+		(word_a, word_b) = rng.sample(words, 2)
+		word_a.variants_grammatical.add(word_b)
+	for i in range(num_utterances):
+		utt_words = rng.sample(words, rng.randint(1, 5))
+		utterance = CompleteUtterance.objects.create(
+			utterance = " ".join(str(w) for w in utt_words),
+			speaker = rng.choice(speakers),
+			source = rng.choice(sources),
+		)
+		utterance.words.set(utt_words)
+	return rng
+
+
+### TESTS ###
+
+# what another process's change looks like to this one, once it reads the data version again:
+# the data changed without signals, then the version in the database was bumped
+def change_in_other_process(change):
+	change()
+	DataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+	caches["search"].delete(data_version_key("default"))
+
+class SearchBackendTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.rng = make_corpus()
+
+	def setUp(self):
+		# rolling back a test does not send signals
+		search_index.mark_stale()
+		caches["search"].clear()
+
+	def random_criteria(self):
+		rng = self.rng
+		word_pool = [ "w" + str(i) for i in range(20) ] + ["notaword"]
+		return SearchCriteria(
+			words = rng.sample(word_pool, rng.randint(0, 3)),
+			similar = rng.choice(["", "yes"]),
+			speaker = rng.choice(["", "Speaker 1", "Speaker 2", "Nobody"]),
+			source = rng.choice(["", "https://example.com/3", "https://example.com/none"]),
+		)
+
+	def test_memory_index_matches_orm(self):
+		for i in range(200):
+			search = compile_search(self.random_criteria())
+			with override_settings(SEARCH_BACKEND="orm"):
+				orm_ids = [ utt.id for utt in search.ordered_utterances() ]
+			with override_settings(SEARCH_BACKEND="memory"):
+				memory_ids = [ utt.id for utt in search.ordered_utterances() ]
+			self.assertEqual(orm_ids, memory_ids)
+
+	@override_settings(SEARCH_BACKEND="memory")
+	def test_memory_index_refreshes_on_change(self):
+		search = compile_search(SearchCriteria(words=["w0"]))
+		before = len(search.ordered_utterances())
+		utterance = CompleteUtterance.objects.create(utterance="w0", speaker=Speaker.objects.first(), source=Source.objects.first())
+		utterance.words.add(Word.objects.get(word="w0"))
+		self.assertEqual(len(search.ordered_utterances()), before + 1)
+
+	def test_filter_pages_match(self):
+		for params in [{ "words": "w1 w2", "similar": "yes" }, { "words": "w3 notaword", "speaker": "Speaker 1" }, { "source": "https://example.com/0" }]:
+			params["pageSize"] = 1000
+			with override_settings(SEARCH_BACKEND="orm"):
+				orm_page = self.client.get("/filter", params).context["db_page"]
+			with override_settings(SEARCH_BACKEND="memory"):
+				memory_page = self.client.get("/filter", params).context["db_page"]
+			self.assertEqual([ utt.id for utt in orm_page ], [ utt.id for utt in memory_page ])
+
+# the compiled search (one lookup query and one grouped query) against the filter chain it replaced
+# in this corpus every variant is a direct variant, so the groups are the same as the old variant lists
+class CompiledSearchTests(TestCase):
+	SAME_WORD = [("ya", "yaaa"), ("unu", "unuu")]
+	GRAMMATICAL = [("mi", "mimi"), ("unu", "unuunu"), ("unuu", "unuunu")]
+
+	@classmethod
+	def setUpTestData(cls):
+		rng = random.Random(13)
+		words = { w: Word.objects.create(word=w) for w in ["ya", "yaaa", "mi", "mimi", "nye", "unu", "unuu", "unuunu"] }
+		for (word_a, word_b) in cls.SAME_WORD:
+			words[word_a].variants_same_word.add(words[word_b])
+		for (word_a, word_b) in cls.GRAMMATICAL:
+			words[word_a].variants_grammatical.add(words[word_b])
+		speaker = Speaker.objects.create(name="Speaker 0", type="hili")
+		source = Source.objects.create(name="Source 0", url="https://example.com/0", version="1.0")
+		for i in range(60):
+			utt_words = rng.sample(list(words.values()), rng.randint(1, 4))
+			utterance = CompleteUtterance.objects.create(utterance=" ".join(str(w) for w in utt_words), speaker=speaker, source=source)
+			utterance.words.set(utt_words)
+
+	# the filter chain from before the compiled search: each word's variants, one filter per word
+	def old_filter_ids(self, words, similar):
+		utterances = CompleteUtterance.objects.all()
+		for word_string in words:
+			word = Word.objects.get(word=word_string)
+			variants = [word] + list(word.variants_same_word.all())
+			if similar:
+				variants += list(word.variants_grammatical.all())
+			utterances = utterances.filter(id__in=CompleteUtterance.objects.filter(words__in=variants))
+		return set(utterances.values_list('id', flat=True))
+
+	def groups(self, word_string):
+		word = Word.objects.get(word=word_string)
+		return (word.same_word_group, word.grammatical_group)
+
+	def test_matches_old_filter_chain(self):
+		for words in [["ya"], ["yaaa"], ["mi"], ["mimi", "nye"], ["unu"], ["unuunu", "ya"], ["ya", "mi", "nye"]]:
+			for similar in ["", "yes"]:
+				with self.subTest(words=words, similar=similar):
+					search = compile_search(SearchCriteria(words=words, similar=similar))
+					ids = set(search.utterances().values_list('id', flat=True))
+					self.assertEqual(ids, self.old_filter_ids(words, similar))
+					self.assertEqual(ids, set(CompleteUtterance.objects.filter(id__in=search.matching_utterance_ids()).values_list('id', flat=True)))
+					self.assertTrue(ids) # not trivially equal
+
+	def test_variants_widen_matches(self):
+		exact = set(CompleteUtterance.objects.filter(words="mi").values_list('id', flat=True))
+		similar = set(compile_search(SearchCriteria(words=["mi"], similar="yes")).utterances().values_list('id', flat=True))
+		self.assertLess(exact, similar)
+
+	def test_lookup_existing_groups(self):
+		existing = lookup_existing(SearchCriteria(words=["yaaa", "mimi", "notaword"], speaker="Speaker 0", source="https://example.com/none"))
+		self.assertEqual(existing["words"][normalize("yaaa")], self.groups("yaaa"))
+		self.assertEqual(existing["words"]["mimi"], self.groups("mimi"))
+		self.assertEqual(set(existing["words"]), { normalize("yaaa"), "mimi" })
+		self.assertEqual(set(existing["speaker"]), {"Speaker 0"})
+		self.assertEqual(existing["source"], {})
+
+	def test_unknown_criteria_are_nonexistent(self):
+		search = compile_search(SearchCriteria(words=["ya", "notaword", "alsonot"], speaker="Nobody", source="https://example.com/none"))
+		self.assertEqual(search.words, ["ya"])
+		self.assertEqual(search.nonexistent_values, {
+			"words": "'notaword', 'alsonot'",
+			"speaker": "Nobody",
+			"source": "https://example.com/none",
+		})
+		self.assertEqual(compile_search(SearchCriteria(words=["ya"], speaker="Speaker 0")).nonexistent_values, {})
+
+class VariantGroupTests(TestCase):
+	def setUp(self):
+		caches["search"].clear() # the version read from the database, which rolling back a test resets
+		self.words = { w: Word.objects.create(word=w) for w in ["ya", "yaaa", "yaya", "mi", "mimi"] }
+
+	def groups(self, word_string):
+		word = Word.objects.get(word=word_string)
+		return (word.same_word_group, word.grammatical_group)
+
+	def test_groups_are_transitive(self):
+		self.words["ya"].variants_grammatical.add(self.words["yaya"])
+		self.assertEqual(self.groups("yaaa"), ("ya", "ya"))
+		self.assertEqual(self.groups("yaya"), ("yaya", "ya"))
+		self.assertEqual(self.groups("mi"), ("mi", "mi"))
+
+	def test_groups_split_when_variant_removed(self):
+		self.words["ya"].variants_same_word.add(self.words["yaya"])
+		self.words["ya"].variants_same_word.remove(self.words["yaya"])
+		self.assertEqual(self.groups("yaya"), ("yaya", "yaya"))
+		self.words["mimi"].variants_grammatical.set([self.words["mi"]])
+		self.words["mimi"].variants_grammatical.clear()
+		self.assertEqual(self.groups("mimi"), ("mimi", "mimi"))
+
+	def test_elongated_forms_are_the_same_word(self):
+		self.assertEqual(normalize("Yaaaa"), "ya")
+		self.assertEqual(tokenize("Yaaaa, mimi!"), ["yaaaa", "mimi"])
+		self.assertEqual(Word.objects.get(word="yaaa").normalized, "ya")
+		self.assertEqual(self.groups("yaaa"), ("ya", "ya"))
+		Word.objects.create(word="yaaaaaa")
+		self.assertEqual(self.groups("yaaaaaa"), ("ya", "ya"))
+
+	def test_double_letters_are_not_elongation(self):
+		self.assertEqual(normalize("unuu"), "unuu")
+		self.assertEqual(normalize("Yoo"), "yoo")
+		self.assertEqual(normalize("unuuu"), "unu")
+		Word.objects.create(word="unu")
+		Word.objects.create(word="unuu")
+		self.assertEqual(self.groups("unuu"), ("unuu", "unuu"))
+		self.assertEqual(self.groups("unu"), ("unu", "unu"))
+
+	def test_search_does_not_depend_on_typed_variant(self):
+		self.words["yaaa"].variants_same_word.add(self.words["ya"])
+		self.words["ya"].variants_grammatical.add(self.words["yaya"])
+		utterance = CompleteUtterance.objects.create(
+			utterance = "yaya",
+			speaker = Speaker.objects.create(name="Speaker", type="hili"),
+			source = Source.objects.create(name="Source", url="https://example.com/", version="1.0"),
+		)
+		utterance.words.add(self.words["yaya"])
+		for word_string in ["ya", "yaaa", "yaya", "yaaaaaaaa"]: # the last one is not in the database
+			search = compile_search(SearchCriteria(words=[word_string], similar="yes"))
+			self.assertEqual([ utt.id for utt in search.ordered_utterances() ], [utterance.id])
+
+	def test_rebuild_changes_data_version(self):
+		Word.objects.filter(word="yaaa").update(same_word_group="yaaa", grammatical_group="yaaa") # no signals
+		version = get_data_state()[0]
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('rebuild_word_variants', stdout=open(os.devnull, 'w'))
+		self.assertEqual(self.groups("yaaa"), ("ya", "ya"))
+		self.assertGreater(get_data_state()[0], version)
+
+	def test_backfill_changes_data_version(self):
+		Word.objects.filter(word="yaaa").update(normalized="yaaa", same_word_group="yaaa", grammatical_group="yaaa") # no signals
+		version = get_data_state()[0]
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('backfill_normalized_words', stdout=open(os.devnull, 'w'))
+		self.assertEqual(Word.objects.get(word="yaaa").normalized, "ya")
+		self.assertEqual(self.groups("yaaa"), ("ya", "ya"))
+		self.assertGreater(get_data_state()[0], version)
+
+class KeysetPaginationTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=1, num_utterances=45)
+
+	@mock.patch.object(pagination, "NUMBERED_PAGES_LIMIT", 10)
+	def test_cursor_pages_follow_numbered_order(self):
+		expected = list(CompleteUtterance.objects.order_by('source', 'id').values_list('id', flat=True))
+		seen = []
+		response = self.client.get("/view", { "pageSize": 10 })
+		self.assertTrue(response.context["keyset"])
+		pages = [response.context["db_page"]]
+		while pages[-1].has_next():
+			seen += [ utt.id for utt in pages[-1] ]
+			response = self.client.get("/view", { "pageSize": 10, "cursor": pages[-1].next_cursor })
+			pages.append(response.context["db_page"])
+		seen += [ utt.id for utt in pages[-1] ]
+		self.assertEqual(seen, expected)
+		# and back again
+		previous = self.client.get("/view", { "pageSize": 10, "cursor": pages[-1].previous_cursor }).context["db_page"]
+		self.assertEqual([ utt.id for utt in previous ], [ utt.id for utt in pages[-2] ])
+
+	def test_small_results_keep_page_numbers(self):
+		response = self.client.get("/filter", { "speaker": "Speaker 1", "pageSize": 5 })
+		self.assertFalse(response.context["keyset"])
+		self.assertTrue(response.context["page_range"])
+
+	def test_invalid_cursor_is_first_page(self):
+		self.assertIsNone(pagination.decode_cursor("not a cursor"))
+		response = self.client.get("/view", { "cursor": "bm9wZQ" })
+		self.assertEqual(response.status_code, 200)
+
+class SearchCacheTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=2, num_utterances=30)
+
+	def setUp(self):
+		caches["search"].clear()
+
+	def test_cache_hit_needs_no_queries(self):
+		(search, ordered) = cached_search(SearchCriteria(words=["w2", "w1", "w1", "nope"]))
+		expected = [ utt.id for utt in ordered[:100] ]
+		with self.assertNumQueries(0):
+			(search, ordered) = cached_search(SearchCriteria(words=["w1", "w2", "nope"]))
+			self.assertEqual(search.nonexistent_values, { "words": "'nope'" })
+			ids = ordered.ids
+		self.assertEqual(ids, expected)
+
+	def test_cache_invalidated_by_change(self):
+		(search, ordered) = cached_search(SearchCriteria(speaker="Speaker 1"))
+		before = len(ordered)
+		with self.captureOnCommitCallbacks(execute=True):
+			CompleteUtterance.objects.create(utterance="w0", speaker=Speaker.objects.get(name="Speaker 1"), source=Source.objects.first())
+		(search, ordered) = cached_search(SearchCriteria(speaker="Speaker 1"))
+		self.assertEqual(len(ordered), before + 1)
+
+	def test_cache_invalidated_by_other_process(self):
+		(search, ordered) = cached_search(SearchCriteria(speaker="Speaker 1"))
+		before = len(ordered)
+		moved = CompleteUtterance.objects.exclude(speaker__name="Speaker 1").values_list('id', flat=True)[:1]
+		change_in_other_process(lambda: CompleteUtterance.objects.filter(id__in=list(moved)).update(speaker=Speaker.objects.get(name="Speaker 1")))
+		(search, ordered) = cached_search(SearchCriteria(speaker="Speaker 1"))
+		self.assertEqual(len(ordered), before + 1)
+
+	def test_version_bumped_after_commit(self):
+		version = get_data_state()[0]
+		with self.captureOnCommitCallbacks(execute=True):
+			Word.objects.create(word="newword1")
+			Word.objects.create(word="newword2")
+			self.assertEqual(get_data_state()[0], version)
+		self.assertGreater(get_data_state()[0], version)
+
+	def test_file_cache_evicts_least_recently_used(self):
+		with tempfile.TemporaryDirectory() as directory:
+			cache = LRUFileBasedCache(directory, { "OPTIONS": { "MAX_ENTRIES": 3, "CULL_FREQUENCY": 3 } })
+			for (i, key) in enumerate(["a", "b", "c"]):
+				cache.set(key, i)
+				os.utime(cache._key_to_file(key), (i, i)) # make the order of use unambiguous
+			cache.get("a") # "b" is now the least recently used
+			cache.set("d", 3)
+			self.assertIsNone(cache.get("b"))
+			self.assertEqual(cache.get("a"), 0)
+
+# maximum number of queries for each public view, whatever the page size or the number of words
+# if a change needs more, it probably added an N+1 query; raise a budget only on purpose
+class QueryBudgetTests(TestCase):
+	QUERY_BUDGETS = [
+		# (url name, args, GET parameters, budget)
+		("index", [], {}, 2),
+		("view", [], { "page": 2, "pageSize": 100 }, 2),
+		("filter", [], { "words": "w1 w2 w3", "similar": "yes", "pageSize": 100 }, 3),
+		("filter", [], { "speaker": "Speaker 1", "source": "https://example.com/1", "pageSize": 100 }, 3),
+		("filter", [], { "words": "nope", "newSearch": "yes", "pageSize": 100 }, 3),
+		("utterance", ["first utterance"], {}, 2),
+		("word", ["w1"], {}, 3),
+		("source", ["first source"], {}, 2),
+		("speaker", ["first speaker"], {}, 1),
+		("select", [], {}, 3),
+	]
+
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=3, num_utterances=120)
+
+	def setUp(self):
+		caches["search"].clear()
+		get_data_state() # read once every settings.DATA_VERSION_MAX_AGE seconds, not once per request
+
+	def resolve_args(self, args):
+		placeholders = {
+			"first utterance": CompleteUtterance.objects.order_by('id').first().id,
+			"first source": Source.objects.order_by('id').first().id,
+			"first speaker": Speaker.objects.order_by('id').first().id,
+		}
+		return [ placeholders.get(arg, arg) for arg in args ]
+
+	def assertWithinQueryBudget(self, url, params, budget):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url, params)
+		self.assertEqual(response.status_code, 200)
+		self.assertLessEqual(
+			len(queries), budget,
+			url + " made " + str(len(queries)) + " queries (budget " + str(budget) + "):\n" + "\n".join(q["sql"] for q in queries.captured_queries)
+		)
+
+	def test_public_views_within_budget(self):
+		for (url_name, args, params, budget) in self.QUERY_BUDGETS:
+			url = reverse("hilichurlian_database:" + url_name, args=self.resolve_args(args))
+			with self.subTest(url=url, params=params):
+				self.assertWithinQueryBudget(url, params, budget)
+
+class SelectPageTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=8, num_utterances=20)
+		Speaker.objects.create(name="Student 0", type="stud")
+
+	def setUp(self):
+		caches["search"].clear()
+
+	def test_rendered_once_and_not_modified(self):
+		url = reverse("hilichurlian_database:select")
+		first = self.client.get(url)
+		self.assertContains(first, "?speaker=Student%200")
+		with self.assertNumQueries(0):
+			self.assertEqual(self.client.get(url).content, first.content)
+			not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+		self.assertEqual(not_modified.status_code, 304)
+
+	def test_invalidated_by_change(self):
+		url = reverse("hilichurlian_database:select")
+		first = self.client.get(url)
+		with self.captureOnCommitCallbacks(execute=True):
+			Word.objects.create(word="newword")
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, "?words=newword")
+
+	def test_invalidated_by_other_process(self):
+		url = reverse("hilichurlian_database:select")
+		first = self.client.get(url)
+		change_in_other_process(lambda: Word.objects.bulk_create([Word(word="newword")]))
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, "?words=newword")
+
+class ConditionalGetTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=9, num_utterances=20)
+
+	def setUp(self):
+		caches["search"].clear()
+
+	def test_not_modified_without_queries(self):
+		urls = [
+			reverse("hilichurlian_database:index"),
+			reverse("hilichurlian_database:filter") + "?words=w1",
+			reverse("hilichurlian_database:utterance", args=[CompleteUtterance.objects.first().id]),
+			reverse("hilichurlian_database:word", args=["w1"]),
+		]
+		for url in urls:
+			with self.subTest(url=url):
+				response = self.client.get(url)
+				with self.assertNumQueries(0):
+					self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+					self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+
+	def test_change_makes_pages_modified(self):
+		url = reverse("hilichurlian_database:word", args=["w1"])
+		response = self.client.get(url)
+		with self.captureOnCommitCallbacks(execute=True):
+			Word.objects.get(word="w1").variants_same_word.add(Word.objects.get(word="w2"))
+		self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+	def test_new_release_makes_pages_modified(self):
+		url = reverse("hilichurlian_database:word", args=["w1"])
+		response = self.client.get(url)
+		with mock.patch("hilichurlian_database.caching.RELEASE_ID", "next-release"):
+			self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+		with mock.patch("hilichurlian_database.caching.STARTED", timezone.now() + timedelta(days=1)):
+			self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 200)
+
+	def test_other_process_change_makes_pages_modified(self):
+		url = reverse("hilichurlian_database:word", args=["w1"])
+		response = self.client.get(url)
+		change_in_other_process(lambda: Word.objects.filter(word="w1").update(normalized="w1changed"))
+		modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"], HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+		self.assertEqual(modified.status_code, 200)
+		self.assertNotEqual(modified["ETag"], response["ETag"])
+
+class RowCacheTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=10, num_utterances=40)
+
+	def setUp(self):
+		caches["search"].clear()
+		caches["rows"].clear()
+
+	def get_page(self):
+		return self.client.get(reverse("hilichurlian_database:view"), { "page": 1, "pageSize": 40 }).content
+
+	def test_rows_rendered_once(self):
+		first = self.get_page()
+		with mock.patch("hilichurlian_database.caching.get_template") as get_template:
+			self.assertEqual(self.get_page(), first)
+		get_template.assert_not_called()
+
+	# a big page does not evict cached searches, and cached searches do not evict its rows
+	def test_rows_in_their_own_cache(self):
+		first = self.get_page()
+		keys = [ row_cache_key(utterance) for utterance in table_utterances().order_by('source', 'id') ]
+		self.assertEqual(len(caches["rows"].get_many(keys)), 40)
+		self.assertEqual(caches["search"].get_many(keys), {})
+		caches["search"].clear()
+		with mock.patch("hilichurlian_database.caching.get_template") as get_template:
+			self.assertEqual(self.get_page(), first)
+		get_template.assert_not_called()
+
+	def test_changed_row_rendered_again(self):
+		self.get_page()
+		utterance = CompleteUtterance.objects.order_by('source', 'id').first()
+		utterance.speaker.name = "Renamed speaker"
+		utterance.speaker.save()
+		with mock.patch("hilichurlian_database.caching.get_template", wraps=get_template) as counted:
+			self.assertIn(b"Renamed speaker", self.get_page())
+		self.assertEqual(counted.call_count, utterance.speaker.completeutterance_set.count())
+
+class EntrySerializationTests(TestCase):
+	ORDER = ["utterance", "words", "speaker", "translation", "translation_source", "context", "source"]
+
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=4, num_utterances=20)
+
+	def test_many_entries_in_constant_queries(self):
+		with self.assertNumQueries(2): # utterances with speaker and source, then words
+			dicts = CompleteUtterance.get_fields_as_dicts(CompleteUtterance.objects.all(), self.ORDER)
+		self.assertEqual(len(dicts), 20)
+		(utterance, values) = dicts[0]
+		self.assertEqual(values["utterance"], [utterance.utterance])
+		self.assertEqual(values["speaker"], [utterance.speaker])
+		self.assertEqual(values["words"], list(utterance.words.all()))
+		self.assertEqual(values["translation"], []) # blank
+
+	def test_choices_use_display_value(self):
+		speaker = Speaker.objects.first()
+		self.assertEqual(speaker.get_fields_as_dict(["name", "type"]), { "name": [speaker.name], "type": ["Hilichurl"] })
+
+# on SQLite, fulltext.py falls back to substring matches
+class TextSearchTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		speaker = Speaker.objects.create(name="Hilichurl Fighter", type="hili")
+		source = Source.objects.create(name="Hilichurlian Studies", url="https://example.com/studies", version="1.0")
+		cls.meat = CompleteUtterance.objects.create(utterance="mosi mita", translation="[I want to eat meat.]", speaker=speaker, source=source)
+		cls.other = CompleteUtterance.objects.create(utterance="olah", context="A greeting.", speaker=speaker, source=source)
+
+	def setUp(self):
+		caches["search"].clear()
+
+	def search_ids(self, **criteria):
+		(search, ordered) = cached_search(SearchCriteria(**criteria))
+		return [ utt.id for utt in ordered[:100] ]
+
+	def test_english_text(self):
+		self.assertEqual(self.search_ids(text="eat MEAT"), [self.meat.id])
+		self.assertEqual(self.search_ids(text="greeting"), [self.other.id])
+		self.assertEqual(self.search_ids(text="greeting meat"), [])
+
+	def test_fuzzy_names(self):
+		self.assertEqual(self.search_ids(speaker_like="fighter"), [self.meat.id, self.other.id])
+		self.assertEqual(self.search_ids(source_like="studies", text="meat"), [self.meat.id])
+
+	def test_filter_view_keeps_text_criteria(self):
+		response = self.client.get("/filter", { "text": "meat", "newSearch": "yes" })
+		self.assertEqual([ utt.id for utt in response.context["db_page"] ], [self.meat.id])
+		self.assertIn("text=meat", response.context["existing"])
+
+	def test_links_keep_special_characters(self):
+		criteria = { "text": "meat & 100% #1+", "speakerLike": "fighter&source=x", "sourceLike": "studies" }
+		response = self.client.get("/filter", dict(criteria, newSearch="yes", pageSize=1))
+		self.assertEqual([ utt.id for utt in response.context["db_page"] ], [self.meat.id])
+		links = QueryDict(response.context["existing"])
+		self.assertEqual({ name: links[name] for name in criteria }, criteria)
+		self.assertEqual(links.getlist("source"), [])
+		self.assertEqual(links["pageSize"], "1")
+
+class ExportTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=5, num_utterances=30)
+
+	def test_jsonl_export_of_search(self):
+		response = self.client.get("/export/jsonl", { "speaker": "Speaker 2" })
+		rows = [ json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines() ]
+		expected = CompleteUtterance.objects.filter(speaker__name="Speaker 2").order_by('source', 'id')
+		self.assertEqual([ row["id"] for row in rows ], [ utt.id for utt in expected ])
+		self.assertEqual(rows[0]["words"], sorted(w.word for w in expected[0].words.all()))
+
+	def test_csv_export_in_constant_queries(self):
+		with self.assertNumQueries(2): # utterances with speakers and sources, then their words
+			response = self.client.get("/export/csv")
+			lines = b"".join(response.streaming_content).decode().splitlines()
+		self.assertEqual(len(lines), 31) # header and every utterance
+
+	def test_unknown_criteria_export_nothing(self):
+		response = self.client.get("/export/csv", { "speaker": "Nobody" })
+		self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 1)
+		self.assertEqual(self.client.get("/export/xml").status_code, 404)
+
+class ImportTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		Speaker.objects.create(name="Speaker 0", type="hili")
+		Word.objects.create(word="ya")
+
+	def write_rows(self, rows):
+		with tempfile.NamedTemporaryFile('w', suffix=".jsonl", delete=False, encoding='utf-8') as import_file:
+			for row in rows:
+				import_file.write(json.dumps(row) + "\n")
+		self.addCleanup(os.remove, import_file.name)
+		return import_file.name
+
+	def make_rows(self, count):
+		return [
+			{ "utterance": "Ya yaaa mimi " + str(i % 7), "speaker": "Speaker " + str(i % 2), "speaker_type": "stud", "source_url": "https://example.com/" + str(i % 3), "version": "2.0" }
+			for i in range(count)
+		]
+
+	def test_import_creates_everything_in_bulk(self):
+		path = self.write_rows(self.make_rows(40))
+		with CaptureQueriesContext(connection) as queries:
+			call_command('import_utterances', path, stdout=open(os.devnull, 'w'))
+		self.assertLess(len(queries), 30) # per batch, not per row or word
+		self.assertEqual(CompleteUtterance.objects.count(), 40)
+		self.assertEqual(CompleteUtterance.object_history.count(), 40)
+		self.assertEqual(Speaker.objects.get(name="Speaker 0").type, "hili") # existing speaker is reused
+		self.assertEqual(Speaker.objects.get(name="Speaker 1").type, "stud")
+		self.assertEqual(Source.objects.count(), 3)
+		utterance = CompleteUtterance.objects.filter(utterance="Ya yaaa mimi 3").first()
+		self.assertEqual(sorted(w.word for w in utterance.words.all()), ["3", "mimi", "ya", "yaaa"])
+		# derived fields of the new words
+		self.assertEqual(Word.objects.get(word="yaaa").same_word_group, "ya")
+		self.assertEqual(Word.object_history.filter(word="mimi").count(), 1)
+
+	def test_dry_run_saves_nothing(self):
+		path = self.write_rows(self.make_rows(5))
+		call_command('import_utterances', path, dry_run=True, stdout=open(os.devnull, 'w'))
+		self.assertEqual(CompleteUtterance.objects.count(), 0)
+		self.assertEqual(Word.objects.count(), 1)
+
+	def test_new_source_needs_version(self):
+		rows = self.make_rows(1)
+		rows[0]["version"] = ""
+		with self.assertRaises(CommandError):
+			call_command('import_utterances', self.write_rows(rows), stdout=open(os.devnull, 'w'))
+
+	def test_history_only_for_words_created_here(self):
+		# another process creates "mimi" (with its own history) after the existing words were looked up
+		def create_concurrently(word):
+			if not Word.objects.filter(word="mimi").exists():
+				Word.objects.bulk_create([Word(word="mimi", same_word_group="mimi", grammatical_group="mimi")])
+			return word
+		with mock.patch("hilichurlian_database.ingest.normalize", side_effect=create_concurrently):
+			new_words = ingest.create_missing_words(["ya", "mimi", "nye"])
+		self.assertEqual(new_words, ["nye"])
+		self.assertEqual(Word.object_history.filter(word="mimi").count(), 0)
+		self.assertEqual(Word.object_history.filter(word="nye").count(), 1)
+
+# the submission URLs only exist when submissions are open, so the view is called directly
+@mock.patch("hilichurlian_database.views.SUBMISSIONS_OPEN", True)
+@mock.patch("hilichurlian_database.views.redirect", mock.Mock())
+class SubmissionTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.speaker = Speaker.objects.create(name="Speaker 0", type="hili")
+		cls.source = Source.objects.create(name="Source 0", url="https://example.com/0", version="1.0")
+		Word.objects.create(word="ya")
+
+	def submit(self, utterance):
+		request = RequestFactory().post("/add_data/utterance", { "utterance": utterance, "speaker": self.speaker.id, "source": self.source.id })
+		request.session = {}
+		request._messages = FallbackStorage(request)
+		with CaptureQueriesContext(connection) as queries:
+			views.add_data(request, "utterance")
+		return len(queries)
+
+	def test_cost_does_not_depend_on_number_of_words(self):
+		short = self.submit("Ya mi")
+		long = self.submit("Ya mimi nye gusha olah unu upa dada celi")
+		self.assertEqual(short, long)
+		utterance = CompleteUtterance.objects.get(utterance="Ya mimi nye gusha olah unu upa dada celi")
+		self.assertEqual(utterance.words.count(), 9)
+		self.assertEqual(CompleteUtterance.object_history.filter(id=utterance.id).count(), 1)
+
+	def test_failure_leaves_no_utterance(self):
+		with mock.patch("hilichurlian_database.ingest.create_missing_words", side_effect=RuntimeError):
+			with self.assertRaises(RuntimeError):
+				self.submit("Ya mi")
+		self.assertFalse(CompleteUtterance.objects.exists())
+
+class RelinkWordsTests(TestCase):
+	def setUp(self):
+		speaker = Speaker.objects.create(name="Speaker 0", type="hili")
+		source = Source.objects.create(name="Source 0", url="https://example.com/0", version="1.0")
+		self.utterances = [
+			CompleteUtterance.objects.create(utterance=text, speaker=speaker, source=source)
+			for text in ["Ya mi", "Mimi nye", "Olah ya", "Unu"]
+		]
+		for utterance in self.utterances:
+			ingest.link_words([utterance])
+		# out of date links
+		self.utterances[0].words.remove("mi")
+		self.utterances[1].words.add(Word.objects.create(word="stale"))
+
+	def test_links_match_tokenizer(self):
+		call_command('relink_words', chunk_size=3, stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+		for utterance in self.utterances:
+			self.assertEqual(set(utterance.words.values_list('word', flat=True)), set(tokenize(utterance.utterance)))
+		self.assertTrue(Word.objects.filter(word="stale").exists())
+
+	def test_resume_and_delete_orphans(self):
+		call_command('relink_words', after=self.utterances[0].id, delete_orphans=True, stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+		self.assertFalse(self.utterances[0].words.filter(word="mi").exists()) # before the resume point
+		self.assertFalse(Word.objects.filter(word="stale").exists())
+
+@override_settings(SESSION_COOKIE_SECURE=False)
+class AdminBulkUpdateTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=6, num_utterances=250)
+		cls.user = User.objects.create_superuser("admin", "admin@example.com", "password")
+
+	def setUp(self):
+		self.client.force_login(self.user)
+		self.changelist = reverse("admin:hilichurlian_database_completeutterance_changelist")
+
+	def select_all(self):
+		response = self.client.post(self.changelist, {
+			"action": "update_multiple_utterances",
+			"_selected_action": [CompleteUtterance.objects.first().pk],
+			"select_across": "1",
+			"index": "0",
+		})
+		self.assertEqual(response.status_code, 302)
+		self.assertLess(len(response["Location"]), 100) # a token, not every pk
+		return response["Location"].split("selection=")[1]
+
+	def test_preview_pages_in_constant_queries(self):
+		token = self.select_all()
+		define = self.changelist + "update_multiple_define"
+		with CaptureQueriesContext(connection) as first_page:
+			response = self.client.get(define, { "selection": token })
+		self.assertContains(response, "Objects that will be updated (250)")
+		with CaptureQueriesContext(connection) as last_page:
+			self.client.get(define, { "selection": token, "page": 3 })
+		self.assertEqual(len(first_page), len(last_page))
+
+	def test_preview_fetches_only_its_page(self):
+		token = self.select_all()
+		define = self.changelist + "update_multiple_define"
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(define, { "selection": token, "page": 2 })
+		expected = list(CompleteUtterance.objects.order_by('source', 'id').values_list('id', flat=True)[100:200])
+		self.assertEqual([ utt.id for utt in response.context["objects_to_update"] ], expected)
+		utterance_queries = [ query["sql"] for query in queries.captured_queries if 'FROM "hilichurlian_database_completeutterance"' in query["sql"] ]
+		self.assertEqual(len(utterance_queries), 1)
+		self.assertEqual(len(utterance_queries[0].split(" IN (")[1].split(")")[0].split(",")), 100)
+		# nothing in the session, so other admin pages do not load the selection
+		self.assertFalse([ key for key in self.client.session.keys() if "selection" in key ])
+
+	def test_selection_belongs_to_its_user(self):
+		token = self.select_all()
+		self.client.force_login(User.objects.create_superuser("other", "other@example.com", "password"))
+		response = self.client.get(self.changelist + "update_multiple_define", { "selection": token })
+		self.assertContains(response, "Objects that will be updated (0)")
+
+	def test_execute_updates_every_selected_utterance(self):
+		token = self.select_all()
+		speaker = Speaker.objects.get(name="Speaker 3")
+		self.client.post(reverse("admin:update_multiple_execute"), { "selection": token, "speaker-checked": "update", "speaker": speaker.pk })
+		self.assertEqual(CompleteUtterance.objects.exclude(speaker=speaker).count(), 0)
+		self.assertEqual(CompleteUtterance.object_history.filter(history_type="~").count(), 250)
+		# the selection is used up
+		response = self.client.post(reverse("admin:update_multiple_execute"), { "selection": token, "speaker-checked": "update", "speaker": speaker.pk }, follow=True)
+		self.assertContains(response, "No objects selected")
+
+@override_settings(SESSION_COOKIE_SECURE=False)
+class AdminScalingTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=7, num_utterances=120)
+		cls.user = User.objects.create_superuser("admin", "admin@example.com", "password")
+
+	def setUp(self):
+		self.client.force_login(self.user)
+
+	def test_changelist_joins_speakers_and_sources(self):
+		changelist = reverse("admin:hilichurlian_database_completeutterance_changelist")
+		with CaptureQueriesContext(connection) as unfiltered:
+			self.client.get(changelist)
+		with CaptureQueriesContext(connection) as filtered:
+			response = self.client.get(changelist, { "source__version": "1.0", "speaker__type": "hili" })
+		self.assertEqual(response.status_code, 200)
+		self.assertLess(len(unfiltered), 15) # not one per row
+		self.assertEqual(len(filtered), len(unfiltered)) # no count of the whole table
+
+	# as on PostgreSQL: the planner's estimate, from EXPLAIN (SQLite has no estimate, so its plan is not parsed here)
+	@mock.patch("hilichurlian_database.pagination.planner_estimate", return_value=1234)
+	def test_changelist_does_not_count(self, planner_estimate):
+		changelist = reverse("admin:hilichurlian_database_completeutterance_changelist")
+		for params in [{}, { "source__version": "1.0" }]:
+			with self.subTest(params=params):
+				with mock.patch.object(connection, "vendor", "postgresql"):
+					with CaptureQueriesContext(connection) as queries:
+						response = self.client.get(changelist, params)
+				self.assertEqual(response.status_code, 200)
+				statements = [ query["sql"] for query in queries.captured_queries ]
+				self.assertFalse([ sql for sql in statements if "COUNT(" in sql.upper() ], statements)
+				self.assertTrue([ sql for sql in statements if sql.startswith("EXPLAIN") ])
+				self.assertContains(response, "1234")
+
+	def test_autocomplete_searches_by_prefix(self):
+		def autocomplete(term):
+			response = self.client.get(reverse("admin:autocomplete"), {
+				"term": term,
+				"app_label": "hilichurlian_database",
+				"model_name": "completeutterance",
+				"field_name": "speaker",
+			})
+			return [ result["text"] for result in response.json()["results"] ]
+		self.assertEqual(len(autocomplete("speak")), 4)
+		self.assertEqual(autocomplete("peaker"), [])
+
+	def test_autocomplete_pages_are_ordered(self):
+		for (model_name, field_name, term) in [("completeutterance", "speaker", "speak"), ("completeutterance", "source", "sour"), ("completeutterance", "words", "w"), ("source", "related_sources", "sour")]:
+			with self.subTest(field_name=field_name):
+				with warnings.catch_warnings():
+					warnings.simplefilter("error", UnorderedObjectListWarning)
+					response = self.client.get(reverse("admin:autocomplete"), {
+						"term": term,
+						"app_label": "hilichurlian_database",
+						"model_name": model_name,
+						"field_name": field_name,
+					})
+				texts = [ result["text"] for result in response.json()["results"] ]
+				self.assertTrue(texts)
+				self.assertEqual(texts, sorted(texts))
+
+	def test_forms_do_not_list_every_option(self):
+		utterance = CompleteUtterance.objects.first()
+		response = self.client.get(reverse("admin:hilichurlian_database_completeutterance_change", args=[utterance.pk]))
+		self.assertNotContains(response, ">Speaker 3</option>" if utterance.speaker.name != "Speaker 3" else ">Speaker 2</option>")
+		self.assertNotContains(response, "<option value=\"w19\"" if not utterance.words.filter(word="w19").exists() else "<option value=\"w18\"")
+
+class ApiTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=11, num_utterances=60)
+
+	def setUp(self):
+		search_index.mark_stale()
+		caches["search"].clear()
+		get_data_state()
+
+	def get_json(self, url_name, params={}):
+		response = self.client.get(reverse("hilichurlian_database:" + url_name), params)
+		self.assertEqual(response["Content-Type"], "application/json")
+		return response.json()
+
+	def test_cursor_pages_cover_every_utterance(self):
+		ids = []
+		params = { "pageSize": 25 }
+		while True:
+			with self.assertNumQueries(2): # page, then its words
+				page = self.get_json("api_utterances", params)
+			ids += [ row["id"] for row in page["results"] ]
+			if not page["next"]:
+				break
+			params["cursor"] = page["next"]
+		self.assertEqual(ids, list(CompleteUtterance.objects.order_by('source', 'id').values_list('id', flat=True)))
+
+	def test_search_matches_filter(self):
+		criteria = SearchCriteria(words=["w1", "nope"], similar="yes")
+		expected = list(compile_search(criteria).ordered_utterances().values_list('id', flat=True))
+		page = self.get_json("api_utterances", { "words": "w1 nope", "similar": "yes", "pageSize": 1000 })
+		self.assertEqual([ row["id"] for row in page["results"] ], expected)
+		self.assertIn("words", page["nonexistent"])
+		self.assertEqual(self.get_json("api_utterances", { "speaker": "Nobody" })["results"], [])
+
+	def test_batches_in_fixed_queries(self):
+		ids = list(CompleteUtterance.objects.values_list('id', flat=True)[:30])
+		with self.assertNumQueries(2):
+			batch = self.get_json("api_utterance_batch", { "ids": ",".join(str(i) for i in ids + [0]) })
+		self.assertEqual([ row["id"] for row in batch["results"] ], ids)
+		self.assertEqual(batch["missing"], [0])
+		with self.assertNumQueries(3): # words, then both kinds of variants
+			batch = self.get_json("api_word_batch", { "words": "w3,w1,nope" })
+		self.assertEqual([ row["word"] for row in batch["results"] ], ["w3", "w1"])
+		self.assertEqual(batch["results"][1]["variants_same_word"], sorted(w.word for w in Word.objects.get(word="w1").variants_same_word.all()))
+		self.assertEqual(self.client.get(reverse("hilichurlian_database:api_speaker_batch"), { "ids": "x" }).status_code, 400)
+
+	def test_entry_cursor_pages(self):
+		words = []
+		params = { "pageSize": 7 }
+		while True:
+			page = self.get_json("api_words", params)
+			words += [ row["word"] for row in page["results"] ]
+			if not page["next"]:
+				break
+			params["cursor"] = page["next"]
+		self.assertEqual(words, sorted(Word.objects.values_list('word', flat=True)))
+
+	def test_bad_entry_cursor(self):
+		word_cursor = self.get_json("api_words", { "pageSize": 1 })["next"]
+		for (url_name, cursor) in [("api_speakers", word_cursor), ("api_sources", word_cursor), ("api_sources", api.encode_entry_cursor(True)), ("api_words", api.encode_entry_cursor(1)), ("api_words", "!!")]:
+			with self.subTest(url_name=url_name, cursor=cursor):
+				response = self.client.get(reverse("hilichurlian_database:" + url_name), { "cursor": cursor })
+				self.assertEqual(response.status_code, 400)
+				self.assertIn("error", response.json())
+
+class ServerTimingTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=12, num_utterances=20)
+
+	def test_disabled_by_default(self):
+		self.assertNotIn("Server-Timing", self.client.get(reverse("hilichurlian_database:index")))
+
+	@override_settings(SERVER_TIMING=True, SLOW_REQUEST_MS=0)
+	def test_headers_and_slow_request_log(self):
+		caches["search"].clear()
+		with self.assertLogs("hilichurlian_database.timing") as logs:
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(reverse("hilichurlian_database:index"))
+		self.assertIn('desc="' + str(len(queries)) + ' queries"', response["Server-Timing"])
+		self.assertIn("tpl;dur=", response["Server-Timing"])
+		slow = json.loads(logs.records[-1].getMessage())
+		self.assertEqual(logs.records[-1].levelname, "WARNING")
+		self.assertEqual(slow["queries"], len(queries))
+		self.assertTrue(slow["top_statements"])
+
+	# the async ORM runs the queries in a thread with its own connections
+	@override_settings(SERVER_TIMING=True)
+	async def test_async_view_queries_counted(self):
+		# the sync view makes the same queries
+		def count_sync_queries():
+			caches["search"].clear()
+			with CaptureQueriesContext(connection) as queries:
+				views.index(RequestFactory().get("/"))
+			return len(queries)
+		expected = await sync_to_async(count_sync_queries)()
+		self.assertGreater(expected, 0)
+		caches["search"].clear()
+		# created in the ORM's thread, like a worker's connections are opened after the middleware is
+		timed_index = await sync_to_async(ServerTimingMiddleware)(async_views.index)
+		with self.assertLogs("hilichurlian_database.timing") as logs:
+			response = await timed_index(AsyncRequestFactory().get("/"))
+		self.assertIn('desc="' + str(expected) + ' queries"', response["Server-Timing"])
+		self.assertEqual(json.loads(logs.records[0].getMessage())["queries"], expected)
+
+@override_settings(SESSION_COOKIE_SECURE=False)
+class StatelessSearchTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=10, num_utterances=30)
+		cls.user = User.objects.create_user("visitor")
+
+	def test_messages_in_context(self):
+		url = reverse("hilichurlian_database:filter")
+		response = self.client.get(url, { "words": "w1 nothere", "newSearch": "yes" })
+		self.assertEqual([ message["type"] for message in response.context["search_messages"] ], ["invalid criteria found", "successful new search"])
+		self.assertContains(response, '<li class="searched error">The following are not in the database: words - &#x27;nothere&#x27;</li>', html=True)
+		response = self.client.get(url, { "words": "nothere", "newSearch": "yes" })
+		self.assertEqual(response.context["search_messages"][-1]["type"], "no valid criteria")
+		self.assertEqual(self.client.get(url, { "words": "w1" }).context["search_messages"][0]["level"], "info")
+
+	def test_no_session_and_cacheable(self):
+		# a visitor with a session (e.g. from the admin) gets the same response, and the session is not loaded
+		self.client.force_login(self.user)
+		for url in ["/", "/filter?words=w2&newSearch=yes", "/select", "/word/w2"]:
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(url)
+			self.assertEqual(response.status_code, 200)
+			self.assertFalse([ query for query in queries if "django_session" in query["sql"] ], url)
+			self.assertFalse(response.cookies, url)
+			self.assertNotIn("Cookie", response.get("Vary", ""), url)
+			self.assertIn("public", response["Cache-Control"], url)
+
+class AsyncViewTests(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		make_corpus(seed=9, num_utterances=60)
+
+	def setUp(self):
+		caches["search"].clear()
+
+	# (status, content) of the sync and the async view for the same request
+	async def both(self, name, path, *args):
+		caches["search"].clear()
+		sync_response = await sync_to_async(getattr(views, name))(RequestFactory().get(path), *args)
+		caches["search"].clear()
+		async_response = await getattr(async_views, name)(AsyncRequestFactory().get(path), *args)
+		return ((sync_response.status_code, sync_response.content), (async_response.status_code, async_response.content))
+
+	async def test_same_pages_as_sync_views(self):
+		utterance = await CompleteUtterance.objects.order_by('id').afirst()
+		speaker = await Speaker.objects.afirst()
+		requests = [
+			("index", "/"),
+			("index", "/view?page=3&pageSize=5"),
+			("index", "/view?cursor=&pageSize=5"),
+			("filter", "/filter?words=w1+w2&newSearch=yes"),
+			("filter", "/filter?words=w3&similar=yes&speaker=" + speaker.name + "&page=2&pageSize=3"),
+			("filter", "/filter?words=nothere&newSearch=yes"),
+			("view_all_criteria", "/select"),
+		]
+		for (name, path) in requests:
+			(sync_page, async_page) = await self.both(name, path)
+			self.assertEqual(sync_page[0], 200)
+			self.assertEqual(sync_page, async_page, path)
+		for (name, args) in [("view_utterance", [utterance.id]), ("view_word", ["w1"]), ("view_source", [utterance.source_id]), ("view_speaker", [0])]:
+			(sync_page, async_page) = await self.both(name, "/", *args)
+			self.assertEqual(sync_page, async_page, name)
+
+	async def test_not_modified(self):
+		response = await async_views.index(AsyncRequestFactory().get("/"))
+		self.assertTrue(response.has_header("Last-Modified"))
+		# AsyncRequestFactory takes header names as they are sent
+		not_modified = await async_views.index(AsyncRequestFactory().get("/", **{ "if-none-match": response["ETag"] }))
+		self.assertEqual(not_modified.status_code, 304)
+
+	async def test_lookups_and_keyset_pages(self):
+		criteria = SearchCriteria(words=["w1", "nothere"], speaker="Speaker 1", source="https://example.com/missing")
+		self.assertEqual(await alookup_existing(criteria), await sync_to_async(lookup_existing)(criteria))
+		paginator = pagination.KeysetPaginator(table_utterances(), 7)
+		first = await paginator.aget_page("")
+		second = await paginator.aget_page(first.next_cursor)
+		self.assertEqual([ utt.id for utt in second ], [ utt.id for utt in await sync_to_async(paginator.get_page)(first.next_cursor) ])
+		previous = await paginator.aget_page(second.previous_cursor)
+		self.assertEqual([ utt.id for utt in previous ], [ utt.id for utt in first ])
+
+class BenchmarkTests(TestCase):
+	def test_small_run(self):
+		benchmark.generate_corpus(300, seed=1)
+		self.assertEqual(CompleteUtterance.objects.count(), 300)
+		self.assertTrue(Word.variants_same_word.through.objects.exists())
+		results = benchmark.run_scenarios(repeat=1)
+		self.assertEqual(set(results), set(name for (name, url_name, args, params) in benchmark.SCENARIOS))
+		self.assertTrue(all(result["status"] == 200 for result in results.values()))
+		self.assertEqual(benchmark.find_regressions(results, results), [])
+		worse = { "index": dict(results["index"], warm_queries=results["index"]["warm_queries"] - 1) }
+		self.assertEqual(len(benchmark.find_regressions({ "index": results["index"] }, worse)), 1)
+
+class LoadTestTests(LiveServerTestCase):
+	def test_percentiles_and_mix(self):
+		values = list(range(1, 101))
+		self.assertEqual([ loadtest.percentile(values, percent) for percent in loadtest.PERCENTILES ], [50, 95, 99])
+		self.assertEqual(loadtest.percentile([7], 99), 7)
+		self.assertEqual(loadtest.parse_mix("home=1, search=3"), { "home": 1, "search": 3 })
+		self.assertRaises(ValueError, loadtest.parse_mix, "admin=1")
+		self.assertRaises(ValueError, loadtest.parse_mix, "home=0")
+
+	def test_short_run(self):
+		benchmark.generate_corpus(100, seed=2)
+		mix = loadtest.discover_mix(self.live_server_url, loadtest.DEFAULT_MIX, max_page=3)
+		report = loadtest.run_load(self.live_server_url, mix, concurrency=2, duration=1)
+		self.assertGreater(report["requests"], 0)
+		self.assertEqual(report["errors"], 0)
+		for summary in report["endpoints"].values():
+			self.assertLessEqual(summary["p50_ms"], summary["p95_ms"])
+			self.assertLessEqual(summary["p95_ms"], summary["p99_ms"])
+		self.assertIn("p99_ms", loadtest.format_report("test", report))
+
+class ReplicaRouterTests(TestCase):
+	def test_routing(self):
+		router = ReplicaRouter()
+		factory = RequestFactory()
+		# outside of a request
+		self.assertEqual(router.db_for_read(Speaker), "default")
+		with override_settings(REPLICA_DATABASES=["replica_1"]):
+			with request_databases(factory.get("/filter")):
+				self.assertEqual(router.db_for_read(Speaker), "replica_1")
+				self.assertEqual(router.db_for_write(Speaker), "default")
+				# read-after-write
+				self.assertEqual(router.db_for_read(Speaker), "default")
+			for request in [factory.post("/add_data/speaker"), factory.get(reverse("admin:index") + "hilichurlian_database/speaker/")]:
+				with request_databases(request):
+					self.assertEqual(router.db_for_read(Speaker), "default")
+		self.assertTrue(router.allow_migrate("default", "hilichurlian_database"))
+		self.assertFalse(router.allow_migrate("replica_1", "hilichurlian_database"))
+
+	# a request on a replica that lags must not cache its data under the primary's newer version
+	def test_data_version_per_database(self):
+		caches["search"].clear()
+		primary_state = get_data_state()
+		caches["search"].set(data_version_key("replica_1"), (primary_state[0] - 1, primary_state[1]))
+		with override_settings(REPLICA_DATABASES=["replica_1"]):
+			with request_databases(RequestFactory().get("/filter")):
+				with self.assertNumQueries(0):
+					self.assertEqual(get_data_state()[0], primary_state[0] - 1)
+		self.assertEqual(get_data_state(), primary_state)
+
+	# the public pages show what is on the replica, the admin what is on the primary
+	def test_two_sqlite_files(self):
+		with tempfile.TemporaryDirectory() as directory:
+			primary = os.path.join(directory, "primary.sqlite3")
+			replica = os.path.join(directory, "replica.sqlite3")
+			env = dict(
+				os.environ,
+				DJANGO_SETTINGS_MODULE = "hilichurlian_database_project.settings",
+				DATABASE_URL = "sqlite:///" + primary,
+				REPLICA_DATABASE_URLS = "sqlite:///" + replica,
+				LOCAL_WORK = "False",
+				DJANGO_DEBUG = "False",
+			)
+			subprocess.run([sys.executable, "manage.py", "migrate", "--no-input", "-v", "0"], env=env, cwd=settings.BASE_DIR, check=True)
+			shutil.copy(primary, replica)
+			for (path, name) in [(primary, "Only on primary"), (replica, "Only on replica")]:
+				with sqlite3.connect(path) as database:
+					database.execute("INSERT INTO hilichurlian_database_speaker (name, type) VALUES (?, 'hili')", [name])
+			script = "; ".join([
+				"from django.conf import settings",
+				"from django.contrib.auth.models import User",
+				"from django.test import Client",
+				"client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])",
+				"public = client.get('/select', secure=True).content.decode()",
+				"client.force_login(User.objects.create_superuser('admin', '', 'password'))",
+				"admin = client.get('/" + reverse("admin:hilichurlian_database_speaker_changelist").lstrip("/") + "', secure=True).content.decode()",
+				"print([ name in page for page in [public, admin] for name in ['Only on primary', 'Only on replica'] ])",
+			])
+			result = subprocess.run([sys.executable, "manage.py", "shell", "-c", script], env=env, cwd=settings.BASE_DIR, check=True, capture_output=True, text=True)
+		self.assertEqual(result.stdout.strip(), str([False, True, True, False]))
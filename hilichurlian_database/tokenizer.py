@@ -0,0 +1,23 @@
+import re
+
+# how utterances are split into Words, and how elongated forms of a word are matched
+# used by submissions (add_data), searches, and the management commands, so that they always agree
+
+### CONSTANTS ###
+
+# no punctuation within words (yet)
+WORD_RE = re.compile(r'\w+')
+# a letter written three or more times in a row, e.g. the "aaaa" in "yaaaa"
+# not twice: a double letter is often part of the word (e.g. "unuu" is not "unu"), and is linked as a variant by hand if it is not
+REPEATED_LETTER_RE = re.compile(r'(\w)\1{2,}')
+
+
+### FUNCTIONS ###
+
+# list of lowercase words in the order they appear (with duplicates)
+def tokenize(text):
+	return WORD_RE.findall(text.lower())
+
+# the form of a word that all of its elongated forms share; e.g. "yaaaa" and "ya" are both "ya"
+def normalize(word):
+	return REPEATED_LETTER_RE.sub(r'\1', word.lower())
@@ -1,19 +1,34 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
+from . import async_views
+from . import api
 
 app_name = 'hilichurlian_database'
+# the public read views; the async versions are for ASGI servers (see async_views.py)
+read_views = async_views if getattr(settings, 'ASYNC_VIEWS', False) else views
 # be careful to not overlap with _project/urls.py
 urlpatterns = [
-	path('', views.index, name='index'),
-	path('view', views.index, name='view'),
+	path('', read_views.index, name='index'),
+	path('view', read_views.index, name='view'),
 	path('about', views.about, name='about'),
-	path('select', views.view_all_criteria, name='select'),
-	path('filter', views.filter, name='filter'),
-	path('utterance/<int:id>', views.view_utterance, name='utterance'),
-	path('word/<slug:word>', views.view_word, name='word'),
-	path('source/<int:id>', views.view_source, name='source'),
-	path('speaker/<int:id>', views.view_speaker, name='speaker')
+	path('select', read_views.view_all_criteria, name='select'),
+	path('filter', read_views.filter, name='filter'),
+	path('export/<slug:export_format>', views.export_utterances, name='export'),
+	path('utterance/<int:id>', read_views.view_utterance, name='utterance'),
+	path('word/<slug:word>', read_views.view_word, name='word'),
+	path('source/<int:id>', read_views.view_source, name='source'),
+	path('speaker/<int:id>', read_views.view_speaker, name='speaker'),
+	# read-only JSON API (see api.py)
+	path('api/utterances', api.utterances, name='api_utterances'),
+	path('api/utterances/batch', api.utterance_batch, name='api_utterance_batch'),
+	path('api/words', api.words, name='api_words'),
+	path('api/words/batch', api.word_batch, name='api_word_batch'),
+	path('api/sources', api.sources, name='api_sources'),
+	path('api/sources/batch', api.source_batch, name='api_source_batch'),
+	path('api/speakers', api.speakers, name='api_speakers'),
+	path('api/speakers/batch', api.speaker_batch, name='api_speaker_batch'),
 ]
 
 if views.SUBMISSIONS_OPEN:
@@ -0,0 +1,146 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Word
+from .tokenizer import normalize
+
+# transitive closure of the word variant relations, stored as connected component ids on Word
+# Word.same_word_group: connected component of variants_same_word and of words with the same normalized form (e.g. "ya" and "yaaaa")
+# Word.grammatical_group: connected component of those and variants_grammatical together
+# (so if wordA's variants_same_word includes wordB and variants_grammatical includes wordC, then wordB and wordC share a grammatical_group)
+# the id of a component is its alphabetically first word, so a component keeps its id unless that word leaves it
+
+### CONSTANTS ###
+
+SAME_WORD_VARIANTS = Word.variants_same_word.through # from_word_id, to_word_id (symmetrical, so both directions are stored)
+GRAMMATICAL_VARIANTS = Word.variants_grammatical.through # from_word_id, to_word_id (symmetrical, so both directions are stored)
+
+
+### FUNCTIONS ###
+
+# words is an iterable of (word, normalized form); same_word_pairs and grammatical_pairs are iterables of (word, word)
+# returns { word: (same_word_group, grammatical_group) }
+# no database access
+def compute_groups(words, same_word_pairs, grammatical_pairs):
+	# union-find
+	def find(parents, word):
+		root = word
+		while parents[root] != root:
+			root = parents[root]
+		while parents[word] != root: # path compression
+			(parents[word], word) = (root, parents[word])
+		return root
+
+	def union(parents, word_a, word_b):
+		root_a = find(parents, word_a)
+		root_b = find(parents, word_b)
+		if root_a != root_b:
+			# keep the alphabetically first word as the root
+			if root_b < root_a:
+				(root_a, root_b) = (root_b, root_a)
+			parents[root_b] = root_a
+
+	words = list(words)
+	same_word_parents = { word: word for (word, normalized) in words }
+	grammatical_parents = dict(same_word_parents)
+	# words with the same normalized form are the same word
+	first_with_form = {}
+	for (word, normalized) in words:
+		first_word = first_with_form.setdefault(normalized or word, word)
+		union(same_word_parents, word, first_word)
+		union(grammatical_parents, word, first_word)
+	for (word_a, word_b) in same_word_pairs:
+		union(same_word_parents, word_a, word_b)
+		union(grammatical_parents, word_a, word_b)
+	for (word_a, word_b) in grammatical_pairs:
+		union(grammatical_parents, word_a, word_b)
+	return {
+		word: (find(same_word_parents, word), find(grammatical_parents, word))
+		for word in same_word_parents
+	}
+
+# save only the groups that changed; update() so that no history is recorded for derived fields
+def save_groups(groups, word_model=Word):
+	current = word_model.objects.filter(word__in=list(groups)).values_list('word', 'same_word_group', 'grammatical_group')
+	changed = {}
+	for (word, same_word_group, grammatical_group) in current:
+		if (same_word_group, grammatical_group) != groups[word]:
+			changed.setdefault(groups[word], []).append(word)
+	for ((same_word_group, grammatical_group), words) in changed.items():
+		word_model.objects.filter(word__in=words).update(same_word_group=same_word_group, grammatical_group=grammatical_group)
+	return sum(len(words) for words in changed.values())
+
+# recompute every group; returns the number of words whose groups changed
+def rebuild_all():
+	with transaction.atomic():
+		groups = compute_groups(
+			Word.objects.values_list('word', 'normalized'),
+			SAME_WORD_VARIANTS.objects.values_list('from_word_id', 'to_word_id'),
+			GRAMMATICAL_VARIANTS.objects.values_list('from_word_id', 'to_word_id'),
+		)
+		return save_groups(groups)
+
+# recompute only the components that contain any of words
+# (if an edge was removed, the old component is split between the components of its two ends)
+def refresh_components(words):
+	component = set(words)
+	frontier = set(words)
+	same_word_pairs = set()
+	grammatical_pairs = set()
+	normalized_forms = {}
+	# breadth-first search, one query per relation per step
+	while frontier:
+		found = set()
+		# words with the same normalized form
+		frontier_forms = set(normalize(word) for word in frontier)
+		for (word, normalized) in Word.objects.filter(normalized__in=frontier_forms).values_list('word', 'normalized'):
+			normalized_forms[word] = normalized
+			found.add(word)
+		for (through, pairs) in [(SAME_WORD_VARIANTS, same_word_pairs), (GRAMMATICAL_VARIANTS, grammatical_pairs)]:
+			for (from_word, to_word) in through.objects.filter(from_word_id__in=frontier).values_list('from_word_id', 'to_word_id'):
+				pairs.add((from_word, to_word))
+				found.add(to_word)
+		frontier = found - component
+		component |= found
+	existing = Word.objects.filter(word__in=component).values_list('word', 'normalized')
+	return save_groups(compute_groups(existing, same_word_pairs, grammatical_pairs))
+
+
+### SIGNALS ###
+
+# a new word is in a component by itself until post_save finds its other forms
+@receiver(pre_save, sender=Word)
+def set_derived_fields(sender, instance, **kwargs):
+	instance.normalized = normalize(instance.word)
+	if not instance.same_word_group:
+		instance.same_word_group = instance.word
+	if not instance.grammatical_group:
+		instance.grammatical_group = instance.word
+
+@receiver(post_save, sender=Word)
+def word_saved(sender, instance, created, **kwargs):
+	if created:
+		refresh_components([instance.word])
+
+@receiver(m2m_changed, sender=SAME_WORD_VARIANTS)
+@receiver(m2m_changed, sender=GRAMMATICAL_VARIANTS)
+def variants_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+	if action == "pre_clear":
+		# the cleared words are not known after clearing
+		instance._cleared_variants = set(sender.objects.filter(from_word_id=instance.pk).values_list('to_word_id', flat=True))
+	elif action in ("post_add", "post_remove", "post_clear"):
+		affected = { instance.pk }
+		affected |= set(pk_set or [])
+		affected |= instance.__dict__.pop('_cleared_variants', set())
+		refresh_components(affected)
+
+@receiver(pre_delete, sender=Word)
+def remember_variants(sender, instance, **kwargs):
+	instance._deleted_variants = set(SAME_WORD_VARIANTS.objects.filter(from_word_id=instance.pk).values_list('to_word_id', flat=True))
+	instance._deleted_variants |= set(GRAMMATICAL_VARIANTS.objects.filter(from_word_id=instance.pk).values_list('to_word_id', flat=True))
+
+@receiver(post_delete, sender=Word)
+def word_deleted(sender, instance, **kwargs):
+	affected = instance.__dict__.pop('_deleted_variants', set())
+	if affected:
+		refresh_components(affected)
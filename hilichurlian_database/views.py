@@ -1,15 +1,24 @@
 from email import message
+from django.db import transaction
 from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, redirect
-from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib import messages
 from django.forms import modelform_factory
 from .models import Speaker, Source, Word, CompleteUtterance
+from .search import SearchCriteria, compile_search, table_utterances
+from .caching import cached_search, cached_fragment, rendered_rows, public_data_condition
+from .pagination import get_paginator, requested_page
+from .routers import use_primary_database
+from . import export
+from . import ingest
 from .templatetags import describe_url
-import re
 
 import os
 from dotenv import load_dotenv
+from urllib.parse import urlencode
 
 
 ### FORM CLASSES ###
@@ -19,6 +28,13 @@ SpeakerForm = modelform_factory(Speaker, fields=Speaker.FORM_FIELDS)
 
 ### GLOBAL CONSTANTS ###
 DEFAULT_PAGE_SIZE = 10
+# the fields shown on each kind of entry page, in order
+ENTRY_FIELDS = {
+	"utterance": ["utterance", "words", "speaker", "translation", "translation_source", "context", "source"],
+	"word": ["word", "variants_same_word", "variants_grammatical"],
+	"source": ["name", "url", "version", "related_sources"],
+	"speaker": ["name", "type"],
+}
 
 load_dotenv()
 SUBMISSIONS_OPEN = (os.environ.get('SUBMISSIONS_OPEN', 'False') == 'True')
@@ -46,7 +62,9 @@ def remove_duplicates(may_have_duplicates):
 	# keep order
 	return list(dict.fromkeys(may_have_duplicates))
 
-def generate_message(request, message_type, relevant_values):
+# returns a search message for the template (search-fields.html) instead of adding it to django.contrib.messages,
+# so that searching never reads or writes the session and the pages stay the same for everyone (and cacheable)
+def generate_message(message_type, relevant_values):
 	level_tag = messages.INFO
 	extra_tags = ""
 	message_text = ""
@@ -75,59 +93,87 @@ def generate_message(request, message_type, relevant_values):
 	elif message_type == "no valid criteria": # either empty or all invalid
 		level_tag = messages.ERROR
 		extra_tags = "searched"
-		message_text = "Nothing found. Please enter a word, speaker, or source to search."
-	messages.add_message(request, level_tag, message_text, extra_tags=extra_tags)
-	return
+		message_text = "Nothing found. Please enter a word, speaker, source, or English text to search."
+	return {
+		'type': message_type,
+		'level': messages.DEFAULT_TAGS[level_tag],
+		'tags': extra_tags + " " + messages.DEFAULT_TAGS[level_tag], # same classes as django.contrib.messages
+		'text': message_text,
+		'values': relevant_values,
+	}
+
+# the messages about a search in filter(); search_values are the criteria that are in the database
+def report_search(search_values, has_results, new_search):
+	if not search_values:
+		if new_search:
+			return [generate_message("no valid criteria", search_values)]
+	elif not has_results:
+		if new_search:
+			return [generate_message("no results", search_values)]
+	elif new_search:
+		return [generate_message("successful new search", search_values)]
+	else:
+		return [generate_message("showing existing results", search_values)]
+	return []
 
 # return the context object for the pages when browsing the database
-def database_public_view_context(paginator, page_num, page_size, words="", similar = "", speaker="", source="", message_types={}):
-	existing_criteria = "pageSize=" + str(page_size)
-	if words:
-		existing_criteria = existing_criteria + "&words=" + words
-	if similar:
-		existing_criteria = existing_criteria + "&similar=" + similar
-	if speaker:
-		existing_criteria = existing_criteria + "&speaker=" + speaker
-	if source:
-		existing_criteria = existing_criteria + "&source=" + source
+# paginator is from pagination.get_paginator(); page_num is from pagination.requested_page()
+# search is the CompiledSearch of the page, if it is a search; its criteria that exist are kept in the page links
+# db_page is the page if it has already been fetched (by the async views)
+def database_public_view_context(paginator, page_num, page_size, search=None, search_messages=None, db_page=None):
+	# every criterion, so that the page size form keeps the page a search (see elements/table.html)
+	criteria = dict.fromkeys(['words', 'similar', 'speaker', 'source', 'text', 'speakerLike', 'sourceLike'], "")
+	if search is not None:
+		criteria.update({
+			'words': search.words_as_string,
+			'similar': search.similar,
+			'speaker': search.speaker,
+			'source': search.source,
+			'text': search.text,
+			'speakerLike': search.speaker_like,
+			'sourceLike': search.source_like,
+		})
+	# encoded, so that free text with "&", "#", "+" or "%" stays the same criteria in the page and export links
+	existing_criteria = urlencode([("pageSize", page_size)] + [ (name, value) for (name, value) in criteria.items() if value ])
+	if db_page is None:
+		db_page = paginator.get_page(page_num)
+	if getattr(paginator, 'is_keyset', False):
+		page_range = []
+	else:
+		page_range = list(paginator.get_elided_page_range(db_page.number, on_each_side=2, on_ends=3))
 	return {
-		'db_page': paginator.get_page(page_num),
-		'page_range': paginator.get_elided_page_range(page_num, on_each_side=2, on_ends=3),
-		'page_range2': paginator.get_elided_page_range(page_num, on_each_side=2, on_ends=3),
+		'db_page': db_page,
+		'rows': rendered_rows(db_page),
+		'page_range': page_range,
+		'page_range2': page_range,
+		'keyset': getattr(paginator, 'is_keyset', False),
+		'approximate_total': getattr(paginator, 'approximate_count', None),
 		'page_size': page_size,
-		'criteria': {
-			'words': words,
-			'similar': similar,
-			'speaker': speaker,
-			'source': source,
-		},
+		'criteria': criteria,
 		'existing': existing_criteria,
-		'message_types': message_types,
+		'search_messages': search_messages or [],
 	}
 
 
 ### VIEWS FOR POST ###
 
 # submit_type is the "name" in the form object in data_entry() (the /submit page)
+@use_primary_database
 def add_data(request, submit_type):
 	if SUBMISSIONS_OPEN and (request.method == 'POST') and submit_type:
 		data = request.POST
 		new_entry = submit_type
 		if submit_type == "utterance":
-			new_entry = CompleteUtterance()
-			for label, value in data.items():
-				if label in new_entry.SPECIALLY_HANDLED: # find existing ForeignKeys
-					(object_for_field, created) = get_model_class(label).objects.get_or_create(id=value)
-					setattr(new_entry, label, object_for_field)
-				elif label in new_entry.FORM_FIELDS: # valid fields only!
-					setattr(new_entry, label, value)
-			new_entry.save() # save now for Word ManyToMany
-			# get list of words; luckily, simple because no punctuation within words (yet)
-			utterance_words = re.findall(r'\w+', data['utterance'].lower())
-			for utt_word in utterance_words:
-				(word_in_db, created) = Word.objects.get_or_create(word=utt_word)
-				new_entry.words.add(word_in_db)
-			new_entry.save()
+			with transaction.atomic():
+				new_entry = CompleteUtterance()
+				for label, value in data.items():
+					if label in new_entry.SPECIALLY_HANDLED: # find existing ForeignKeys
+						(object_for_field, created) = get_model_class(label).objects.get_or_create(id=value)
+						setattr(new_entry, label, object_for_field)
+					elif label in new_entry.FORM_FIELDS: # valid fields only!
+						setattr(new_entry, label, value)
+				# saves it and links its words
+				ingest.create_utterance(new_entry)
 		elif submit_type == "source":
 			(source_in_db, created) = Source.objects.get_or_create(
 				url = data['url'],
@@ -162,6 +208,9 @@ def add_data(request, submit_type):
 
 ### VIEWS FOR USERS ###
 
+# public_data_condition: the pages depend only on the public data, so repeat visitors get 304 Not Modified until it changes
+
+@public_data_condition
 def index(request):
 	req = request.GET
 	# initialize parameters
@@ -170,14 +219,14 @@ def index(request):
 	page_size = req.get('pageSize', DEFAULT_PAGE_SIZE)
 	if int(page_size) < 1:
 		page_size = 1
-	if int(page) > 1:
+	if int(page) > 1 or req.get('cursor'):
 		# go away, big home page blurb
 		render_page = "hilichurlian_database/results.html"
-	paging = Paginator(CompleteUtterance.objects.order_by('source', 'id'), page_size)
+	paging = get_paginator(table_utterances().order_by('source', 'id'), page_size, req)
 	return render(
 		request,
 		render_page,
-		database_public_view_context(paging, page, page_size)
+		database_public_view_context(paging, requested_page(paging, req), page_size)
 	)
 
 # general
@@ -185,142 +234,128 @@ def view_entry(request, entry_queryset, entry_type, order=[]):
 	render_page = "hilichurlian_database/entry.html"
 
 	context = {"type": entry_type}
-	if entry_queryset.exists():
-		context["entry"] = entry_queryset.get()
-		context["entry_values"] = context["entry"].get_fields_as_dict(order)
+	# one query for the entry and its ForeignKeys, plus one per ManyToManyField
+	entry = entry_queryset.model.with_related(entry_queryset, order).first()
+	if entry:
+		context["entry"] = entry
+		context["entry_values"] = entry.get_fields_as_dict(order)
 
 	return render(request, render_page, context)
 
+@public_data_condition
 def view_utterance(request, id):
-	return view_entry(request, CompleteUtterance.objects.filter(id=id), "utterance", ["utterance", "words", "speaker", "translation", "translation_source", "context", "source"])
+	return view_entry(request, CompleteUtterance.objects.filter(id=id), "utterance", ENTRY_FIELDS["utterance"])
 
+@public_data_condition
 def view_word(request, word):
-	return view_entry(request, Word.objects.filter(pk=word), "word", ["word", "variants_same_word", "variants_grammatical"])
+	return view_entry(request, Word.objects.filter(pk=word), "word", ENTRY_FIELDS["word"])
 
+@public_data_condition
 def view_source(request, id):
-	return view_entry(request, Source.objects.filter(id=id), "source", ["name", "url", "version", "related_sources"])
+	return view_entry(request, Source.objects.filter(id=id), "source", ENTRY_FIELDS["source"])
 
+@public_data_condition
 def view_speaker(request, id):
-	return view_entry(request, Speaker.objects.filter(id=id), "speaker", ["name", "type"])
+	return view_entry(request, Speaker.objects.filter(id=id), "speaker", ENTRY_FIELDS["speaker"])
 
 # for searching
-# TODO: make this less scary
+@public_data_condition
 def filter(request):
 	req = request.GET
 	# initialize general parameters
-	page = req.get('page', 1)
 	page_size = req.get('pageSize', DEFAULT_PAGE_SIZE)
 	if int(page_size) < 1:
 		page_size = 1
-	# initialize parameters to be updated
-	utterances = CompleteUtterance.objects.all() # results
-	all_variants = {} # word variants
-	not_words = [] # from user's search
-	# initialize search parameters
-	want_grammatical_variants = req.get('similar', "").strip()
-	speaker = req.get('speaker', "").strip()
-	source = req.get('source', "").strip()
 	new_search = req.get('newSearch', "")
-	words_as_string = req.get('words', "").strip()
-	words_list = re.findall(r'\w+', words_as_string.lower()) # like in add_data()
-
-	# TODO: if wordA's variants_same_word includes wordB and variants_grammatical includes wordC, then wordB's variants_grammatical should also include wordC, but that's not enforced in models.py and views.py
-	# get words to be searched for
-	words_list = remove_duplicates(words_list)
-	original_words_list = list(words_list)
-	for word_string in original_words_list:
-		word_query = Word.objects.filter(word=word_string)
-		if not word_query.exists():
-			not_words.append(word_string)
-			words_list.remove(word_string)
-			continue
-		word_object = word_query.get()
-		all_variants[word_string] = word_object.variants_same_word.union(Word.objects.filter(word=word_string)) # Words are currently not variants of themselves
-		if want_grammatical_variants and word_object.variants_grammatical.exists():
-			all_variants[word_string] = all_variants[word_string].union(word_object.variants_grammatical.all())
-	# regenerate words_as_string
-	words_as_string = ""
-	for w in words_list:
-		words_as_string = words_as_string + w + " "
-	words_as_string = words_as_string[:-1]
-	
-	# prepare invalid info about search
-	nonexistent_values = {}
-	if not_words:
-		nonexistent_values["words"] = str(not_words)[1:-1]
-	if speaker and not Speaker.objects.filter(name=speaker).exists():
-		nonexistent_values["speaker"] = speaker
-		speaker = ""
-	if source and not Source.objects.filter(url=source).exists():
-		nonexistent_values["source"] = source
-		source = ""
-	if nonexistent_values:
-		generate_message(request, "invalid criteria found", nonexistent_values)
-
-	# get utterances within search_set that match speaker and source
-	if speaker:
-		utterances = utterances.filter(speaker__name=speaker)
-	if source:
-		utterances = utterances.filter(source__url=source)
-	# now that the set is smaller, get utterances that have all of the words
-	# TODO: handle case where grammatical variations are specifically specified (e.g. user enters "mi mimi") so that anything the user enters is required
-	for w in words_list:
-		all_word_utters = CompleteUtterance.objects.filter(words__in=(all_variants[w]))
-		utterances = utterances.intersection(all_word_utters)
-		if not utterances.exists():
-			break
-	
-	# prepare valid info about search
-	search_values = {}
-	if words_list:
-		search_values["words"] = str(words_list)[1:-1]
-	if speaker:
-		search_values["speaker"] = speaker
-	if source:
-		search_values["source"] = source
+
+	# from the search cache, or one query to find which criteria are not in the database
+	# plus one grouped query (or the in-memory index) for the utterances
+	(search, ordered_utterances) = cached_search(SearchCriteria.from_querydict(req))
+	search_messages = []
+	if search.nonexistent_values:
+		search_messages.append(generate_message("invalid criteria found", search.nonexistent_values))
+
+	search_values = search.search_values
+	has_results = False
+	if search_values:
+		paging = get_paginator(ordered_utterances, page_size, req)
+		has_results = paging.has_results()
+	if not has_results:
+		# show everything instead
+		paging = get_paginator(table_utterances().order_by('source', 'id'), page_size, req)
 
 	# add message with info about search
-	if not search_values:
-		utterances = CompleteUtterance.objects.all()
-		if new_search:
-			generate_message(request, "no valid criteria", search_values)
-	elif not utterances.exists():
-		utterances = CompleteUtterance.objects.all()
-		if new_search:
-			generate_message(request, "no results", search_values)
-	else: # utterances.exists()
-		if new_search:
-			generate_message(request, "successful new search", search_values)
-		else:
-			generate_message(request, "showing existing results", search_values)
-	
-	paging = Paginator(utterances.order_by('source', 'id'), page_size)
+	search_messages += report_search(search_values, has_results, new_search)
+
 	return render(
 		request,
 		"hilichurlian_database/results.html",
-		database_public_view_context(paging, page, page_size, words_as_string, want_grammatical_variants, speaker, source, {"search_messages": "yes"})
+		database_public_view_context(paging, requested_page(paging, req), page_size, search, search_messages)
+	)
+
+# the /export/<format> pages; same criteria as filter()
+# streamed, so memory use does not depend on the number of utterances
+def export_utterances(request, export_format):
+	if export_format not in export.FORMATS:
+		raise Http404("Unknown export format")
+	criteria = SearchCriteria.from_querydict(request.GET)
+	ordered = None # everything
+	if criteria.has_criteria():
+		search = compile_search(criteria)
+		if search.has_criteria():
+			ordered = search.ordered_utterances()
+		else:
+			ordered = table_utterances().none() # nothing in the database matches
+	(content_type, extension) = export.FORMATS[export_format]
+	response = StreamingHttpResponse(
+		export.export_lines(export_format, export.iter_utterances(ordered)),
+		content_type = content_type
 	)
+	response['Content-Disposition'] = 'attachment; filename="hilichurlian-utterances.' + extension + '"'
+	return response
 
 # the /select page
+# the lists are rendered once per data version (see caching.py), and repeat visitors get 304 Not Modified
+@public_data_condition
 def view_all_criteria(request):
-	sources = Source.objects.order_by('version', 'name')
-	speakers = Speaker.objects.order_by('type', 'name')
-	words = Word.objects.order_by('word')
 	return render(request, "hilichurlian_database/select.html", {
+		'criteria_lists': cached_fragment("select", render_criteria_lists),
+	})
+
+# one query per model, values only, and the speakers grouped here instead of looped over once per type in the template
+def render_criteria_lists():
+	return criteria_lists_html(*criteria_lists())
+
+# (speakers, sources, words)
+def criteria_lists():
+	return (
+		Speaker.objects.order_by('type', 'name').values_list('name', 'type'),
+		Source.objects.order_by('version', 'name').values('name', 'url', 'version'),
+		Word.objects.order_by('word').values_list('word', flat=True),
+	)
+
+def criteria_lists_html(speakers, sources, words):
+	speaker_types = [ # use Speaker.SPEAKER_TYPES when we have unknown
+		("hili", "Hilichurl"),
+		("stud", "Student"),
+	]
+	speakers_by_type = { speaker_type: [] for (speaker_type, label) in speaker_types }
+	for (name, speaker_type) in speakers:
+		if speaker_type in speakers_by_type:
+			speakers_by_type[speaker_type].append(name)
+	return render_to_string("hilichurlian_database/elements/criteria-lists.html", {
+		'filter_url': reverse('hilichurlian_database:filter'),
 		'sources': sources,
-		'speakers': speakers,
+		'speaker_groups': [ ("Other" if label == "Unknown" else label, speakers_by_type[speaker_type]) for (speaker_type, label) in speaker_types ],
 		'words': words,
-		'speaker_types': [ # use Speaker.SPEAKER_TYPES when we have unknown
-			("hili", "Hilichurl"),
-			("stud", "Student"),
-		]
 	})
 
 # the /about page
 def about(request):
 	return render(request, "hilichurlian_database/about.html")
 
-# the /submit page
+# the /submit page; shows the messages from add_data(), so it reads the session from the primary
+@use_primary_database
 def data_entry(request):
 	return render(request, "hilichurlian_database/submit.html", {
 		'forms': get_forms(),
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import time
 import dj_database_url
 from dotenv import load_dotenv
 
@@ -52,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+	'hilichurlian_database.middleware.ServerTimingMiddleware', # first, so that it times everything; off unless SERVER_TIMING
+	'hilichurlian_database.middleware.ReplicaMiddleware', # before anything that reads the database; off unless REPLICA_DATABASE_URLS
 	'django.middleware.security.SecurityMiddleware',
 	'whitenoise.middleware.WhiteNoiseMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
@@ -102,7 +105,89 @@ if IS_LOCAL:
 		}
 	}
 else:
-	DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=True)
+	# SQLite (e.g. manage.py loadtest's scratch database) has no SSL
+	DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=not os.environ.get('DATABASE_URL', '').startswith('sqlite'))
+
+# Read replicas
+# comma-separated database URLs, e.g. REPLICA_DATABASE_URLS=sqlite:///replica.sqlite3 (a copy of DATABASE_URL=sqlite:///db.sqlite3)
+# the public pages read from them; writes, the admin and migrations use the default database (see hilichurlian_database/routers.py)
+REPLICA_DATABASES = []
+for replica_url in os.environ.get('REPLICA_DATABASE_URLS', '').split(','):
+	if replica_url.strip():
+		alias = 'replica_' + str(len(REPLICA_DATABASES) + 1)
+		DATABASES[alias] = dj_database_url.parse(replica_url.strip(), conn_max_age=600, ssl_require=not replica_url.strip().startswith('sqlite'))
+		DATABASES[alias]['TEST'] = { 'MIRROR': 'default' } # tests have one database
+		REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['hilichurlian_database.routers.ReplicaRouter']
+
+if 'postgresql' in DATABASES['default'].get('ENGINE', ''):
+	# trigram lookups for fuzzy speaker and source search (see hilichurlian_database/fulltext.py)
+	INSTALLED_APPS.append('django.contrib.postgres')
+
+
+# Search
+# "orm" searches with SQL; "memory" keeps an inverted index of words in each worker (see search_index.py)
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'orm')
+SEARCH_INDEX_MAX_AGE = int(os.environ.get('SEARCH_INDEX_MAX_AGE', '300')) # seconds
+
+
+# Async views
+# async versions of the public read views, for ASGI servers (asgi.py); keep off under WSGI (see hilichurlian_database/async_views.py)
+ASYNC_VIEWS = (os.environ.get('ASYNC_VIEWS', 'False') == 'True')
+
+
+# Request timing
+# Server-Timing headers and a log line per request (see hilichurlian_database/middleware.py)
+SERVER_TIMING = (os.environ.get('SERVER_TIMING', 'False') == 'True')
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', '500'))
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# the search cache holds the ids of search results; both backends evict the least recently used entries
+# local memory is per worker; use the file-based cache to share it between the workers of one dyno
+# the rows cache holds rendered rows of the results table, keyed by what they show (so never stale); a page can have thousands,
+# so it is separate from the search cache (which they would otherwise evict) and always in local memory (a file per row would be slower than rendering)
+
+SEARCH_CACHE_BACKEND = os.environ.get('SEARCH_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+	'default': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+	},
+	'search': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'search',
+		'TIMEOUT': None, # invalidated by data version instead
+		'OPTIONS': {
+			'MAX_ENTRIES': int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '1000')),
+		},
+	},
+	'rows': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'rows',
+		'TIMEOUT': None,
+		'OPTIONS': {
+			'MAX_ENTRIES': int(os.environ.get('ROW_CACHE_MAX_ENTRIES', '20000')),
+		},
+	},
+}
+
+if SEARCH_CACHE_BACKEND == 'file':
+	CACHES['search']['BACKEND'] = 'hilichurlian_database.cache_backends.LRUFileBasedCache'
+	CACHES['search']['LOCATION'] = os.environ.get('SEARCH_CACHE_LOCATION', '/tmp/hilichurlian_database_search_cache')
+
+# how often each process reads the version of the public data from the database, which invalidates the caches (see hilichurlian_database/caching.py)
+DATA_VERSION_MAX_AGE = int(os.environ.get('DATA_VERSION_MAX_AGE', '2')) # seconds
+
+# identifies the deployed code in the ETags of the public pages (see hilichurlian_database/caching.py),
+# so that clients and CDNs do not get 304 Not Modified for pages rendered by an older release
+# Heroku sets HEROKU_RELEASE_VERSION when the dyno metadata feature is on; otherwise the time the settings were loaded
+# (the same for every worker with gunicorn --preload; different otherwise, which costs revalidations, never stale pages)
+RELEASE_ID = os.environ.get('RELEASE_ID', os.environ.get('HEROKU_RELEASE_VERSION', str(int(time.time()))))
+
+# how long a CDN or reverse proxy may keep the public pages before revalidating them (see hilichurlian_database/caching.py)
+PUBLIC_CACHE_MAX_AGE = int(os.environ.get('PUBLIC_CACHE_MAX_AGE', '0')) # seconds
 
 
 # Password validation
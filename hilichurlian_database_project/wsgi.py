@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hilichurlian_database_project.settings')
 
 application = get_wsgi_application()
+
+# build the in-memory search index (if enabled) once, before the workers fork
+from hilichurlian_database import search_index
+search_index.warm_up()